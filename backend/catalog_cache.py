@@ -0,0 +1,137 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class LRUCache:
+    """Bounded LRU map whose entries also expire after ttl_seconds."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class CatalogCache:
+    """Read-through cache for medicine documents and catalog pages.
+
+    Pages only store the ids they contain, so they stay valid across stock and
+    price changes and are dropped only when medicines are created or deleted.
+    Document entries are replaced by the write routes. Only the
+    given fields are kept, so cached documents can be served as they are.
+    """
+
+    def __init__(
+        self,
+        collection,
+        fields: Iterable[str],
+        max_entries: int = 50000,
+        max_pages: int = 1000,
+        ttl_seconds: float = 30,
+    ):
+        self.collection = collection
+        self.fields = list(fields)
+        self.projection = {"_id": 0, **{field: 1 for field in self.fields}}
+        self.documents = LRUCache(max_entries, ttl_seconds)
+        self.pages = LRUCache(max_pages, ttl_seconds)
+
+    async def get(self, medicine_id: str) -> Optional[Dict[str, Any]]:
+        doc = self.documents.get(medicine_id)
+        if doc is None:
+            doc = await self.collection.find_one({"id": medicine_id}, self.projection)
+            if doc is not None:
+                self.documents.set(medicine_id, doc)
+        return doc
+
+    async def get_many(self, medicine_ids: List[str]) -> List[Dict[str, Any]]:
+        """Documents for the given ids in the same order, skipping ids that no longer exist."""
+        found = {}
+        missing = []
+        for medicine_id in medicine_ids:
+            doc = self.documents.get(medicine_id)
+            if doc is None:
+                missing.append(medicine_id)
+            else:
+                found[medicine_id] = doc
+        if missing:
+            async for doc in self.collection.find({"id": {"$in": missing}}, self.projection):
+                self.documents.set(doc["id"], doc)
+                found[doc["id"]] = doc
+        return [found[medicine_id] for medicine_id in medicine_ids if medicine_id in found]
+
+    async def page(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Tuple[List[Dict[str, Any]], Optional[str]]]],
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        cached = self.pages.get(key)
+        if cached is not None:
+            ids, next_cursor = cached
+            return await self.get_many(ids), next_cursor
+        docs, next_cursor = await loader()
+        for doc in docs:
+            self.put(doc)
+        self.pages.set(key, ([doc["id"] for doc in docs], next_cursor))
+        return docs, next_cursor
+
+    def _trim(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        return {field: doc[field] for field in self.fields if field in doc}
+
+    def put(self, doc: Dict[str, Any]):
+        self.documents.set(doc["id"], self._trim(doc))
+
+    def remove(self, medicine_id: str):
+        self.documents.pop(medicine_id)
+        self.pages.clear()
+
+    def invalidate_pages(self):
+        self.pages.clear()
+
+    def clear(self):
+        self.documents.clear()
+        self.pages.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"documents": self.documents.stats(), "pages": self.pages.stats()}
@@ -0,0 +1,61 @@
+import hashlib
+import uuid
+from typing import Dict, Optional, Union
+
+from pymongo import UpdateOne
+
+
+def quote_etag(value: str) -> str:
+    return f'"{value}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires."""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def digest(value: Union[str, bytes]) -> str:
+    if isinstance(value, str):
+        value = value.encode()
+    return hashlib.blake2b(value, digest_size=8).hexdigest()
+
+
+class CollectionVersions:
+    """Per-collection change counters used to build ETags.
+
+    Every write route bumps the counters of the collections it touches. The
+    epoch is generated when a counter document is first created so ETags from
+    a wiped or restored database never collide with older ones.
+    """
+
+    def __init__(self, db, collection_name: str = "collection_versions"):
+        self.collection = db[collection_name]
+
+    async def bump(self, *names: str):
+        await self.collection.bulk_write([
+            UpdateOne(
+                {"_id": name},
+                {"$inc": {"version": 1}, "$setOnInsert": {"epoch": uuid.uuid4().hex[:8]}},
+                upsert=True,
+            )
+            for name in names
+        ], ordered=False)
+
+    async def get(self, *names: str) -> Dict[str, str]:
+        docs = {
+            doc["_id"]: f"{doc.get('epoch', '0')}.{doc.get('version', 0)}"
+            async for doc in self.collection.find({"_id": {"$in": list(names)}})
+        }
+        return {name: docs.get(name, "0.0") for name in names}
+
+    async def etag(self, *names: str, key: str = "") -> str:
+        """Strong ETag for a representation built from the given collections."""
+        versions = await self.get(*names)
+        tag = "-".join(f"{name}.{versions[name]}" for name in names)
+        return quote_etag(f"{tag}-{digest(key)}" if key else tag)
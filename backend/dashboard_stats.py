@@ -0,0 +1,150 @@
+import logging
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+OVERALL_KEY = "overall"
+
+
+def day_key(day: date) -> str:
+    return f"day:{day.isoformat()}"
+
+
+def medicine_counters(medicine: Optional[Dict[str, Any]], as_of: datetime) -> Dict[str, int]:
+    """Contribution of a single medicine document to the overall counters, with expiry judged at as_of."""
+    if medicine is None:
+        return {"total_medicines": 0, "low_stock_count": 0, "expired_medicines_count": 0}
+    # Lots are sorted by expiry, so the first one decides whether any stock has expired
+    lots = medicine.get("lots")
+    expiry_date = (lots[0]["expiry_date"] if lots else None) if lots is not None else medicine.get("expiry_date")
+    return {
+        "total_medicines": 1,
+        "low_stock_count": int(medicine["stock_quantity"] <= medicine["min_stock_level"]),
+        "expired_medicines_count": int(expiry_date is not None and expiry_date <= as_of),
+    }
+
+
+class DashboardStats:
+    """Materialized dashboard counters.
+
+    One `overall` document holds catalog counters and one `day:<date>`
+    document per day holds sales counters. Write routes apply `$inc` deltas;
+    `reconcile` recomputes everything from the source collections.
+
+    Stock expires without any write, so the expired count is kept as of the
+    `expired_through` mark on the overall document: write deltas judge expiry
+    at the mark, and `record_expirations` moves it forward, counting the
+    medicines whose stock expired in between. A medicine that expired after
+    its last write is then never taken off the count before it was added.
+    """
+
+    def __init__(self, db, sales, collection_name: str = "dashboard_stats"):
+        self.db = db
+        self.sales = sales
+        self.collection = db[collection_name]
+
+    async def _apply(self, key: str, deltas: Dict[str, float]):
+        deltas = {field: value for field, value in deltas.items() if value}
+        if not deltas:
+            return
+        await self.collection.update_one(
+            {"_id": key},
+            {"$inc": deltas, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True,
+        )
+
+    async def record_medicine_change(self, before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]):
+        """Apply the counter delta between two versions of a medicine (None = absent)."""
+        await self.record_medicine_changes([(before, after)])
+
+    async def record_medicine_changes(self, changes: List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]):
+        """Apply the summed counter deltas of several (before, after) pairs in one write."""
+        as_of = await self.expired_through()
+        deltas: Dict[str, float] = {}
+        for before, after in changes:
+            old = medicine_counters(before, as_of)
+            new = medicine_counters(after, as_of)
+            for field in new:
+                deltas[field] = deltas.get(field, 0) + new[field] - old[field]
+        await self._apply(OVERALL_KEY, deltas)
+
+    async def expired_through(self) -> datetime:
+        """The moment the expired count is kept as of; now until the first reconcile."""
+        overall = await self.collection.find_one({"_id": OVERALL_KEY}, {"expired_through": 1})
+        return (overall or {}).get("expired_through") or datetime.utcnow()
+
+    async def record_expirations(self) -> int:
+        """Move the expired_through mark to now and count the medicines whose stock expired in between.
+
+        Only the worker whose conditional update moves the mark counts the
+        window, so every worker can run this without counting twice. Writes
+        racing the move are settled by the next reconcile.
+        """
+        now = datetime.utcnow()
+        since = await self.expired_through()
+        if since >= now:
+            return 0
+        moved = await self.collection.update_one(
+            {"_id": OVERALL_KEY, "expired_through": since}, {"$set": {"expired_through": now}}
+        )
+        if not moved.modified_count:
+            return 0
+        window = {"$gt": since, "$lte": now}
+        # Lots are sorted by expiry, so only medicines whose first lot expired in the window are newly expired
+        counted = await self.db.medicines.aggregate([
+            {"$match": {"lots.expiry_date": window, "lots.0.expiry_date": window}},
+            {"$count": "expired"},
+        ]).to_list(1)
+        expired = counted[0]["expired"] if counted else 0
+        await self._apply(OVERALL_KEY, {"expired_medicines_count": expired})
+        return expired
+
+    async def record_sales(self, sales: List[Dict[str, Any]]):
+        days: Dict[str, Dict[str, float]] = {}
+        for sale in sales:
+            deltas = days.setdefault(day_key(sale["sale_date"].date()), {"sales_count": 0, "revenue": 0})
+            deltas["sales_count"] += 1
+            deltas["revenue"] += sale["total_amount"]
+        for key, deltas in days.items():
+            await self._apply(key, deltas)
+
+    async def read(self, day: Optional[date] = None) -> Dict[str, Any]:
+        day = day or datetime.utcnow().date()
+        docs = {
+            doc["_id"]: doc
+            async for doc in self.collection.find({"_id": {"$in": [OVERALL_KEY, day_key(day)]}})
+        }
+        overall = docs.get(OVERALL_KEY, {})
+        today = docs.get(day_key(day), {})
+        return {
+            "total_medicines": overall.get("total_medicines", 0),
+            "low_stock_count": overall.get("low_stock_count", 0),
+            "today_sales_count": today.get("sales_count", 0),
+            "today_revenue": today.get("revenue", 0),
+            "expired_medicines_count": overall.get("expired_medicines_count", 0),
+        }
+
+    async def reconcile(self, day: Optional[date] = None):
+        """Recompute the overall counters and the given day's sales from source data."""
+        now = datetime.utcnow()
+        day = day or now.date()
+        overall = {
+            "total_medicines": await self.db.medicines.count_documents({}),
+            "low_stock_count": await self.db.medicines.count_documents({"is_low_stock": True}),
+            "expired_medicines_count": await self.db.medicines.count_documents({"lots.expiry_date": {"$lte": now}}),
+            "expired_through": now,
+            "updated_at": now,
+        }
+        start = datetime.combine(day, datetime.min.time())
+        totals = await self.sales.aggregate(start, start + timedelta(days=1), [
+            {"$group": {"_id": None, "sales_count": {"$sum": 1}, "revenue": {"$sum": "$total_amount"}}},
+        ])
+        daily = {
+            "sales_count": totals[0]["sales_count"] if totals else 0,
+            "revenue": totals[0]["revenue"] if totals else 0,
+            "updated_at": now,
+        }
+        await self.collection.update_one({"_id": OVERALL_KEY}, {"$set": overall}, upsert=True)
+        await self.collection.update_one({"_id": day_key(day)}, {"$set": daily}, upsert=True)
+        logger.info("Dashboard stats reconciled: %s", {**overall, **daily})
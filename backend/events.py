@@ -0,0 +1,215 @@
+import asyncio
+import itertools
+import logging
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Set, Tuple
+
+import orjson
+
+from sales_partitions import PARTITION_PATTERN, is_partition
+
+logger = logging.getLogger(__name__)
+
+# (id, type, data); ids are "<epoch>:<sequence>" so ids from an earlier process never match
+Event = Tuple[str, str, Dict[str, Any]]
+
+RESYNC = "resync"
+
+
+def format_sse(event: Event) -> bytes:
+    event_id, event_type, data = event
+    return b"id: %s\nevent: %s\ndata: %s\n\n" % (event_id.encode(), event_type.encode(), orjson.dumps(data))
+
+
+class EventBus:
+    """In-process fan-out of change events to push subscribers.
+
+    Every subscriber gets a bounded queue. Publishing never waits: a
+    subscriber whose queue is full is dropped and sent a `resync` event,
+    telling the client to reload over REST. Recent events are kept so a
+    client reconnecting with Last-Event-ID replays what it missed.
+    """
+
+    def __init__(self, history: int = 1000, queue_size: int = 256):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.queue_size = queue_size
+        self._sequence = itertools.count(1)
+        self._last_sequence = 0
+        self._history: Deque[Tuple[int, Event]] = deque(maxlen=history)
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, event_type: str, data: Dict[str, Any]):
+        sequence = self._last_sequence = next(self._sequence)
+        event = (f"{self.epoch}:{sequence}", event_type, data)
+        self._history.append((sequence, event))
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._subscribers.discard(queue)
+                self._resync(queue)
+
+    def _resync(self, queue: asyncio.Queue):
+        while not queue.empty():
+            queue.get_nowait()
+        # Carries the latest id, so the client's reconnect resumes from the state it reloads
+        queue.put_nowait((f"{self.epoch}:{self._last_sequence}", RESYNC, {}))
+
+    def _missed(self, last_event_id: str) -> Optional[List[Event]]:
+        """Events after last_event_id, or None if they are no longer all in the history."""
+        epoch, _, sequence = last_event_id.partition(":")
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        if self._history and self._history[0][0] > sequence + 1:
+            return None
+        return [event for event_sequence, event in self._history if event_sequence > sequence]
+
+    def subscribe(self, last_event_id: Optional[str] = None) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        if last_event_id:
+            missed = self._missed(last_event_id)
+            if missed is None or len(missed) >= self.queue_size:
+                self._resync(queue)
+                return queue
+            for event in missed:
+                queue.put_nowait(event)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    async def stream(self, last_event_id: Optional[str] = None, heartbeat: float = 15) -> AsyncIterator[bytes]:
+        """Server-sent events for one client, with comment lines to keep idle connections open."""
+        queue = self.subscribe(last_event_id)
+        try:
+            # Clients wait this long before reconnecting
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                yield format_sse(event)
+                if event[1] == RESYNC:
+                    return
+        finally:
+            self.unsubscribe(queue)
+
+
+def is_expired(medicine: Optional[Dict[str, Any]], now: datetime) -> bool:
+    if not medicine:
+        return False
+    lots = medicine.get("lots")
+    expiry_date = (lots[0]["expiry_date"] if lots else None) if lots is not None else medicine.get("expiry_date")
+    return expiry_date is not None and expiry_date <= now
+
+
+def stock_alerts(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> List[Tuple[str, Dict[str, Any]]]:
+    """Alerts for a medicine write: crossing min_stock_level in either direction, or holding expired stock."""
+    if after is None:
+        return []
+    summary = {
+        "id": after["id"],
+        "name": after.get("name"),
+        "stock_quantity": after["stock_quantity"],
+        "min_stock_level": after["min_stock_level"],
+    }
+    alerts = []
+    was_low = before is not None and before["stock_quantity"] <= before["min_stock_level"]
+    is_low = after["stock_quantity"] <= after["min_stock_level"]
+    if is_low and not was_low:
+        alerts.append(("low_stock", summary))
+    elif was_low and not is_low:
+        alerts.append(("stock_restored", summary))
+    now = datetime.utcnow()
+    if is_expired(after, now) and not is_expired(before, now):
+        alerts.append(("expired", {**summary, "expiry_date": after.get("expiry_date")}))
+    return alerts
+
+
+class ExpiryWatcher:
+    """Publishes `lot_expired` for lots whose expiry passed since the previous check.
+
+    Writes already report stock that is expired when written; this catches
+    lots that expire while nobody touches the medicine.
+    """
+
+    def __init__(self, db, bus: EventBus):
+        self.db = db
+        self.bus = bus
+        self.checked_until = datetime.utcnow()
+
+    async def check(self):
+        now = datetime.utcnow()
+        window = {"$gt": self.checked_until, "$lte": now}
+        async for lot in self.db.medicines.aggregate([
+            {"$match": {"lots.expiry_date": window}},
+            {"$unwind": "$lots"},
+            {"$match": {"lots.expiry_date": window}},
+            {"$project": {
+                "_id": 0,
+                "id": 1,
+                "name": 1,
+                "lot_id": "$lots.lot_id",
+                "batch_number": "$lots.batch_number",
+                "expiry_date": "$lots.expiry_date",
+                "quantity": "$lots.quantity",
+            }},
+        ]):
+            self.bus.publish("lot_expired", lot)
+        self.checked_until = now
+
+
+class ChangeStreamRelay:
+    """Feed the bus from MongoDB change streams instead of the local write routes.
+
+    With several workers each one has its own bus, so a client only hears
+    about writes served by its own worker. The relay sees every worker's
+    writes. It needs a replica set. Medicine alerts come from the
+    is_low_stock changes the stream reports. Deletes are not relayed,
+    because without pre-images the stream only carries the _id.
+    """
+
+    def __init__(self, db, bus: EventBus, read_stats):
+        self.db = db
+        self.bus = bus
+        self.read_stats = read_stats
+
+    async def run(self):
+        pipeline = [{"$match": {
+            "$or": [
+                {"ns.coll": {"$in": ["medicines", "dashboard_stats"]}},
+                {"ns.coll": {"$regex": PARTITION_PATTERN}},
+            ],
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]},
+        }}]
+        async with self.db.watch(pipeline, full_document="updateLookup") as stream:
+            async for change in stream:
+                await self._relay(change)
+
+    async def _relay(self, change: Dict[str, Any]):
+        collection = change["ns"]["coll"]
+        document = change.get("fullDocument") or {}
+        document.pop("_id", None)
+        if collection == "dashboard_stats":
+            self.bus.publish("stats", await self.read_stats())
+        elif is_partition(collection) and change["operationType"] == "insert":
+            self.bus.publish("sale", document)
+        elif collection == "medicines":
+            if change["operationType"] == "delete":
+                return
+            self.bus.publish("medicine", document)
+            updated = (change.get("updateDescription") or {}).get("updatedFields", {})
+            if "is_low_stock" in updated and document:
+                event_type = "low_stock" if updated["is_low_stock"] else "stock_restored"
+                self.bus.publish(event_type, {
+                    field: document.get(field) for field in ("id", "name", "stock_quantity", "min_stock_level")
+                })
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from statistics import NormalDist
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOOKBACK_DAYS = 90
+DEFAULT_HALF_LIFE_DAYS = 14
+
+
+def demand_matrix(
+    rows: List[Dict[str, Any]], ids: pd.Index, start: datetime, days: int
+) -> np.ndarray:
+    """Units sold per medicine (row, in ids order) and day (column) from grouped sales rows."""
+    matrix = np.zeros((len(ids), days))
+    if not rows:
+        return matrix
+    positions = ids.get_indexer([row["_id"]["medicine_id"] for row in rows])
+    # Only ~lookback distinct days: parse each once
+    codes, days_seen = pd.factorize(pd.Index([row["_id"]["day"] for row in rows]))
+    offsets = (pd.to_datetime(days_seen, format="%Y-%m-%d") - pd.Timestamp(start)).days.to_numpy()[codes]
+    units = np.array([row["units"] for row in rows], dtype=float)
+    keep = (positions >= 0) & (offsets >= 0) & (offsets < days)
+    np.add.at(matrix, (positions[keep], offsets[keep]), units[keep])
+    return matrix
+
+
+def demand_rates(matrix: np.ndarray, half_life_days: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Exponentially weighted mean and standard deviation of daily demand, recent days weighing most."""
+    days = matrix.shape[1]
+    weights = 0.5 ** (np.arange(days)[::-1] / half_life_days)
+    weights /= weights.sum()
+    mean = matrix @ weights
+    variance = ((matrix - mean[:, None]) ** 2) @ weights
+    return mean, np.sqrt(variance)
+
+
+def expected_waste(rates: np.ndarray, quantities: np.ndarray, days_to_expiry: np.ndarray) -> np.ndarray:
+    """Units of each lot expected to expire unsold when lots are sold first-expiry-first-out.
+
+    quantities and days_to_expiry are (medicines x lots), padded with zero
+    quantities, each row sorted by expiry. The cumulative units sold from
+    lots 1..k by the time lot k expires is min(sold through k-1 + q_k,
+    rate * t_k), so one pass over lot positions covers the whole catalog.
+    """
+    sold = np.zeros(len(rates))
+    waste = np.zeros_like(quantities, dtype=float)
+    present = quantities > 0
+    horizon = np.where(present, np.clip(days_to_expiry, 0, None), 0)
+    for k in range(quantities.shape[1]):
+        available = sold + quantities[:, k]
+        sold_k = np.where(present[:, k], np.minimum(available, rates * horizon[:, k]), sold)
+        waste[:, k] = available - sold_k
+        sold = sold_k
+    return waste
+
+
+def lot_arrays(lots: List[List[Dict[str, Any]]], now: datetime) -> Tuple[np.ndarray, np.ndarray]:
+    width = max((len(medicine_lots) for medicine_lots in lots), default=0)
+    quantities = np.zeros((len(lots), width))
+    days_to_expiry = np.full((len(lots), width), np.inf)
+    for row, medicine_lots in enumerate(lots):
+        for column, lot in enumerate(medicine_lots):
+            quantities[row, column] = lot["quantity"]
+            days_to_expiry[row, column] = (lot["expiry_date"] - now).total_seconds() / 86400
+    return quantities, days_to_expiry
+
+
+class DemandForecast:
+    """Catalog-wide demand rates, stockout dates and expiry waste from recent sales.
+
+    `refresh` reads the catalog and the sales of the lookback window once and
+    computes everything with array operations; `reorder` and `waste` answer
+    from the last result, so only refresh touches the database.
+    """
+
+    def __init__(self, db, sales, lookback_days: int = DEFAULT_LOOKBACK_DAYS, half_life_days: float = DEFAULT_HALF_LIFE_DAYS):
+        self.db = db
+        self.sales = sales
+        self.lookback_days = lookback_days
+        self.half_life_days = half_life_days
+        self.frame: Optional[pd.DataFrame] = None
+        self.generated_at: Optional[datetime] = None
+
+    async def load(self, now: datetime):
+        medicines = await self.db.medicines.find({}, {
+            "_id": 0, "id": 1, "name": 1, "category": 1, "stock_quantity": 1,
+            "min_stock_level": 1, "purchase_price": 1, "lots.quantity": 1, "lots.expiry_date": 1,
+        }).to_list(None)
+        start = datetime.combine((now - timedelta(days=self.lookback_days)).date(), datetime.min.time())
+        rows = await self.sales.aggregate(start, now, [
+            {"$unwind": "$items"},
+            {"$group": {
+                "_id": {
+                    "medicine_id": "$items.medicine_id",
+                    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$sale_date"}},
+                },
+                "units": {"$sum": "$items.quantity"},
+            }},
+        ])
+        return medicines, rows, start
+
+    def compute(self, medicines: List[Dict[str, Any]], rows: List[Dict[str, Any]], start: datetime, now: datetime) -> pd.DataFrame:
+        frame = pd.DataFrame({
+            "id": [medicine["id"] for medicine in medicines],
+            "name": [medicine.get("name") for medicine in medicines],
+            "category": [medicine.get("category") for medicine in medicines],
+            "stock_quantity": np.array([medicine.get("stock_quantity", 0) for medicine in medicines], dtype=np.int64),
+            "min_stock_level": np.array([medicine.get("min_stock_level", 0) for medicine in medicines], dtype=np.int64),
+            "purchase_price": np.array([medicine.get("purchase_price") or 0.0 for medicine in medicines], dtype=float),
+        })
+        # Today is partial; the window ends with yesterday
+        days = max((now.date() - start.date()).days, 1)
+        rates, deviations = demand_rates(demand_matrix(rows, pd.Index(frame["id"]), start, days), self.half_life_days)
+
+        quantities, days_to_expiry = lot_arrays([medicine.get("lots", []) for medicine in medicines], now)
+        waste = expected_waste(rates, quantities, days_to_expiry)
+        with np.errstate(divide="ignore"):
+            frame["days_until_stockout"] = np.where(rates > 0, frame["stock_quantity"].to_numpy() / rates, np.inf)
+        frame["daily_demand"] = rates
+        frame["demand_std"] = deviations
+        frame["expected_waste_units"] = waste.sum(axis=1)
+        frame["expected_waste_value"] = frame["expected_waste_units"] * frame["purchase_price"]
+        frame["days_to_next_expiry"] = days_to_expiry.min(axis=1, initial=np.inf)
+        return frame
+
+    async def refresh(self):
+        now = datetime.utcnow()
+        started = time.perf_counter()
+        medicines, rows, start = await self.load(now)
+        loaded = time.perf_counter()
+        # Array work releases the GIL for most of its time; keep it off the event loop
+        self.frame = await asyncio.to_thread(self.compute, medicines, rows, start, now)
+        self.generated_at = now
+        logger.info(
+            "Demand forecast for %d medicines from %d medicine-days: loaded in %.2fs, computed in %.2fs",
+            len(self.frame), len(rows), loaded - started, time.perf_counter() - loaded,
+        )
+
+    def reorder(
+        self,
+        lead_time_days: float,
+        review_days: float,
+        service_level: float,
+        limit: int,
+        include_all: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Reorder points and order-up-to quantities, most urgent first.
+
+        Safety stock covers demand variability over the lead time at the
+        given service level; the order quantity tops stock up to cover the
+        lead time plus the review period.
+        """
+        frame = self.frame
+        if frame is None or frame.empty:
+            return []
+        z = NormalDist().inv_cdf(service_level)
+        rates = frame["daily_demand"].to_numpy()
+        safety_stock = z * frame["demand_std"].to_numpy() * np.sqrt(lead_time_days)
+        reorder_point = rates * lead_time_days + safety_stock
+        target = rates * (lead_time_days + review_days) + safety_stock
+        quantity = np.ceil(np.clip(target - frame["stock_quantity"].to_numpy(), 0, None)).astype(np.int64)
+        result = frame.assign(
+            safety_stock=np.round(safety_stock, 2),
+            reorder_point=np.ceil(reorder_point).astype(np.int64),
+            suggested_order_quantity=quantity,
+            below_reorder_point=frame["stock_quantity"].to_numpy() <= reorder_point,
+        )
+        if not include_all:
+            result = result[result["suggested_order_quantity"] > 0]
+        result = result.sort_values(["days_until_stockout", "daily_demand"], ascending=[True, False]).head(limit)
+        return records(result.drop(columns=["expected_waste_units", "expected_waste_value"]))
+
+    def waste(self, limit: int) -> List[Dict[str, Any]]:
+        """Medicines whose lots are expected to expire before they sell, by value at cost."""
+        frame = self.frame
+        if frame is None or frame.empty:
+            return []
+        result = frame[frame["expected_waste_units"] > 0].sort_values("expected_waste_value", ascending=False)
+        return records(result.head(limit))
+
+
+def records(frame: pd.DataFrame) -> List[Dict[str, Any]]:
+    """JSON-ready rows: floats rounded and infinities reported as null."""
+    frame = frame.round(3).astype(object)
+    frame = frame.where(~frame.isin([np.inf, -np.inf]) & frame.notna(), None)
+    return frame.to_dict("records")
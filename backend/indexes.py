@@ -0,0 +1,178 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import PyMongoError
+
+from sales_partitions import is_partition
+
+logger = logging.getLogger(__name__)
+
+
+class IndexSpec(BaseModel):
+    name: str
+    keys: List[Tuple[str, Any]]
+    unique: bool = False
+    sparse: bool = False
+    partial_filter: Optional[Dict[str, Any]] = None
+
+    def to_index_model(self) -> IndexModel:
+        options = {"name": self.name}
+        if self.unique:
+            options["unique"] = True
+        if self.sparse:
+            options["sparse"] = True
+        if self.partial_filter is not None:
+            options["partialFilterExpression"] = self.partial_filter
+        return IndexModel(self.keys, **options)
+
+    def differences(self, info: Dict[str, Any]) -> List[str]:
+        """Compare against an entry of `index_information()` and describe any drift."""
+        drift = []
+        if self.keys[0][1] == TEXT:
+            # Text indexes are reported as _fts/_ftsx, compare the weighted fields instead
+            expected = {field for field, _ in self.keys}
+            actual = set((info.get("weights") or {}).keys())
+            if expected != actual:
+                drift.append(f"text fields {sorted(actual)} != {sorted(expected)}")
+        elif [tuple(k) for k in info.get("key", [])] != [tuple(k) for k in self.keys]:
+            drift.append(f"keys {info.get('key')} != {self.keys}")
+        if bool(info.get("unique")) != self.unique:
+            drift.append(f"unique={bool(info.get('unique'))}, expected {self.unique}")
+        if bool(info.get("sparse")) != self.sparse:
+            drift.append(f"sparse={bool(info.get('sparse'))}, expected {self.sparse}")
+        if info.get("partialFilterExpression") != self.partial_filter:
+            drift.append(f"partial filter {info.get('partialFilterExpression')} != {self.partial_filter}")
+        return drift
+
+
+# Declarative registry: collection name -> indexes the app relies on
+INDEX_REGISTRY: Dict[str, List[IndexSpec]] = {
+    "medicines": [
+        IndexSpec(name="id_1", keys=[("id", ASCENDING)], unique=True),
+        IndexSpec(name="expiry_date_1", keys=[("expiry_date", ASCENDING)]),
+        IndexSpec(name="lots.batch_number_1", keys=[("lots.batch_number", ASCENDING)]),
+        IndexSpec(name="lots.expiry_date_1", keys=[("lots.expiry_date", ASCENDING)]),
+        IndexSpec(
+            name="is_low_stock_1",
+            keys=[("is_low_stock", ASCENDING)],
+            partial_filter={"is_low_stock": True},
+        ),
+        IndexSpec(name="change_seq_1", keys=[("change_seq", ASCENDING)]),
+    ],
+    "customers": [
+        IndexSpec(name="id_1", keys=[("id", ASCENDING)], unique=True),
+        IndexSpec(name="phone_1", keys=[("phone", ASCENDING)]),
+        IndexSpec(name="change_seq_1", keys=[("change_seq", ASCENDING)]),
+    ],
+    "sales_archive": [
+        IndexSpec(name="month_1_start_1", keys=[("month", ASCENDING), ("start", ASCENDING)]),
+    ],
+    "sales_rollups": [
+        IndexSpec(name="period_1_start_1", keys=[("period", ASCENDING), ("start", ASCENDING)]),
+    ],
+    "sales_rollup_medicines": [
+        IndexSpec(name="rollup_1", keys=[("rollup", ASCENDING)]),
+        IndexSpec(name="period_1_start_1", keys=[("period", ASCENDING), ("start", ASCENDING)]),
+    ],
+    "stock_movements": [
+        IndexSpec(name="medicine_id_1_at_1", keys=[("medicine_id", ASCENDING), ("at", ASCENDING)]),
+    ],
+    "stock_snapshots": [
+        IndexSpec(name="medicine_id_1_at_1", keys=[("medicine_id", ASCENDING), ("at", ASCENDING)]),
+    ],
+    "suppliers": [
+        IndexSpec(name="id_1", keys=[("id", ASCENDING)], unique=True),
+        IndexSpec(name="change_seq_1", keys=[("change_seq", ASCENDING)]),
+    ],
+    "tombstones": [
+        IndexSpec(name="change_seq_1", keys=[("change_seq", ASCENDING)]),
+    ],
+}
+
+# Indexes of every monthly sales partition (sales_YYYY_MM), see sales_partitions.py
+SALES_PARTITION_INDEXES: List[IndexSpec] = [
+    IndexSpec(name="id_1", keys=[("id", ASCENDING)], unique=True),
+    IndexSpec(name="sale_date_-1_id_-1", keys=[("sale_date", DESCENDING), ("id", DESCENDING)]),
+    IndexSpec(name="customer_id_1_sale_date_-1", keys=[("customer_id", ASCENDING), ("sale_date", DESCENDING)]),
+]
+
+
+class IndexManager:
+    """Creates the registered indexes and reports drift from the live database."""
+
+    def __init__(
+        self,
+        db,
+        registry: Dict[str, List[IndexSpec]] = INDEX_REGISTRY,
+        partition_indexes: List[IndexSpec] = SALES_PARTITION_INDEXES,
+    ):
+        self.db = db
+        self.registry = registry
+        self.partition_indexes = partition_indexes
+        self.state: Dict[str, Dict[str, Any]] = {}
+        self.last_checked: Optional[datetime] = None
+
+    async def ensure(self) -> Dict[str, Dict[str, Any]]:
+        state = {}
+        for collection_name, specs in self.registry.items():
+            state[collection_name] = await self._ensure_collection(collection_name, specs)
+        for collection_name in sorted(await self.db.list_collection_names()):
+            if is_partition(collection_name):
+                state[collection_name] = await self._ensure_collection(collection_name, self.partition_indexes)
+        self.state = state
+        self.last_checked = datetime.utcnow()
+        return state
+
+    async def ensure_partition(self, collection_name: str) -> Dict[str, Any]:
+        """Index a sales partition, typically when its month starts."""
+        report = await self._ensure_collection(collection_name, self.partition_indexes)
+        self.state = {**self.state, collection_name: report}
+        return report
+
+    def forget_partition(self, collection_name: str):
+        self.state = {name: report for name, report in self.state.items() if name != collection_name}
+
+    async def _ensure_collection(self, collection_name: str, specs: List[IndexSpec]) -> Dict[str, Any]:
+        collection = self.db[collection_name]
+        existing = await collection.index_information()
+        report = {"indexes": {}, "unmanaged": []}
+
+        for spec in specs:
+            info = existing.get(spec.name)
+            if info is None:
+                try:
+                    await collection.create_indexes([spec.to_index_model()])
+                    report["indexes"][spec.name] = {"status": "created"}
+                    logger.info("Created index %s.%s", collection_name, spec.name)
+                except PyMongoError as e:
+                    report["indexes"][spec.name] = {"status": "error", "error": str(e)}
+                    logger.error("Failed to create index %s.%s: %s", collection_name, spec.name, e)
+                continue
+
+            drift = spec.differences(info)
+            if drift:
+                report["indexes"][spec.name] = {"status": "drift", "drift": drift}
+                logger.warning("Index drift on %s.%s: %s", collection_name, spec.name, "; ".join(drift))
+            else:
+                report["indexes"][spec.name] = {"status": "ok"}
+
+        managed = {spec.name for spec in specs} | {"_id_"}
+        report["unmanaged"] = sorted(name for name in existing if name not in managed)
+        for name in report["unmanaged"]:
+            logger.warning("Unmanaged index on %s: %s", collection_name, name)
+        return report
+
+    def status(self) -> Dict[str, Any]:
+        healthy = all(
+            index["status"] in ("ok", "created")
+            for report in self.state.values()
+            for index in report["indexes"].values()
+        )
+        return {
+            "healthy": healthy and bool(self.state),
+            "last_checked": self.last_checked,
+            "collections": self.state,
+        }
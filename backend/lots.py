@@ -0,0 +1,201 @@
+import bisect
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Attempts at a revision-guarded lot write before giving up on a conflict
+MAX_LOT_WRITE_ATTEMPTS = 5
+
+
+class InsufficientStock(Exception):
+    def __init__(self, requested: int, available: int):
+        super().__init__(f"requested {requested}, available {available}")
+        self.requested = requested
+        self.available = available
+
+
+class ConcurrentLotUpdate(Exception):
+    """A medicine's lots changed between reading and writing them."""
+
+
+def new_lot(
+    batch_number: str,
+    expiry_date: datetime,
+    quantity: int,
+    purchase_price: Optional[float] = None,
+    lot_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    return {
+        "lot_id": lot_id or str(uuid.uuid4()),
+        "batch_number": batch_number,
+        "expiry_date": expiry_date,
+        "quantity": quantity,
+        "purchase_price": purchase_price,
+        "received_at": datetime.utcnow(),
+    }
+
+
+def lots_of(medicine: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The medicine's lots, or a single lot built from its flat fields for older documents."""
+    if "lots" in medicine:
+        return medicine["lots"]
+    if medicine.get("stock_quantity", 0) <= 0:
+        return []
+    return [new_lot(
+        medicine["batch_number"],
+        medicine["expiry_date"],
+        medicine["stock_quantity"],
+        medicine.get("purchase_price"),
+        lot_id=f"{medicine['id']}:{medicine['batch_number']}",
+    )]
+
+
+def _expiry(lot: Dict[str, Any]) -> datetime:
+    return lot["expiry_date"]
+
+
+def insert_lot(lots: List[Dict[str, Any]], lot: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """New list with lot placed in expiry order, after lots expiring at the same time."""
+    lots = list(lots)
+    lots.insert(bisect.bisect_right(lots, _expiry(lot), key=_expiry), lot)
+    return lots
+
+
+def upsert_lot(lots: List[Dict[str, Any]], lot: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Replace the lot with the same batch number, keeping its lot_id, or add it."""
+    for index, existing in enumerate(lots):
+        if existing["batch_number"] == lot["batch_number"]:
+            lot = {**lot, "lot_id": existing["lot_id"], "received_at": existing["received_at"]}
+            lots = lots[:index] + lots[index + 1:]
+            break
+    return insert_lot(lots, lot)
+
+
+def allocate(
+    lots: List[Dict[str, Any]], quantity: int, now: Optional[datetime] = None
+) -> List[Tuple[int, int]]:
+    """First-expiry-first-out (index, quantity) picks covering quantity.
+
+    Lots are kept sorted by expiry with empty lots dropped, so expired stock is
+    a prefix that a binary search skips and every pick after it is taken from
+    the front. Pass now=None to include expired lots, as write-offs do.
+    """
+    start = 0 if now is None else bisect.bisect_right(lots, now, key=_expiry)
+    picks = []
+    remaining = quantity
+    for index in range(start, len(lots)):
+        if remaining == 0:
+            break
+        take = min(lots[index]["quantity"], remaining)
+        picks.append((index, take))
+        remaining -= take
+    if remaining:
+        raise InsufficientStock(quantity, quantity - remaining)
+    return picks
+
+
+def consume(
+    lots: List[Dict[str, Any]], quantity: int, now: Optional[datetime] = None
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Take quantity from lots in FEFO order; returns the new lots and the allocations made."""
+    picks = dict(allocate(lots, quantity, now))
+    remaining_lots = []
+    allocations = []
+    for index, lot in enumerate(lots):
+        take = picks.get(index, 0)
+        if take:
+            allocations.append({
+                "lot_id": lot["lot_id"],
+                "batch_number": lot["batch_number"],
+                "expiry_date": lot["expiry_date"],
+                "purchase_price": lot.get("purchase_price"),
+                "quantity": take,
+            })
+        if lot["quantity"] > take:
+            remaining_lots.append({**lot, "quantity": lot["quantity"] - take})
+    return remaining_lots, allocations
+
+
+def restore(lots: List[Dict[str, Any]], allocations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Put allocated quantities back into their lots, recreating lots that were emptied."""
+    lots = list(lots)
+    for allocation in allocations:
+        for index, lot in enumerate(lots):
+            if lot["lot_id"] == allocation["lot_id"]:
+                lots[index] = {**lot, "quantity": lot["quantity"] + allocation["quantity"]}
+                break
+        else:
+            lots = insert_lot(lots, new_lot(
+                allocation["batch_number"],
+                allocation["expiry_date"],
+                allocation["quantity"],
+                allocation.get("purchase_price"),
+                lot_id=allocation["lot_id"],
+            ))
+    return lots
+
+
+def adjust(
+    lots: List[Dict[str, Any]],
+    stock_quantity: Optional[int] = None,
+    batch_number: Optional[str] = None,
+    expiry_date: Optional[datetime] = None,
+    purchase_price: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """Apply a direct edit of the flat medicine fields to its lots.
+
+    Batch and expiry edits correct the current (earliest) lot, or start a new
+    lot when the batch number is not one of the medicine's lots. A stock
+    count above the lot total adds the difference to that lot; a lower count
+    writes stock off in FEFO order, expired lots first.
+    """
+    lots = list(lots)
+    if batch_number is not None or expiry_date is not None:
+        index = next((i for i, lot in enumerate(lots) if lot["batch_number"] == batch_number), None)
+        if index is None and lots and batch_number is None:
+            index = 0
+        if index is None:
+            if expiry_date is None:
+                expiry_date = lots[0]["expiry_date"] if lots else datetime.utcnow()
+            lots = insert_lot(lots, new_lot(batch_number, expiry_date, 0, purchase_price))
+        else:
+            lot = lots.pop(index)
+            lots = insert_lot(lots, {**lot, "expiry_date": expiry_date or lot["expiry_date"]})
+
+    if stock_quantity is not None:
+        delta = stock_quantity - sum(lot["quantity"] for lot in lots)
+        if delta < 0:
+            lots, _ = consume(lots, -delta)
+        elif delta > 0:
+            target = next((i for i, lot in enumerate(lots) if lot["batch_number"] == batch_number), 0)
+            if lots:
+                lots[target] = {**lots[target], "quantity": lots[target]["quantity"] + delta}
+            else:
+                raise ValueError("batch_number and expiry_date are required to add stock to a medicine without lots")
+    return [lot for lot in lots if lot["quantity"] > 0 or lot["batch_number"] == batch_number]
+
+
+def lot_fields(medicine: Dict[str, Any], lots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Fields to $set after a lot change: the lots, their totals and the next revision.
+
+    The flat batch_number and expiry_date mirror the earliest lot so SKU level
+    reads, indexes and reports keep working; they are left as they were once
+    the medicine runs out.
+    """
+    stock_quantity = sum(lot["quantity"] for lot in lots)
+    fields = {
+        "lots": lots,
+        "stock_quantity": stock_quantity,
+        "is_low_stock": stock_quantity <= medicine["min_stock_level"],
+        "lot_revision": medicine.get("lot_revision", 0) + 1,
+    }
+    if lots:
+        fields["batch_number"] = lots[0]["batch_number"]
+        fields["expiry_date"] = lots[0]["expiry_date"]
+    return fields
+
+
+def revision_filter(medicine: Dict[str, Any]) -> Dict[str, Any]:
+    """Match the medicine only while its lots are still at the revision that was read."""
+    revision = medicine.get("lot_revision", 0)
+    return {"id": medicine["id"], "lot_revision": {"$in": [0, None]} if revision == 0 else revision}
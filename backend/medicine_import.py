@@ -0,0 +1,80 @@
+import codecs
+import csv
+import json
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+SUPPORTED_FORMATS = ("csv", "ndjson")
+
+Row = Tuple[int, Dict[str, Any]]
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    name = (filename or "").lower()
+    if name.endswith(".csv") or content_type == "text/csv":
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")) or content_type in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    return None
+
+
+def _csv_rows(stream: BinaryIO) -> Iterator[Row]:
+    text = codecs.getreader("utf-8-sig")(stream)
+    reader = csv.DictReader(text)
+    # Row 1 is the header line
+    for row_number, row in enumerate(reader, start=2):
+        yield row_number, {k.strip(): (v.strip() if isinstance(v, str) else v) for k, v in row.items() if k}
+
+
+def _ndjson_rows(stream: BinaryIO) -> Iterator[Row]:
+    for row_number, line in enumerate(codecs.getreader("utf-8-sig")(stream), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield row_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_number, {"__error__": f"Invalid JSON: {e.msg}"}
+
+
+def iter_chunks(stream: BinaryIO, fmt: str, chunk_size: int) -> Iterator[List[Row]]:
+    """Yield lists of at most chunk_size (row number, raw row) pairs."""
+    rows = _csv_rows(stream) if fmt == "csv" else _ndjson_rows(stream)
+    chunk: List[Row] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def validate_chunk(rows: List[Row], model: Type[BaseModel]) -> Tuple[List[Tuple[int, BaseModel]], List[Dict[str, Any]]]:
+    """Validate raw rows against model, splitting them into valid models and row errors."""
+    valid = []
+    errors = []
+    for row_number, raw in rows:
+        if not isinstance(raw, dict):
+            errors.append({"row": row_number, "errors": ["Row is not an object"]})
+            continue
+        if "__error__" in raw:
+            errors.append({"row": row_number, "errors": [raw["__error__"]]})
+            continue
+        try:
+            valid.append((row_number, model(**raw)))
+        except ValidationError as e:
+            errors.append({
+                "row": row_number,
+                "errors": [f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors()],
+            })
+    return valid, errors
+
+
+def next_validated_chunk(chunks: Iterator[List[Row]], model: Type[BaseModel]):
+    """Pull and validate the next chunk; meant to run in a worker thread. None when exhausted."""
+    rows = next(chunks, None)
+    if rows is None:
+        return None
+    return validate_chunk(rows, model)
@@ -0,0 +1,252 @@
+import abc
+import functools
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Sequence, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DOCUMENT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(abc.ABC):
+    """A metric family with a fixed set of label names, safe to update from any thread."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abc.abstractmethod
+    def _samples(self) -> List[str]:
+        """Sample lines for the current values; called with the lock held."""
+
+    def render(self) -> List[str]:
+        with self._lock:
+            samples = self._samples()
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", *samples]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_labels(list(zip(self.label_names, key)))} {_number(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in sorted(self._values.items()):
+            pairs = list(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(pairs + [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(pairs)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(pairs)} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """The application's metric families, rendered together in Prometheus text format."""
+
+    def __init__(self):
+        self.http_request_duration = Histogram(
+            "http_request_duration_seconds",
+            "Time from receiving a request to sending the last byte of its response.",
+            ("method", "route", "status"),
+        )
+        self.mongo_command_duration = Histogram(
+            "mongodb_command_duration_seconds",
+            "MongoDB command round trip time, as reported by the driver.",
+            ("collection", "command"),
+        )
+        self.mongo_documents_returned = Histogram(
+            "mongodb_command_documents_returned",
+            "Documents in the cursor batch returned by a MongoDB command.",
+            ("collection", "command"),
+            DOCUMENT_BUCKETS,
+        )
+        self.mongo_command_failures = Counter(
+            "mongodb_command_failures_total",
+            "MongoDB commands that returned an error.",
+            ("collection", "command"),
+        )
+        self.to_list_documents = Histogram(
+            "motor_to_list_documents",
+            "Documents materialized by a single cursor to_list() call.",
+            ("collection",),
+            DOCUMENT_BUCKETS,
+        )
+
+    def families(self) -> List[Metric]:
+        return [value for value in vars(self).values() if isinstance(value, Metric)]
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.families() for line in metric.render()) + "\n"
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """pymongo command listener feeding the MongoDB metrics.
+
+    Driver events arrive on Motor's worker threads; the metric families lock
+    internally, and in-flight commands are keyed by request and connection.
+    """
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._collections: Dict[Tuple[int, Any], str] = {}
+
+    @staticmethod
+    def _collection(event: monitoring.CommandStartedEvent) -> str:
+        if event.command_name == "getMore":
+            return str(event.command.get("collection", ""))
+        target = event.command.get(event.command_name)
+        return target if isinstance(target, str) else ""
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        with self._lock:
+            self._collections[(event.request_id, event.connection_id)] = self._collection(event)
+
+    def _finish(self, event) -> str:
+        with self._lock:
+            return self._collections.pop((event.request_id, event.connection_id), "")
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        collection = self._finish(event)
+        self.metrics.mongo_command_duration.observe(
+            event.duration_micros / 1e6, collection=collection, command=event.command_name
+        )
+        cursor = event.reply.get("cursor") if event.reply else None
+        if isinstance(cursor, dict):
+            batch = cursor.get("firstBatch", cursor.get("nextBatch", []))
+            self.metrics.mongo_documents_returned.observe(
+                len(batch), collection=collection, command=event.command_name
+            )
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        collection = self._finish(event)
+        self.metrics.mongo_command_duration.observe(
+            event.duration_micros / 1e6, collection=collection, command=event.command_name
+        )
+        self.metrics.mongo_command_failures.inc(collection=collection, command=event.command_name)
+
+
+def watch_to_list(cursor_class, metrics: Metrics, warn_documents: int):
+    """Record the size of every to_list() result and warn about large or unbounded ones.
+
+    Wraps the method on the shared Motor cursor base class, so calls from all
+    modules are covered. Warnings name the calling line.
+    """
+    original = cursor_class.to_list
+    if getattr(original, "_watched", False):
+        return
+
+    @functools.wraps(original)
+    async def to_list(self, length=None, *args, **kwargs):
+        docs = await original(self, length, *args, **kwargs)
+        collection = getattr(getattr(self, "collection", None), "name", "")
+        metrics.to_list_documents.observe(len(docs), collection=collection)
+        if len(docs) >= warn_documents:
+            caller = sys._getframe(1)
+            logger.warning(
+                "to_list(%s) materialized %d documents from %s at %s:%d",
+                length, len(docs), collection or "a command cursor", caller.f_code.co_filename, caller.f_lineno,
+            )
+        return docs
+
+    to_list._watched = True
+    cursor_class.to_list = to_list
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each request under its route template.
+
+    Requests that match no route share one label, so unknown paths cannot
+    grow the label set. Streaming responses are timed until they finish.
+    """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            self.metrics.http_request_duration.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status,
+            )
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SaleQueueFull(Exception):
+    """No room in the queue within the enqueue timeout."""
+
+
+class SaleQueueClosed(Exception):
+    """The queue is shutting down and takes no new sales."""
+
+
+class PendingSale:
+    __slots__ = ("sale", "quantities", "names", "future")
+
+    def __init__(self, sale: Dict[str, Any], quantities: Dict[str, int], names: Dict[str, str]):
+        self.sale = sale
+        self.quantities = quantities
+        self.names = names
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def resolve(self, result: Any):
+        if not self.future.done():
+            self.future.set_result(result)
+
+    def fail(self, error: BaseException):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+
+class SaleQueue:
+    """Group commit for checkouts.
+
+    Requests enqueue a validated sale and wait; one writer takes everything
+    queued so far (up to group_size) and commits it together, resolving
+    each request once its sale is written. While a group is being written
+    the next one fills up, so the number of round trips per sale falls as
+    load rises. The queue is bounded: a full queue makes submitters wait,
+    and past enqueue_timeout they get SaleQueueFull. `close` stops intake
+    and writes what is left.
+    """
+
+    def __init__(
+        self,
+        commit: Callable[[List[PendingSale]], Awaitable[None]],
+        max_pending: int = 1000,
+        group_size: int = 200,
+        enqueue_timeout: float = 5,
+    ):
+        self.commit = commit
+        self.group_size = group_size
+        self.enqueue_timeout = enqueue_timeout
+        self.closed = False
+        self._queue: Optional[asyncio.Queue] = None
+        self._max_pending = max_pending
+        self._writer: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self) -> asyncio.Task:
+        # The queue belongs to the running loop, so it is created here rather than at import
+        self.closed = False
+        self._queue = asyncio.Queue(self._max_pending)
+        self._writer = asyncio.create_task(self._run())
+        return self._writer
+
+    async def submit(self, sale: Dict[str, Any], quantities: Dict[str, int], names: Dict[str, str]) -> Any:
+        """Queue a sale and wait for its group to be written; returns what commit resolved it with."""
+        if self.closed or self._queue is None:
+            raise SaleQueueClosed()
+        pending = PendingSale(sale, quantities, names)
+        try:
+            await asyncio.wait_for(self._queue.put(pending), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            raise SaleQueueFull() from None
+        return await pending.future
+
+    async def _run(self):
+        while True:
+            group = [await self._queue.get()]
+            while len(group) < self.group_size and not self._queue.empty():
+                group.append(self._queue.get_nowait())
+            stop = None in group
+            await self._write([pending for pending in group if pending is not None])
+            if stop:
+                break
+
+    async def _write(self, group: List[PendingSale]):
+        if not group:
+            return
+        try:
+            await self.commit(group)
+        except Exception as e:
+            logger.exception("Writing a group of %d sales failed", len(group))
+            for pending in group:
+                pending.fail(e)
+        else:
+            for pending in group:
+                pending.fail(RuntimeError("sale was not resolved by its group commit"))
+
+    async def close(self):
+        """Stop taking sales, write the queued ones and wait for the writer to finish."""
+        if self._writer is None:
+            return
+        self.closed = True
+        if not self._writer.done():
+            # Wakes the writer once everything queued before it has been taken
+            await self._queue.put(None)
+            await self._writer
+        # Submitters that were waiting for room when intake stopped
+        while not self._queue.empty():
+            pending = self._queue.get_nowait()
+            if pending is not None:
+                pending.fail(SaleQueueClosed())
+        self._writer = None
@@ -0,0 +1,141 @@
+import csv
+import io
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterator, List
+
+# One row per sale line item, with the sale header repeated on every line
+SALE_COLUMNS = [
+    "sale_id", "sale_date", "customer_id", "customer_name", "payment_method",
+    "subtotal", "discount_percent", "discount_amount", "tax_percent", "tax_amount", "total_amount",
+]
+ITEM_COLUMNS = ["line_number", "medicine_id", "medicine_name", "quantity", "unit_price", "total_price"]
+EXPORT_COLUMNS = SALE_COLUMNS + ITEM_COLUMNS
+
+# Rows buffered before a chunk is sent to the client
+EXPORT_CHUNK_ROWS = 5000
+
+
+def flatten_sale(sale: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    header = {
+        "sale_id": sale.get("id"),
+        "sale_date": sale.get("sale_date"),
+        "customer_id": sale.get("customer_id"),
+        "customer_name": sale.get("customer_name"),
+        "payment_method": sale.get("payment_method"),
+        "subtotal": sale.get("subtotal"),
+        "discount_percent": sale.get("discount_percent", 0),
+        "discount_amount": sale.get("discount_amount", 0),
+        "tax_percent": sale.get("tax_percent", 0),
+        "tax_amount": sale.get("tax_amount", 0),
+        "total_amount": sale.get("total_amount"),
+    }
+    for line_number, item in enumerate(sale.get("items", []), start=1):
+        yield {
+            **header,
+            "line_number": line_number,
+            "medicine_id": item.get("medicine_id"),
+            "medicine_name": item.get("medicine_name"),
+            "quantity": item.get("quantity"),
+            "unit_price": item.get("unit_price"),
+            "total_price": item.get("total_price"),
+        }
+
+
+async def iter_row_chunks(cursor, chunk_rows: int = EXPORT_CHUNK_ROWS) -> AsyncIterator[List[Dict[str, Any]]]:
+    rows: List[Dict[str, Any]] = []
+    async for sale in cursor:
+        rows.extend(flatten_sale(sale))
+        if len(rows) >= chunk_rows:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+
+async def iter_csv(cursor) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    async for rows in iter_row_chunks(cursor):
+        for row in rows:
+            if isinstance(row["sale_date"], datetime):
+                row["sale_date"] = row["sale_date"].isoformat()
+            writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object whose contents are drained after every row group."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("sale_id", pa.string()),
+        ("sale_date", pa.timestamp("us")),
+        ("customer_id", pa.string()),
+        ("customer_name", pa.string()),
+        ("payment_method", pa.string()),
+        ("subtotal", pa.float64()),
+        ("discount_percent", pa.float64()),
+        ("discount_amount", pa.float64()),
+        ("tax_percent", pa.float64()),
+        ("tax_amount", pa.float64()),
+        ("total_amount", pa.float64()),
+        ("line_number", pa.int32()),
+        ("medicine_id", pa.string()),
+        ("medicine_name", pa.string()),
+        ("quantity", pa.int64()),
+        ("unit_price", pa.float64()),
+        ("total_price", pa.float64()),
+    ])
+
+
+async def iter_parquet(cursor) -> AsyncIterator[bytes]:
+    """Stream a Parquet file, one row group per chunk of rows."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        async for rows in iter_row_chunks(cursor):
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
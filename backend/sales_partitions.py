@@ -0,0 +1,395 @@
+import logging
+import re
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from pymongo import ASCENDING, DESCENDING, InsertOne
+from pymongo.errors import BulkWriteError, CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+PARTITION_PATTERN = r"^sales_\d{4}_\d{2}$"
+# Sales per archive bucket, keeps a busy day well under the 16MB document limit
+ARCHIVE_BUCKET_SIZE = 1000
+ARCHIVE_STORAGE_ENGINE = {"wiredTiger": {"configString": "block_compressor=zstd"}}
+# How long a claim on a month being archived lasts without renewal; renewed before every bucket
+ARCHIVE_LEASE_SECONDS = 600
+
+HOT = "hot"
+ARCHIVING = "archiving"
+ARCHIVED = "archived"
+
+# (sale_date, id) of the last sale returned, for keyset paging
+SaleKey = Tuple[datetime, str]
+
+
+def month_of(moment) -> date:
+    return date(moment.year, moment.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_key(month: date) -> str:
+    return f"{month:%Y-%m}"
+
+
+def partition_name(month: date) -> str:
+    return f"sales_{month:%Y_%m}"
+
+
+def is_partition(collection_name: str) -> bool:
+    return re.match(PARTITION_PATTERN, collection_name) is not None
+
+
+def months_between(start: datetime, end: datetime) -> List[date]:
+    """First days of the months overlapping [start, end)."""
+    months = []
+    month = month_of(start)
+    while datetime.combine(month, datetime.min.time()) < end:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def encode_key(key: SaleKey) -> str:
+    return f"{key[0].isoformat()}|{key[1]}"
+
+
+def decode_key(cursor: str) -> SaleKey:
+    """Parse a paging cursor; raises ValueError if it is not one."""
+    moment, separator, sale_id = cursor.partition("|")
+    if not separator or not sale_id:
+        raise ValueError(cursor)
+    return datetime.fromisoformat(moment), sale_id
+
+
+def _project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    included = [field for field, value in (projection or {}).items() if value and field != "_id"]
+    if included:
+        return {field: doc[field] for field in included if field in doc}
+    return {field: value for field, value in doc.items() if field != "_id"}
+
+
+class SalesPartitions:
+    """Sales stored in one collection per month, with old months archived.
+
+    Writes go to `sales_YYYY_MM` for the sale date, so a date-range read only
+    touches the months it covers and today's queries scan one month's index
+    however long the history gets. `sales_partitions` catalogs the months.
+    Months older than `hot_months` are moved into `sales_archive` as
+    buckets of up to ARCHIVE_BUCKET_SIZE sales of one day, in a collection
+    created with zstd block compression; reads cover both transparently.
+    """
+
+    def __init__(
+        self,
+        db,
+        index_manager,
+        hot_months: int = 12,
+        catalog_name: str = "sales_partitions",
+        archive_name: str = "sales_archive",
+        legacy_name: str = "sales",
+        compress_archive: bool = True,
+    ):
+        self.db = db
+        self.index_manager = index_manager
+        # The current month is always hot, writes never land in an archived month
+        self.hot_months = max(hot_months, 1)
+        self.catalog = db[catalog_name]
+        self.archive = db[archive_name]
+        self.legacy = db[legacy_name]
+        self.compress_archive = compress_archive
+        self._known: Set[str] = set()
+
+    def hot_from(self, now: Optional[datetime] = None) -> date:
+        """First month still kept in its own partition."""
+        return add_months(month_of(now or datetime.utcnow()), 1 - self.hot_months)
+
+    # Writes
+
+    async def collection_for(self, sale_date: datetime):
+        """The partition for sale_date, cataloged and indexed the first time it is used."""
+        month = month_of(sale_date)
+        name = partition_name(month)
+        if name not in self._known:
+            await self.catalog.update_one(
+                {"_id": month_key(month)},
+                {"$setOnInsert": {
+                    "collection": name,
+                    "start": datetime.combine(month, datetime.min.time()),
+                    "state": HOT,
+                }},
+                upsert=True,
+            )
+            await self.index_manager.ensure_partition(name)
+            self._known.add(name)
+        return self.db[name]
+
+    async def insert_one(self, sale: Dict[str, Any], session=None):
+        collection = await self.collection_for(sale["sale_date"])
+        await collection.insert_one(sale, session=session)
+
+    async def insert_many(self, sales: List[Dict[str, Any]], session=None):
+        by_month: Dict[date, List[Dict[str, Any]]] = {}
+        for sale in sales:
+            by_month.setdefault(month_of(sale["sale_date"]), []).append(sale)
+        for month, month_sales in by_month.items():
+            collection = await self.collection_for(month_sales[0]["sale_date"])
+            await collection.insert_many(month_sales, ordered=False, session=session)
+
+    # Reads
+
+    async def _months(self, start: Optional[datetime], end: Optional[datetime]) -> List[Dict[str, Any]]:
+        """Catalog entries for the months overlapping [start, end), oldest first."""
+        end = end or datetime.utcnow() + timedelta(days=1)
+        if start is not None and month_of(start) >= self.hot_from():
+            # Recent months are never archived, their partitions follow from the dates alone
+            return [
+                {
+                    "_id": month_key(month),
+                    "collection": partition_name(month),
+                    "start": datetime.combine(month, datetime.min.time()),
+                    "state": HOT,
+                }
+                for month in months_between(start, end)
+            ]
+        query: Dict[str, Any] = {"start": {"$lt": end}}
+        if start is not None:
+            query["start"]["$gte"] = datetime.combine(month_of(start), datetime.min.time())
+        return await self.catalog.find(query).sort("start", ASCENDING).to_list(None)
+
+    async def iter_sales(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        newest_first: bool = True,
+        after: Optional[SaleKey] = None,
+        projection: Optional[Dict[str, Any]] = None,
+        batch_size: int = 500,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Sales in [start, end) ordered by (sale_date, id), continuing after a paging key."""
+        date_filter: Dict[str, Any] = {}
+        if start is not None:
+            date_filter["$gte"] = start
+        if end is not None:
+            date_filter["$lt"] = end
+        query: Dict[str, Any] = {"sale_date": date_filter} if date_filter else {}
+        if after is not None:
+            op = "$lt" if newest_first else "$gt"
+            query = {"$and": [query, {"$or": [
+                {"sale_date": {op: after[0]}},
+                {"sale_date": after[0], "id": {op: after[1]}},
+            ]}]}
+        direction = DESCENDING if newest_first else ASCENDING
+        months = await self._months(start, end)
+        if newest_first:
+            months.reverse()
+        for month in months:
+            if after is not None and (
+                month["start"] > after[0] if newest_first else month_of(month["start"]) < month_of(after[0])
+            ):
+                # Entirely on the already returned side of the cursor
+                continue
+            if month["state"] == ARCHIVED:
+                async for sale in self._iter_archived(month["_id"], start, end, newest_first, after):
+                    yield _project(sale, projection)
+                continue
+            cursor = self.db[month["collection"]].find(query, projection or {"_id": 0}).sort(
+                [("sale_date", direction), ("id", direction)]
+            ).batch_size(batch_size)
+            async for sale in cursor:
+                yield sale
+
+    async def _iter_archived(self, key: str, start, end, newest_first: bool, after: Optional[SaleKey]):
+        direction = DESCENDING if newest_first else ASCENDING
+        async for bucket in self.archive.find({"month": key}).sort([("start", direction), ("_id", direction)]):
+            sales = sorted(bucket["sales"], key=lambda sale: (sale["sale_date"], sale["id"]), reverse=newest_first)
+            for sale in sales:
+                sale_key = (sale["sale_date"], sale["id"])
+                if start is not None and sale["sale_date"] < start or end is not None and sale["sale_date"] >= end:
+                    continue
+                if after is not None and (sale_key >= after if newest_first else sale_key <= after):
+                    continue
+                yield sale
+
+    async def aggregate(self, start: datetime, end: datetime, pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Run pipeline over each month overlapping [start, end), results concatenated.
+
+        Archived months are read back out of their buckets, so results cover
+        the whole range whatever state its months are in.
+        """
+        results = []
+        match = {"$match": {"sale_date": {"$gte": start, "$lt": end}}}
+        for month in await self._months(start, end):
+            if month["state"] == ARCHIVED:
+                unpacked = [
+                    {"$match": {
+                        "month": month["_id"],
+                        "start": {"$gte": datetime.combine(start.date(), datetime.min.time()), "$lt": end},
+                    }},
+                    {"$unwind": "$sales"},
+                    {"$replaceRoot": {"newRoot": "$sales"}},
+                ]
+                results += await self.archive.aggregate([*unpacked, match, *pipeline]).to_list(None)
+            else:
+                results += await self.db[month["collection"]].aggregate([match, *pipeline]).to_list(None)
+        return results
+
+    # Maintenance
+
+    async def migrate_legacy(self, batch_size: int = 1000) -> int:
+        """Move sales from the single pre-partitioning collection into monthly partitions."""
+        moved = 0
+        while True:
+            batch = await self.legacy.find({}).sort("_id", ASCENDING).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+            by_month: Dict[date, List[Dict[str, Any]]] = {}
+            for sale in batch:
+                by_month.setdefault(month_of(sale["sale_date"]), []).append(sale)
+            for month, sales in by_month.items():
+                collection = await self.collection_for(sales[0]["sale_date"])
+                try:
+                    await collection.bulk_write([InsertOne(sale) for sale in sales], ordered=False)
+                except BulkWriteError as e:
+                    # Copied by an earlier, interrupted run; the _id is kept so the copy is recognised
+                    if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                        raise
+            await self.legacy.delete_many({"_id": {"$in": [sale["_id"] for sale in batch]}})
+            moved += len(batch)
+        if moved:
+            logger.info("Moved %d sales into monthly partitions", moved)
+        return moved
+
+    async def ensure_archive(self):
+        if self.archive.name not in await self.db.list_collection_names():
+            try:
+                options = {"storageEngine": ARCHIVE_STORAGE_ENGINE} if self.compress_archive else {}
+                await self.db.create_collection(self.archive.name, **options)
+            except CollectionInvalid:
+                pass
+
+    async def _holds_claim(self, key: str, owner: str) -> bool:
+        """Renew the lease on a month this worker is archiving; False once another worker took it over."""
+        result = await self.catalog.update_one(
+            {"_id": key, "state": ARCHIVING, "owner": owner},
+            {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=ARCHIVE_LEASE_SECONDS)}},
+        )
+        return result.matched_count == 1
+
+    async def _release(self, key: str, owner: str):
+        """Let the next run claim the month again straight away."""
+        await self.catalog.update_one(
+            {"_id": key, "state": ARCHIVING, "owner": owner}, {"$set": {"lease_until": datetime.utcnow()}}
+        )
+
+    async def archive_month(self, key: str) -> int:
+        """Copy a month into archive buckets, check the copy, then drop the partition.
+
+        Every worker runs this job, so a month is claimed with an owner and a
+        lease, and only re-claimed from another worker once its lease ran
+        out. Buckets carry their owner; a worker stops as soon as it finds
+        its claim gone, and the partition is only dropped when the buckets
+        in the archive add up to exactly the sales in the partition. Safe to
+        rerun after a crash: the month stays readable from its partition
+        until the catalog says it is archived.
+        """
+        owner = uuid.uuid4().hex
+        now = datetime.utcnow()
+        entry = await self.catalog.find_one_and_update(
+            {"_id": key, "$or": [
+                {"state": HOT},
+                {"state": ARCHIVING, "lease_until": {"$not": {"$gt": now}}},
+            ]},
+            {"$set": {
+                "state": ARCHIVING,
+                "owner": owner,
+                "lease_until": now + timedelta(seconds=ARCHIVE_LEASE_SECONDS),
+            }},
+        )
+        if entry is None:
+            return 0
+        await self.ensure_archive()
+        partition = self.db[entry["collection"]]
+        # Buckets left by earlier attempts whose claims have lapsed
+        if not await self._holds_claim(key, owner):
+            return 0
+        await self.archive.delete_many({"month": key, "owner": {"$ne": owner}})
+
+        archived = 0
+        bucket: List[Dict[str, Any]] = []
+        bucket_day: Optional[date] = None
+        bucket_index = 0
+        lost = False
+
+        async def flush():
+            nonlocal archived, bucket, bucket_index, lost
+            if bucket and not lost:
+                if not await self._holds_claim(key, owner):
+                    lost = True
+                    return
+                await self.archive.insert_one({
+                    # Zero padded so a day's buckets sort in order
+                    "_id": f"{bucket_day.isoformat()}:{bucket_index:05d}:{owner}",
+                    "month": key,
+                    "owner": owner,
+                    "start": datetime.combine(bucket_day, datetime.min.time()),
+                    "sales_count": len(bucket),
+                    "sales": bucket,
+                })
+                archived += len(bucket)
+                bucket, bucket_index = [], bucket_index + 1
+
+        async for sale in partition.find({}, {"_id": 0}).sort([("sale_date", ASCENDING), ("id", ASCENDING)]).batch_size(ARCHIVE_BUCKET_SIZE):
+            day = sale["sale_date"].date()
+            if day != bucket_day:
+                await flush()
+                bucket_day, bucket_index = day, 0
+            bucket.append(sale)
+            if len(bucket) >= ARCHIVE_BUCKET_SIZE:
+                await flush()
+            if lost:
+                logger.warning("Archiving %s was taken over by another worker, stopping", key)
+                return 0
+        await flush()
+        if lost:
+            logger.warning("Archiving %s was taken over by another worker, stopping", key)
+            return 0
+
+        # Check what the archive actually holds, not what this run believes it wrote
+        expected = await partition.count_documents({})
+        stored = await self.archive.aggregate([
+            {"$match": {"month": key}},
+            {"$group": {"_id": None, "sales": {"$sum": "$sales_count"}}},
+        ]).to_list(1)
+        stored = stored[0]["sales"] if stored else 0
+        if archived != expected or stored != expected:
+            # Sales arrived while copying, or buckets of another run are mixed in; retry next run
+            logger.warning("Archiving %s copied %d, archive holds %d of %d sales, will retry", key, archived, stored, expected)
+            await self._release(key, owner)
+            return 0
+        result = await self.catalog.update_one(
+            {"_id": key, "state": ARCHIVING, "owner": owner},
+            {"$set": {"state": ARCHIVED, "sales_count": archived, "archived_at": datetime.utcnow()},
+             "$unset": {"owner": "", "lease_until": ""}},
+        )
+        if not result.matched_count:
+            logger.warning("Archiving %s was taken over by another worker before it finished", key)
+            return 0
+        await partition.drop()
+        self._known.discard(entry["collection"])
+        self.index_manager.forget_partition(entry["collection"])
+        logger.info("Archived %d sales of %s", archived, key)
+        return archived
+
+    async def archive_old_months(self) -> int:
+        """Archive every month before the hot window; returns sales archived."""
+        cutoff = datetime.combine(self.hot_from(), datetime.min.time())
+        archived = 0
+        async for entry in self.catalog.find({"state": {"$in": [HOT, ARCHIVING]}, "start": {"$lt": cutoff}}):
+            archived += await self.archive_month(entry["_id"])
+        return archived
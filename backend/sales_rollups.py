@@ -0,0 +1,303 @@
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReplaceOne, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+UNCATEGORIZED = "Uncategorized"
+PERIODS = ("day", "month")
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(day: date) -> date:
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def period_start(period: str, day: date) -> date:
+    return month_start(day) if period == "month" else day
+
+
+def rollup_key(period: str, day: date) -> str:
+    start = period_start(period, day)
+    return f"{period}:{start.isoformat()[:7] if period == 'month' else start.isoformat()}"
+
+
+def field_key(value: str) -> str:
+    """Make an arbitrary string safe to use as a document field name."""
+    return value.replace(".", "_").lstrip("$") or "_"
+
+
+def plan_periods(start: date, end: date) -> List[str]:
+    """Cover [start, end) with whole months where possible and single days at the edges."""
+    keys = []
+    current = start
+    while current < end:
+        if current.day == 1 and next_month(current) <= end:
+            keys.append(rollup_key("month", current))
+            current = next_month(current)
+        else:
+            keys.append(rollup_key("day", current))
+            current += timedelta(days=1)
+    return keys
+
+
+def sale_increments(sale: Dict[str, Any], categories: Dict[str, str]) -> Tuple[Dict[str, float], Dict[str, str]]:
+    """Dotted-path counters a sale adds to its rollups, plus the display names to set."""
+    increments: Dict[str, float] = defaultdict(int)
+    names: Dict[str, str] = {}
+    increments["sales_count"] += 1
+    increments["revenue"] += sale["total_amount"]
+    increments["subtotal"] += sale["subtotal"]
+    increments["discount_amount"] += sale.get("discount_amount", 0)
+    increments["tax_amount"] += sale.get("tax_amount", 0)
+    for item in sale["items"]:
+        category = categories.get(item["medicine_id"]) or UNCATEGORIZED
+        category_key = field_key(category)
+        increments["units"] += item["quantity"]
+        increments[f"categories.{category_key}.units"] += item["quantity"]
+        increments[f"categories.{category_key}.revenue"] += item["total_price"]
+        names[f"categories.{category_key}.name"] = category
+    return dict(increments), names
+
+
+def medicine_increments(sale: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Units and revenue a sale adds per medicine, with the name to show."""
+    totals: Dict[str, Dict[str, Any]] = {}
+    for item in sale["items"]:
+        total = totals.setdefault(item["medicine_id"], {"name": item["medicine_name"], "units": 0, "revenue": 0.0})
+        total["units"] += item["quantity"]
+        total["revenue"] += item["total_price"]
+    return totals
+
+
+def medicine_rollup_key(key: str, medicine_id: str) -> str:
+    return f"{key}:{medicine_id}"
+
+
+def open_periods(now: datetime) -> Dict[str, datetime]:
+    """Start of the day and of the month that live sales are still being added to."""
+    return {period: datetime.combine(period_start(period, now.date()), datetime.min.time()) for period in PERIODS}
+
+
+def _nest(flat: Dict[str, Any]) -> Dict[str, Any]:
+    nested: Dict[str, Any] = {}
+    for path, value in flat.items():
+        target = nested
+        *parents, leaf = path.split(".")
+        for part in parents:
+            target = target.setdefault(part, {})
+        target[leaf] = value
+    return nested
+
+
+class SalesRollups:
+    """Daily and monthly sales aggregates.
+
+    Each rollup document holds totals for one day or month plus a
+    per-category breakdown; per-medicine totals get one document per
+    period and medicine, so a month stays far below the document size
+    limit however many SKUs sold in it. `record_sales` keeps them current
+    as sales are committed; `rebuild` recomputes closed periods from the
+    stored sales.
+    """
+
+    def __init__(
+        self,
+        db,
+        sales,
+        collection_name: str = "sales_rollups",
+        medicines_name: str = "sales_rollup_medicines",
+    ):
+        self.db = db
+        self.sales = sales
+        self.collection = db[collection_name]
+        self.medicines = db[medicines_name]
+
+    async def record_sales(self, sales: List[Dict[str, Any]], categories: Dict[str, str]):
+        """Add several sales to their day and month rollups with one bulk write per collection."""
+        updates, medicine_updates = [], []
+        for sale in sales:
+            increments, names = sale_increments(sale, categories)
+            day = sale["sale_date"].date()
+            for period in PERIODS:
+                key = rollup_key(period, day)
+                start = datetime.combine(period_start(period, day), datetime.min.time())
+                updates.append(UpdateOne(
+                    {"_id": key},
+                    {"$inc": increments, "$set": names, "$setOnInsert": {"period": period, "start": start}},
+                    upsert=True,
+                ))
+                for medicine_id, total in medicine_increments(sale).items():
+                    medicine_updates.append(UpdateOne(
+                        {"_id": medicine_rollup_key(key, medicine_id)},
+                        {
+                            "$inc": {"units": total["units"], "revenue": total["revenue"]},
+                            "$set": {"name": total["name"]},
+                            "$setOnInsert": {"rollup": key, "period": period, "start": start, "medicine_id": medicine_id},
+                        },
+                        upsert=True,
+                    ))
+        if updates:
+            await self.collection.bulk_write(updates, ordered=False)
+        if medicine_updates:
+            await self.medicines.bulk_write(medicine_updates, ordered=False)
+
+    async def rebuild(self, start: Optional[date] = None, end: Optional[date] = None) -> int:
+        """Recompute closed rollups for whole months overlapping [start, end); returns sales scanned.
+
+        Today's rollups and this month's are still receiving live sales, which
+        a scan could miss, so they are left to `record_sales`. Closed rollups
+        are replaced a month at a time and stamped with when this run began;
+        the ones in range left unstamped, for periods without sales any more,
+        are deleted at the end. Runs from several workers at once converge on
+        the same documents.
+        """
+        started = datetime.utcnow()
+        opened = open_periods(started)
+        date_filter = {}
+        if start is not None:
+            start = month_start(start)
+            date_filter["$gte"] = datetime.combine(start, datetime.min.time())
+        if end is not None:
+            end = next_month(end - timedelta(days=1))
+            date_filter["$lt"] = datetime.combine(end, datetime.min.time())
+        closed = {
+            period: {**date_filter, "$lt": min(date_filter.get("$lt", opened[period]), opened[period])}
+            for period in PERIODS
+        }
+
+        categories = {
+            medicine["id"]: medicine.get("category")
+            async for medicine in self.db.medicines.find({}, {"_id": 0, "id": 1, "category": 1})
+        }
+        rollups: Dict[str, Dict[str, Any]] = {}
+        medicines: Dict[str, Dict[str, Any]] = {}
+        scanned = written = 0
+        month = None
+
+        async def flush():
+            nonlocal written
+            docs = [
+                {
+                    "_id": key,
+                    "period": rollup["period"],
+                    "start": rollup["start"],
+                    "rebuilt_at": started,
+                    **_nest({**rollup["counters"], **rollup["names"]}),
+                }
+                for key, rollup in rollups.items()
+                if rollup["start"] < opened[rollup["period"]]
+            ]
+            medicine_docs = [
+                {"_id": key, **doc, "rebuilt_at": started}
+                for key, doc in medicines.items()
+                if doc["start"] < opened[doc["period"]]
+            ]
+            if docs:
+                await self.collection.bulk_write(
+                    [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs], ordered=False
+                )
+            if medicine_docs:
+                await self.medicines.bulk_write(
+                    [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in medicine_docs], ordered=False
+                )
+            written += len(docs)
+            rollups.clear()
+            medicines.clear()
+
+        # Oldest first, so each month is complete when the next one starts
+        sales = self.sales.iter_sales(date_filter.get("$gte"), closed["day"]["$lt"], newest_first=False, batch_size=1000)
+        async for sale in sales:
+            scanned += 1
+            day = sale["sale_date"].date()
+            if month_start(day) != month:
+                await flush()
+                month = month_start(day)
+            increments, names = sale_increments(sale, categories)
+            for period in PERIODS:
+                key = rollup_key(period, day)
+                period_begin = datetime.combine(period_start(period, day), datetime.min.time())
+                rollup = rollups.setdefault(key, {
+                    "counters": defaultdict(int),
+                    "names": {},
+                    "period": period,
+                    "start": period_begin,
+                })
+                for path, value in increments.items():
+                    rollup["counters"][path] += value
+                rollup["names"].update(names)
+                for medicine_id, total in medicine_increments(sale).items():
+                    entry = medicines.setdefault(medicine_rollup_key(key, medicine_id), {
+                        "rollup": key,
+                        "period": period,
+                        "start": period_begin,
+                        "medicine_id": medicine_id,
+                        "units": 0,
+                        "revenue": 0.0,
+                    })
+                    entry["name"] = total["name"]
+                    entry["units"] += total["units"]
+                    entry["revenue"] += total["revenue"]
+        await flush()
+
+        stale = {
+            "rebuilt_at": {"$not": {"$gte": started}},
+            "$or": [{"period": period, "start": bounds} for period, bounds in closed.items()],
+        }
+        await self.collection.delete_many(stale)
+        await self.medicines.delete_many(stale)
+        logger.info("Rebuilt %d sales rollups from %d sales", written, scanned)
+        return scanned
+
+    async def series(self, period: str, start: date, end: date) -> List[Dict[str, Any]]:
+        """Totals per day or month in [start, end), without the breakdowns."""
+        docs = await self.collection.find(
+            {
+                "period": period,
+                "start": {
+                    "$gte": datetime.combine(start, datetime.min.time()),
+                    "$lt": datetime.combine(end, datetime.min.time()),
+                },
+            },
+            {"_id": 0, "medicines": 0, "categories": 0, "rebuilt_at": 0},
+        ).sort("start", 1).to_list(None)
+        return docs
+
+    async def _breakdown(self, field: str, start: date, end: date) -> Dict[str, Dict[str, Any]]:
+        totals: Dict[str, Dict[str, Any]] = {}
+        async for doc in self.collection.find({"_id": {"$in": plan_periods(start, end)}}, {"_id": 0, field: 1}):
+            for key, entry in doc.get(field, {}).items():
+                total = totals.setdefault(key, {"units": 0, "revenue": 0.0})
+                total["units"] += entry.get("units", 0)
+                total["revenue"] += entry.get("revenue", 0)
+                total.update({k: v for k, v in entry.items() if k not in ("units", "revenue")})
+        return totals
+
+    async def top_medicines(self, start: date, end: date, limit: int = 10, by: str = "units") -> List[Dict[str, Any]]:
+        return await self.medicines.aggregate([
+            {"$match": {"rollup": {"$in": plan_periods(start, end)}}},
+            {"$group": {
+                "_id": "$medicine_id",
+                "units": {"$sum": "$units"},
+                "revenue": {"$sum": "$revenue"},
+                "name": {"$last": "$name"},
+            }},
+            {"$sort": {by: -1, "_id": 1}},
+            {"$limit": limit},
+            {"$project": {"_id": 0, "medicine_id": "$_id", "name": 1, "units": 1, "revenue": 1}},
+        ]).to_list(limit)
+
+    async def category_mix(self, start: date, end: date) -> List[Dict[str, Any]]:
+        totals = await self._breakdown("categories", start, end)
+        revenue = sum(entry["revenue"] for entry in totals.values()) or 1
+        return sorted(
+            ({**entry, "revenue_share": entry["revenue"] / revenue} for entry in totals.values()),
+            key=lambda entry: entry["revenue"],
+            reverse=True,
+        )
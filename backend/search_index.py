@@ -0,0 +1,218 @@
+import bisect
+import heapq
+import re
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Searchable medicine fields and how much a match in each counts towards the rank
+FIELD_WEIGHTS = {
+    "name": 4.0,
+    "generic_name": 3.0,
+    "manufacturer": 1.5,
+    "category": 1.0,
+}
+
+# Match quality per query token
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.8
+SUBSTRING_SCORE = 0.5
+FUZZY_SCORE = 0.4
+
+# Upper bound on index tokens a single short prefix may expand to
+MAX_PREFIX_EXPANSION = 500
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+def trigrams(token: str) -> Set[str]:
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def padded_trigrams(token: str) -> Set[str]:
+    return trigrams(f" {token} ")
+
+
+def max_edits(token: str) -> int:
+    if len(token) < 4:
+        return 0
+    return 1 if len(token) < 8 else 2
+
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> Optional[int]:
+    """Edit distance between a and b, or None once it is known to exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb),
+            ))
+        if min(current) > limit:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= limit else None
+
+
+class MedicineSearchIndex:
+    """In-memory typeahead index over the medicine catalog.
+
+    Tokens from the searchable fields are kept in a sorted list for prefix
+    lookups and in a trigram map for substring and typo-tolerant lookups.
+    The routes that write medicines keep it current with `add`/`remove`.
+    """
+
+    def __init__(self, field_weights: Dict[str, float] = FIELD_WEIGHTS):
+        self.field_weights = field_weights
+        self._reset()
+
+    def _reset(self):
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._doc_tokens: Dict[str, Dict[str, float]] = {}
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._sorted_tokens: List[str] = []
+        self._grams: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def load(self, docs: Iterable[Dict[str, Any]]):
+        """Replace the whole index with the given documents."""
+        fresh = MedicineSearchIndex(self.field_weights)
+        for doc in {doc["id"]: doc for doc in docs}.values():
+            fresh._index(doc)
+        # Sorted and gram-indexed once here; add() keeps them current one token at a time
+        fresh._sorted_tokens = sorted(fresh._postings)
+        grams: Dict[str, Set[str]] = defaultdict(set)
+        for token in fresh._sorted_tokens:
+            for gram in padded_trigrams(token):
+                grams[gram].add(token)
+        fresh._grams = dict(grams)
+        self.__dict__.update(fresh.__dict__)
+
+    def add(self, doc: Dict[str, Any]):
+        """Insert or replace a medicine document."""
+        if doc["id"] in self._docs:
+            self.remove(doc["id"])
+        for token in self._index(doc):
+            bisect.insort(self._sorted_tokens, token)
+            self._add_grams(token)
+
+    def _index(self, doc: Dict[str, Any]) -> List[str]:
+        """Add a document to the postings, returning the tokens new to the index."""
+        doc_id = doc["id"]
+        weights: Dict[str, float] = {}
+        for field, weight in self.field_weights.items():
+            for token in tokenize(doc.get(field)):
+                weights[token] = max(weights.get(token, 0.0), weight)
+
+        self._docs[doc_id] = {k: v for k, v in doc.items() if k != "_id"}
+        self._doc_tokens[doc_id] = weights
+        new_tokens = []
+        for token, weight in weights.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                new_tokens.append(token)
+            postings[doc_id] = weight
+        return new_tokens
+
+    def _add_grams(self, token: str):
+        for gram in padded_trigrams(token):
+            self._grams.setdefault(gram, set()).add(token)
+
+    def remove(self, doc_id: str):
+        if self._docs.pop(doc_id, None) is None:
+            return
+        for token in self._doc_tokens.pop(doc_id, {}):
+            postings = self._postings[token]
+            postings.pop(doc_id, None)
+            if postings:
+                continue
+            del self._postings[token]
+            position = bisect.bisect_left(self._sorted_tokens, token)
+            del self._sorted_tokens[position]
+            for gram in padded_trigrams(token):
+                tokens = self._grams.get(gram)
+                if tokens is not None:
+                    tokens.discard(token)
+                    if not tokens:
+                        del self._grams[gram]
+
+    def _covered_docs(self, tokens: Iterable[str], limit: int) -> int:
+        covered = 0
+        for token in tokens:
+            covered += len(self._postings[token])
+            if covered >= limit:
+                break
+        return covered
+
+    def _token_matches(self, query_token: str, limit: int) -> Dict[str, float]:
+        """Index tokens matching one query token, with their match quality."""
+        matches: Dict[str, float] = {}
+        if query_token in self._postings:
+            matches[query_token] = EXACT_SCORE
+
+        start = bisect.bisect_left(self._sorted_tokens, query_token)
+        for token in self._sorted_tokens[start:start + MAX_PREFIX_EXPANSION]:
+            if not token.startswith(query_token):
+                break
+            matches.setdefault(token, PREFIX_SCORE)
+
+        if len(query_token) >= 3:
+            gram_sets = sorted((self._grams.get(g, set()) for g in trigrams(query_token)), key=len)
+            candidates = set(gram_sets[0]).intersection(*gram_sets[1:]) if gram_sets else set()
+            for token in candidates:
+                if query_token in token:
+                    matches.setdefault(token, SUBSTRING_SCORE)
+
+        edits = max_edits(query_token)
+        if edits and self._covered_docs(matches, limit) < limit:
+            query_grams = padded_trigrams(query_token)
+            overlap = Counter()
+            for gram in query_grams:
+                overlap.update(self._grams.get(gram, ()))
+            # Every edit destroys at most three padded trigrams
+            min_overlap = len(query_grams) - 3 * edits
+            for token, shared in overlap.items():
+                if shared < min_overlap or token in matches:
+                    continue
+                distance = bounded_levenshtein(query_token, token, edits)
+                if distance is None:
+                    # Also accept typos inside the typed prefix of a longer token
+                    distance = bounded_levenshtein(query_token, token[:len(query_token)], edits)
+                if distance is not None:
+                    matches[token] = FUZZY_SCORE / (1 + distance)
+        return matches
+
+    def search(self, query: str, limit: int = 100) -> List[Dict[str, Any]]:
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens:
+            return []
+
+        scores: Optional[Dict[str, float]] = None
+        for query_token in query_tokens:
+            token_scores: Dict[str, float] = {}
+            for token, quality in self._token_matches(query_token, limit).items():
+                for doc_id, weight in self._postings[token].items():
+                    score = quality * weight
+                    if score > token_scores.get(doc_id, 0.0):
+                        token_scores[doc_id] = score
+            # Every query token has to match somewhere in the document
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {doc_id: scores[doc_id] + s for doc_id, s in token_scores.items() if doc_id in scores}
+            if not scores:
+                return []
+
+        # Bounded selection of the best `limit`, a broad query can match most of the catalog
+        ranked = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], self._docs[item[0]].get("name", "")))
+        return [self._docs[doc_id] for doc_id, _ in ranked]
@@ -1,31 +1,196 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Response, UploadFile, File
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.core import AgnosticBaseCursor
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
 import os
+import csv
+import orjson
+import asyncio
 import logging
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 import uuid
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from decimal import Decimal
 
+from catalog_cache import CatalogCache
+from collection_versions import CollectionVersions, digest, etag_matches, quote_etag
+from dashboard_stats import DashboardStats
+from events import ChangeStreamRelay, EventBus, ExpiryWatcher, stock_alerts
+from forecasting import DemandForecast
+from indexes import IndexManager
+from lots import (
+    MAX_LOT_WRITE_ATTEMPTS, ConcurrentLotUpdate, InsufficientStock,
+    adjust, consume, insert_lot, lot_fields, lots_of, new_lot, restore, revision_filter, upsert_lot,
+)
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, CommandMetrics, Metrics, MetricsMiddleware, watch_to_list
+from medicine_import import detect_format, iter_chunks, next_validated_chunk
+from sales_export import iter_csv, iter_parquet, parquet_available
+from sale_queue import PendingSale, SaleQueue, SaleQueueClosed, SaleQueueFull
+from sales_partitions import SalesPartitions, decode_key, encode_key
+from sales_rollups import SalesRollups
+from search_index import MedicineSearchIndex
+from storage import MONGO, open_storage
+from stock_ledger import ADJUSTMENT, RESTOCK, SALE, SALE_REVERSAL, WRITE_OFF, StockLedger
+from sync import ChangeSequence, DeltaSync, change_fields
+from valuation import InventoryValuation
+
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Request, MongoDB command and cursor size metrics, served at /metrics
+metrics = Metrics()
+# to_list() results at least this large are logged as warnings
+TO_LIST_WARN_DOCUMENTS = int(os.environ.get('TO_LIST_WARN_DOCUMENTS', '5000'))
+watch_to_list(AgnosticBaseCursor, metrics, TO_LIST_WARN_DOCUMENTS)
 
-# Create the main app without a prefix
-app = FastAPI()
+# MongoDB connection pool and timeouts; unset variables keep the driver defaults
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": "MONGO_MAX_POOL_SIZE",
+    "minPoolSize": "MONGO_MIN_POOL_SIZE",
+    "maxConnecting": "MONGO_MAX_CONNECTING",
+    "maxIdleTimeMS": "MONGO_MAX_IDLE_TIME_MS",
+    "waitQueueTimeoutMS": "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+    "serverSelectionTimeoutMS": "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+    "connectTimeoutMS": "MONGO_CONNECT_TIMEOUT_MS",
+    "socketTimeoutMS": "MONGO_SOCKET_TIMEOUT_MS",
+}
+
+def mongo_client_options() -> dict:
+    return {
+        option: int(os.environ[variable])
+        for option, variable in MONGO_CLIENT_OPTIONS.items()
+        if os.environ.get(variable)
+    }
+
+# Database engine: `mongo`, or `memory` for test runs without a server (not for deployments), see storage.py
+STORAGE_ENGINE = os.environ.get('STORAGE_ENGINE', MONGO)
+
+# Motor connects lazily, so building the client at import time opens no
+# sockets or threads and stays safe to fork under gunicorn --preload; the
+# lifespan handler below connects and warms the pool in each worker.
+storage = open_storage(
+    STORAGE_ENGINE,
+    os.environ.get('DB_NAME', 'pharmacy'),
+    mongo_url=os.environ.get('MONGO_URL'),
+    event_listeners=[CommandMetrics(metrics)],
+    client_options=mongo_client_options(),
+)
+client = storage.client
+db = storage.db
+
+index_manager = IndexManager(db)
+sales_partitions = SalesPartitions(
+    db,
+    index_manager,
+    hot_months=int(os.environ.get('SALES_HOT_MONTHS', '12')),
+    compress_archive=storage.server_features,
+)
+search_index = MedicineSearchIndex()
+inventory_valuation = InventoryValuation()
+dashboard_stats = DashboardStats(db, sales_partitions)
+sales_rollups = SalesRollups(db, sales_partitions)
+collection_versions = CollectionVersions(db)
+change_sequence = ChangeSequence(db)
+delta_sync = DeltaSync(
+    db,
+    change_sequence,
+    settle_seconds=float(os.environ.get('SYNC_SETTLE_SECONDS', '5')),
+    tombstone_days=int(os.environ.get('SYNC_TOMBSTONE_DAYS', '30')),
+)
+stock_ledger = StockLedger(db, snapshot_every=int(os.environ.get('STOCK_SNAPSHOT_EVERY', '50')))
+event_bus = EventBus()
+expiry_watcher = ExpiryWatcher(db, event_bus)
+sale_queue = SaleQueue(
+    lambda group: commit_sale_group(group),
+    max_pending=int(os.environ.get('SALES_QUEUE_SIZE', '1000')),
+    group_size=int(os.environ.get('SALES_GROUP_SIZE', '200')),
+    enqueue_timeout=float(os.environ.get('SALES_ENQUEUE_TIMEOUT_SECONDS', '5')),
+)
+demand_forecast = DemandForecast(
+    db,
+    sales_partitions,
+    lookback_days=int(os.environ.get('FORECAST_LOOKBACK_DAYS', '90')),
+    half_life_days=float(os.environ.get('FORECAST_HALF_LIFE_DAYS', '14')),
+)
+
+# Full reload interval for the in-memory search index, keeps multiple workers converging
+SEARCH_INDEX_REFRESH_SECONDS = int(os.environ.get('SEARCH_INDEX_REFRESH_SECONDS', '300'))
+# Recompute interval for the materialized dashboard counters
+STATS_RECONCILE_SECONDS = int(os.environ.get('STATS_RECONCILE_SECONDS', '300'))
+# How often lots that expired since the last check are pushed to /api/events and added to the expired count
+EXPIRY_CHECK_SECONDS = int(os.environ.get('EXPIRY_CHECK_SECONDS', '60'))
+# Feed /api/events from change streams so every worker sees every write (replica set only)
+EVENTS_CHANGE_STREAMS = os.environ.get('EVENTS_CHANGE_STREAMS', '').lower() in ('1', 'true', 'yes')
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get('EVENTS_HEARTBEAT_SECONDS', '15'))
+# Queue POST /api/sales and write sales in groups, see sale_queue.py
+SALES_GROUP_COMMIT = os.environ.get('SALES_GROUP_COMMIT', '').lower() in ('1', 'true', 'yes')
+# How often months older than SALES_HOT_MONTHS are moved to the compressed sales archive
+SALES_ARCHIVE_CHECK_SECONDS = int(os.environ.get('SALES_ARCHIVE_CHECK_SECONDS', '86400'))
+# How often delete tombstones older than SYNC_TOMBSTONE_DAYS are pruned
+SYNC_PRUNE_SECONDS = int(os.environ.get('SYNC_PRUNE_SECONDS', '86400'))
+# Recompute interval for the demand forecast behind /api/forecast
+FORECAST_REFRESH_SECONDS = int(os.environ.get('FORECAST_REFRESH_SECONDS', '3600'))
+# Connections opened before a worker reports ready, and the readiness ping timeout
+POOL_WARMUP_CONNECTIONS = int(os.environ.get('POOL_WARMUP_CONNECTIONS', '10'))
+READINESS_TIMEOUT_SECONDS = float(os.environ.get('READINESS_TIMEOUT_SECONDS', '2'))
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Pagination settings
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Bulk import settings
+IMPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_IMPORT_ERRORS = 1000
+# Items accepted by one bulk PATCH /api/medicines
+MAX_BULK_UPDATE_ITEMS = 50000
+# Bulk writes changing more medicines than this push `catalog_reloaded` instead of one event each
+MAX_PUSHED_CHANGES = 100
+
+# Low stock flag, kept in sync with stock_quantity/min_stock_level on every write
+# so low stock lookups hit a partial index instead of scanning the catalog
+LOW_STOCK_STAGE = {"$set": {"is_low_stock": {"$lte": ["$stock_quantity", "$min_stock_level"]}}}
+
+# Set at startup: multi-document transactions need a replica set or mongos
+transactions_supported = False
+# Set at startup: write routes stop publishing once the change stream relay runs
+events_from_change_streams = False
+
+# Lot Models
+class MedicineLot(BaseModel):
+    lot_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    batch_number: str
+    expiry_date: datetime
+    quantity: int
+    purchase_price: Optional[float] = None
+    received_at: datetime = Field(default_factory=datetime.utcnow)
+
+class LotCreate(BaseModel):
+    batch_number: str
+    expiry_date: datetime
+    quantity: int
+    purchase_price: Optional[float] = None
+
+class LotAllocation(BaseModel):
+    medicine_id: str
+    lot_id: str
+    batch_number: str
+    expiry_date: datetime
+    purchase_price: Optional[float] = None
+    quantity: int
+
 # Medicine Models
 class Medicine(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -41,6 +206,8 @@ class Medicine(BaseModel):
     selling_price: float
     stock_quantity: int
     min_stock_level: int
+    # In-stock lots, earliest expiry first; batch_number and expiry_date mirror the first one
+    lots: List[MedicineLot] = Field(default_factory=list)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -55,7 +222,7 @@ class MedicineCreate(BaseModel):
     expiry_date: datetime
     purchase_price: float
     selling_price: float
-    stock_quantity: int
+    stock_quantity: int = Field(ge=0)
     min_stock_level: int
 
 class MedicineUpdate(BaseModel):
@@ -69,9 +236,12 @@ class MedicineUpdate(BaseModel):
     expiry_date: Optional[datetime] = None
     purchase_price: Optional[float] = None
     selling_price: Optional[float] = None
-    stock_quantity: Optional[int] = None
+    stock_quantity: Optional[int] = Field(None, ge=0)
     min_stock_level: Optional[int] = None
 
+class MedicineBulkUpdate(MedicineUpdate):
+    id: str
+
 # Customer Models
 class Customer(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -107,6 +277,7 @@ class Sale(BaseModel):
     tax_amount: float = 0
     total_amount: float
     payment_method: str = "cash"
+    lot_allocations: List[LotAllocation] = Field(default_factory=list)
     sale_date: datetime = Field(default_factory=datetime.utcnow)
 
 class SaleCreate(BaseModel):
@@ -135,80 +306,848 @@ class SupplierCreate(BaseModel):
     email: Optional[str] = None
     address: Optional[str] = None
 
+# Serialization Helpers
+# Documents read back from our own collections were validated when they were
+# written, so read routes project them to the response model's fields in the
+# query and hand them straight to orjson instead of re-validating each one.
+def model_fields(model) -> List[str]:
+    return list(model.model_fields)
+
+def model_projection(model) -> dict:
+    return {"_id": 0, **{field: 1 for field in model.model_fields}}
+
+def pick_fields(doc: dict, fields: List[str]) -> dict:
+    return {field: doc[field] for field in fields if field in doc}
+
+MEDICINE_FIELDS = model_fields(Medicine)
+MEDICINE_PROJECTION = model_projection(Medicine)
+
+catalog_cache = CatalogCache(
+    db.medicines,
+    fields=MEDICINE_FIELDS,
+    max_entries=int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', '50000')),
+    max_pages=int(os.environ.get('CATALOG_CACHE_MAX_PAGES', '1000')),
+    ttl_seconds=float(os.environ.get('CATALOG_CACHE_TTL_SECONDS', '30')),
+)
+
+def json_response(content, etag: Optional[str] = None, next_cursor: Optional[str] = None) -> ORJSONResponse:
+    headers = cache_headers(etag) if etag else {}
+    if next_cursor is not None:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    return ORJSONResponse(content, headers=headers)
+
+def tagged_json_response(request: Request, content, next_cursor: Optional[str] = None) -> Response:
+    """JSON response tagged with a digest of the bytes actually sent.
+
+    For bodies served from the per-worker catalog cache: the shared collection
+    version may already count writes the cached body does not show yet, so
+    the ETag has to come from the body itself.
+    """
+    body = ORJSONResponse(content).body
+    etag = quote_etag(digest(body + (next_cursor or "").encode()))
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+    headers = cache_headers(etag)
+    if next_cursor is not None:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    return Response(body, media_type="application/json", headers=headers)
+
+# Pagination Helpers
+async def fetch_page(collection, limit: int, after: Optional[str] = None, projection: Optional[dict] = None):
+    """Keyset page over the `id` field, returned with the cursor for the next page."""
+    query = {"id": {"$gt": after}} if after else {}
+    docs = await collection.find(query, projection or {"_id": 0}).sort("id", 1).limit(limit + 1).to_list(limit + 1)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        return docs, docs[-1]["id"]
+    return docs, None
+
+async def iter_ndjson(collection, projection: dict, after: Optional[str] = None):
+    """Yield documents as NDJSON lines while the cursor is being consumed."""
+    query = {"id": {"$gt": after}} if after else {}
+    cursor = collection.find(query, projection).sort("id", 1).batch_size(STREAM_BATCH_SIZE)
+    async for doc in cursor:
+        yield orjson.dumps(doc) + b"\n"
+
+def ndjson_response(collection, model, after: Optional[str] = None, headers: Optional[dict] = None):
+    return StreamingResponse(
+        iter_ndjson(collection, model_projection(model), after),
+        media_type="application/x-ndjson",
+        headers=headers,
+    )
+
+async def list_response(request: Request, collection, model, limit: int, after: Optional[str], stream: bool):
+    """Conditional, paged or streamed listing shared by the collection list routes."""
+    etag = await collection_versions.etag(collection.name, key=str(request.url.query))
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+    if stream:
+        return ndjson_response(collection, model, after, cache_headers(etag))
+    docs, next_cursor = await fetch_page(collection, limit, after, model_projection(model))
+    return json_response(docs, etag, next_cursor)
+
+# Conditional GET Helpers
+def cache_headers(etag: str) -> dict:
+    # no-cache lets browsers keep the body but revalidate it with If-None-Match every time
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """A 304 response if the client already holds the representation tagged etag."""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers(etag))
+    return None
+
+def start_of_day(day: date) -> datetime:
+    return datetime.combine(day, datetime.min.time())
+
+# Stock Helpers
+# Stock is held per lot (see lots.py). Lot changes are computed from the
+# document as read and written back only if its lot_revision is unchanged,
+# so concurrent checkouts never allocate the same units twice.
+def lot_update(medicine: dict, lots: list, fields: Optional[dict] = None):
+    """Revision-guarded write of new lots, with the document it produces."""
+    medicine = {**medicine, **(fields or {})}
+    changes = {**(fields or {}), **lot_fields(medicine, lots)}
+    return UpdateOne(revision_filter(medicine), {"$set": changes}), {**medicine, **changes}
+
+async def modify_lots(medicine_id: str, change, fields: Optional[dict] = None):
+    """Apply change(medicine) -> lots to one medicine, retrying on conflicts.
+
+    Returns the medicine before and after the write.
+    """
+    for _ in range(MAX_LOT_WRITE_ATTEMPTS):
+        medicine = await db.medicines.find_one({"id": medicine_id}, {"_id": 0})
+        if medicine is None:
+            raise HTTPException(status_code=404, detail="Medicine not found")
+        stamp = change_fields(await change_sequence.next())
+        update, updated = lot_update(medicine, change(medicine), {**(fields or {}), **stamp})
+        result = await db.medicines.bulk_write([update])
+        if result.matched_count:
+            return medicine, updated
+    raise HTTPException(status_code=409, detail="Medicine was modified concurrently, please retry")
+
+def plan_sale(
+    medicines: List[dict], quantities: Dict[str, int], names: Dict[str, str], seqs: Optional[Iterator[int]] = None
+):
+    """FEFO picks for every line of a sale.
+
+    Returns the lot updates, the (before, after) medicine documents and the
+    allocations to record on the sale. Updates are stamped with change
+    numbers from seqs when given.
+    """
+    now = datetime.utcnow()
+    by_id = {medicine["id"]: medicine for medicine in medicines}
+    updates, changes, allocations, short = [], [], [], []
+    for medicine_id, quantity in quantities.items():
+        medicine = by_id.get(medicine_id)
+        if medicine is None:
+            raise HTTPException(status_code=404, detail=f"Medicine {names[medicine_id]} not found")
+        try:
+            lots, picked = consume(lots_of(medicine), quantity, now)
+        except InsufficientStock as e:
+            short.append(f"{names[medicine_id]} (requested {e.requested}, available {e.available})")
+            continue
+        update, updated = lot_update(medicine, lots, change_fields(next(seqs)) if seqs is not None else None)
+        updates.append(update)
+        changes.append((medicine, updated))
+        allocations += [{"medicine_id": medicine_id, **allocation} for allocation in picked]
+    if short:
+        raise HTTPException(status_code=409, detail="Insufficient stock: " + ", ".join(short))
+    return updates, changes, allocations
+
+async def commit_sale_in_transaction(sale_doc: dict, quantities: Dict[str, int], names: Dict[str, str]):
+    """Allocate every line, write the lots and insert the sale, all or nothing."""
+    # Index builds do not belong inside the transaction; first sale of a month creates its partition here
+    await sales_partitions.collection_for(sale_doc["sale_date"])
+    for _ in range(MAX_LOT_WRITE_ATTEMPTS):
+        try:
+            async with await client.start_session() as session:
+                async with session.start_transaction():
+                    medicines = await db.medicines.find(
+                        {"id": {"$in": list(quantities)}}, {"_id": 0}, session=session
+                    ).to_list(None)
+                    seqs = iter(await change_sequence.allocate(len(quantities)))
+                    updates, changes, allocations = plan_sale(medicines, quantities, names, seqs)
+                    result = await db.medicines.bulk_write(updates, ordered=False, session=session)
+                    if result.matched_count != len(updates):
+                        # Raising inside the block aborts the transaction
+                        raise ConcurrentLotUpdate()
+                    await sales_partitions.insert_one({**sale_doc, "lot_allocations": allocations}, session=session)
+                    return changes, allocations
+        except ConcurrentLotUpdate:
+            continue
+        except PyMongoError as e:
+            if not e.has_error_label("TransientTransactionError"):
+                raise
+    raise HTTPException(status_code=409, detail="Stock changed during checkout, please retry")
+
+async def commit_sale_with_compensation(sale_doc: dict, quantities: Dict[str, int], names: Dict[str, str]):
+    """Standalone mongod fallback: allocate one medicine at a time, put the stock back if anything fails."""
+    changes, allocations = [], []
+    try:
+        for medicine_id, quantity in quantities.items():
+            for _ in range(MAX_LOT_WRITE_ATTEMPTS):
+                medicines = await db.medicines.find({"id": medicine_id}, {"_id": 0}).to_list(1)
+                seqs = iter(await change_sequence.allocate())
+                updates, medicine_changes, picked = plan_sale(medicines, {medicine_id: quantity}, names, seqs)
+                result = await db.medicines.bulk_write(updates)
+                if result.matched_count:
+                    break
+            else:
+                raise HTTPException(status_code=409, detail="Stock changed during checkout, please retry")
+            changes += medicine_changes
+            allocations += picked
+        await sales_partitions.insert_one({**sale_doc, "lot_allocations": allocations})
+    except BaseException:
+        for _, medicine in changes:
+            returned = [allocation for allocation in allocations if allocation["medicine_id"] == medicine["id"]]
+            await modify_lots(medicine["id"], lambda current: restore(lots_of(current), returned))
+        raise
+    return changes, allocations
+
+def plan_sale_group(medicines: List[dict], group: List[PendingSale], seqs: Iterator[int]):
+    """FEFO picks for queued sales in queue order, each seeing the stock the previous ones left.
+
+    Returns the accepted (sale, allocations) pairs, the rejected (sale, error)
+    pairs, one lot update per medicine and the (before, after) documents.
+    """
+    originals = {medicine["id"]: medicine for medicine in medicines}
+    current = dict(originals)
+    accepted, rejected = [], []
+    for pending in group:
+        try:
+            _, changes, allocations = plan_sale(
+                [current[medicine_id] for medicine_id in pending.quantities if medicine_id in current],
+                pending.quantities,
+                pending.names,
+            )
+        except HTTPException as e:
+            rejected.append((pending, e))
+            continue
+        for _, updated in changes:
+            current[updated["id"]] = updated
+        accepted.append((pending, allocations))
+    updates, changes = {}, []
+    for medicine_id in {medicine_id for pending, _ in accepted for medicine_id in pending.quantities}:
+        # One write per medicine, guarded by the revision that was read
+        updates[medicine_id], updated = lot_update(
+            originals[medicine_id], current[medicine_id]["lots"], change_fields(next(seqs))
+        )
+        changes.append((originals[medicine_id], updated))
+    return accepted, rejected, updates, changes
+
+def sale_group_ids(group: List[PendingSale]) -> List[str]:
+    return list({medicine_id for pending in group for medicine_id in pending.quantities})
+
+async def write_sale_group_in_transaction(group: List[PendingSale]):
+    """Write a group all or nothing; a conflict on any medicine replans the whole group."""
+    for pending in group:
+        await sales_partitions.collection_for(pending.sale["sale_date"])
+    async with await client.start_session() as session:
+        async with session.start_transaction():
+            medicines = await db.medicines.find(
+                {"id": {"$in": sale_group_ids(group)}}, {"_id": 0}, session=session
+            ).to_list(None)
+            seqs = iter(await change_sequence.allocate(len(medicines)))
+            accepted, rejected, updates, changes = plan_sale_group(medicines, group, seqs)
+            if updates:
+                result = await db.medicines.bulk_write(list(updates.values()), ordered=False, session=session)
+                if result.matched_count != len(updates):
+                    raise ConcurrentLotUpdate()
+            if accepted:
+                await sales_partitions.insert_many(
+                    [{**pending.sale, "lot_allocations": allocations} for pending, allocations in accepted],
+                    session=session,
+                )
+    return accepted, rejected, changes, []
+
+async def write_sale_group_with_compensation(group: List[PendingSale]):
+    """Standalone mongod: one guarded write per medicine, all in flight at once.
+
+    Sales touching a medicine that changed underneath are returned for
+    another attempt, with what they took from their other medicines put back.
+    """
+    medicines = await db.medicines.find({"id": {"$in": sale_group_ids(group)}}, {"_id": 0}).to_list(None)
+    seqs = iter(await change_sequence.allocate(len(medicines)))
+    accepted, rejected, updates, changes = plan_sale_group(medicines, group, seqs)
+    results = await asyncio.gather(*(db.medicines.bulk_write([update]) for update in updates.values()))
+    conflicted = {medicine_id for medicine_id, result in zip(updates, results) if not result.matched_count}
+    written = [change for change in changes if change[0]["id"] not in conflicted]
+    retry = [(pending, allocations) for pending, allocations in accepted if conflicted & set(pending.quantities)]
+    accepted = [(pending, allocations) for pending, allocations in accepted if not conflicted & set(pending.quantities)]
+
+    async def put_back(sales):
+        # What the given sales took from medicines whose write went through
+        for medicine_id in {medicine_id for pending, _ in sales for medicine_id in pending.quantities} - conflicted:
+            returned = [
+                allocation
+                for _, allocations in sales
+                for allocation in allocations
+                if allocation["medicine_id"] == medicine_id
+            ]
+            written.append(await modify_lots(medicine_id, lambda current: restore(lots_of(current), returned)))
+
+    if accepted:
+        try:
+            await sales_partitions.insert_many(
+                [{**pending.sale, "lot_allocations": allocations} for pending, allocations in accepted]
+            )
+        except BaseException:
+            await put_back(accepted + retry)
+            raise
+    await put_back(retry)
+    return accepted, rejected, written, [pending for pending, _ in retry]
+
+async def commit_sale_group(group: List[PendingSale]):
+    """Group commit target of the sale queue: write, then update derived state once for the group."""
+    write = write_sale_group_in_transaction if transactions_supported else write_sale_group_with_compensation
+    pending_sales = group
+    for _ in range(MAX_LOT_WRITE_ATTEMPTS):
+        try:
+            accepted, rejected, changes, pending_sales = await write(pending_sales)
+        except ConcurrentLotUpdate:
+            continue
+        except PyMongoError as e:
+            if not e.has_error_label("TransientTransactionError"):
+                raise
+            continue
+        for pending, error in rejected:
+            pending.fail(error)
+        if accepted:
+            sales = [{**pending.sale, "lot_allocations": allocations} for pending, allocations in accepted]
+            await record_sales(sales, changes)
+            for pending, allocations in accepted:
+                pending.resolve(allocations)
+        if not pending_sales:
+            return
+    for pending in pending_sales:
+        pending.fail(HTTPException(status_code=409, detail="Stock changed during checkout, please retry"))
+
+async def detect_transaction_support() -> bool:
+    if not storage.server_features:
+        return False
+    try:
+        hello = await client.admin.command("hello")
+    except PyMongoError:
+        return False
+    return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+# Import Helpers
+def imported_lot(medicine: MedicineCreate) -> dict:
+    return new_lot(medicine.batch_number, medicine.expiry_date, medicine.stock_quantity, medicine.purchase_price)
+
+def new_medicine_doc(medicine: MedicineCreate) -> dict:
+    medicine_obj = Medicine(**medicine.dict())
+    lots = [imported_lot(medicine)] if medicine.stock_quantity > 0 else []
+    return {**medicine_obj.dict(), **lot_fields(medicine_obj.dict(), lots)}
+
+async def upsert_import_chunk(valid: list, report: dict) -> List[dict]:
+    """Each row is one lot: it replaces the lot with the same batch number or starts a new medicine."""
+    now = datetime.utcnow()
+    read = {}
+    by_batch = {}
+    async for medicine in db.medicines.find(
+        {"lots.batch_number": {"$in": [medicine.batch_number for _, medicine in valid]}}, {"_id": 0}
+    ):
+        read[medicine["id"]] = medicine
+        for lot in medicine["lots"]:
+            by_batch[lot["batch_number"]] = medicine["id"]
+
+    # Rows for the same medicine are folded into one write
+    pending: Dict[str, dict] = {}
+    inserted = set()
+    rows: Dict[str, List[int]] = {}
+    for row, medicine in valid:
+        fields = medicine.dict(exclude={"batch_number", "expiry_date", "stock_quantity"})
+        medicine_id = by_batch.get(medicine.batch_number)
+        if medicine_id is None:
+            doc = new_medicine_doc(medicine)
+            medicine_id = doc["id"]
+            by_batch[medicine.batch_number] = medicine_id
+            inserted.add(medicine_id)
+        else:
+            current = pending.get(medicine_id) or read.get(medicine_id)
+            lots = upsert_lot(lots_of(current), imported_lot(medicine))
+            doc = {**current, **fields, **lot_fields({**current, **fields}, lots), "updated_at": now}
+            if medicine_id in read:
+                doc["lot_revision"] = read[medicine_id].get("lot_revision", 0) + 1
+        pending[medicine_id] = doc
+        rows.setdefault(medicine_id, []).append(row)
+
+    medicine_ids = list(pending)
+    for medicine_id, seq in zip(medicine_ids, await change_sequence.allocate(len(medicine_ids))):
+        pending[medicine_id].update(change_fields(seq))
+    operations = [
+        InsertOne(pending[medicine_id]) if medicine_id in inserted
+        else UpdateOne(revision_filter(read[medicine_id]), {"$set": pending[medicine_id]})
+        for medicine_id in medicine_ids
+    ]
+    failed = {}
+    try:
+        result = await db.medicines.bulk_write(operations, ordered=False)
+        details = result.bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+        failed = {medicine_ids[error["index"]]: error["errmsg"] for error in e.details["writeErrors"]}
+    report["inserted"] += details["nInserted"]
+    report["updated"] += details["nMatched"]
+
+    if details["nMatched"] < len(medicine_ids) - len(inserted):
+        updated_ids = [medicine_id for medicine_id in medicine_ids if medicine_id not in inserted]
+        async for medicine in db.medicines.find({"id": {"$in": updated_ids}}, {"_id": 0, "id": 1, "lot_revision": 1}):
+            if medicine.get("lot_revision") != pending[medicine["id"]]["lot_revision"]:
+                failed.setdefault(medicine["id"], "Medicine was modified during the import, retry this row")
+    for medicine_id, doc in pending.items():
+        if medicine_id not in failed:
+            doc.pop("_id", None)
+            index_medicine(doc)
+    written = [medicine_id for medicine_id in medicine_ids if medicine_id not in failed]
+    await stock_ledger.record(RESTOCK, [(None, pending[medicine_id]) for medicine_id in written if medicine_id in inserted])
+    await stock_ledger.record(ADJUSTMENT, [(read[medicine_id], pending[medicine_id]) for medicine_id in written if medicine_id not in inserted])
+    return [{"row": row, "errors": [message]} for medicine_id, message in failed.items() for row in rows[medicine_id]]
+
+async def write_import_chunk(valid: list, mode: str, report: dict) -> List[dict]:
+    """Write one validated chunk, returning row errors raised by the database."""
+    if not valid:
+        return []
+    if mode == "upsert":
+        return await upsert_import_chunk(valid, report)
+
+    docs = [
+        {**new_medicine_doc(medicine), **change_fields(seq)}
+        for (_, medicine), seq in zip(valid, await change_sequence.allocate(len(valid)))
+    ]
+    failed = {}
+    try:
+        await db.medicines.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        failed = {error["index"]: error["errmsg"] for error in e.details["writeErrors"]}
+    for index, doc in enumerate(docs):
+        if index not in failed:
+            doc.pop("_id", None)
+            index_medicine(doc)
+    await stock_ledger.record(RESTOCK, [(None, doc) for index, doc in enumerate(docs) if index not in failed])
+    report["inserted"] += len(docs) - len(failed)
+    return [{"row": valid[index][0], "errors": [message]} for index, message in failed.items()]
+
+# In-memory Catalog Copies
+# Writes applied while load_search_index builds fresh copies, replayed onto them before the swap
+pending_catalog_writes: Optional[List[Tuple[str, Optional[dict]]]] = None
+
+def index_medicine(doc: dict):
+    """Add or replace a medicine in the search index and the inventory valuation."""
+    search_index.add(doc)
+    inventory_valuation.add(doc)
+    if pending_catalog_writes is not None:
+        pending_catalog_writes.append((doc["id"], doc))
+
+def unindex_medicine(medicine_id: str):
+    search_index.remove(medicine_id)
+    inventory_valuation.remove(medicine_id)
+    if pending_catalog_writes is not None:
+        pending_catalog_writes.append((medicine_id, None))
+
+def build_catalog_copies(medicines: List[dict]) -> Tuple[MedicineSearchIndex, InventoryValuation]:
+    fresh_index = MedicineSearchIndex(search_index.field_weights)
+    fresh_index.load(medicines)
+    # Same documents, so the valuation copy converges across workers on the same schedule
+    fresh_valuation = InventoryValuation(inventory_valuation.groupings)
+    fresh_valuation.load(medicines)
+    return fresh_index, fresh_valuation
+
+# Push Helpers
+def publish_medicine_events(before: Optional[dict], after: Optional[dict]):
+    if events_from_change_streams:
+        return
+    if after is None:
+        event_bus.publish("medicine_deleted", {"id": before["id"]})
+    else:
+        event_bus.publish("medicine", pick_fields(after, MEDICINE_FIELDS))
+    for event_type, data in stock_alerts(before, after):
+        event_bus.publish(event_type, data)
+
+async def publish_stats():
+    # Once per write request, and only while someone is listening
+    if len(event_bus) and not events_from_change_streams:
+        event_bus.publish("stats", await dashboard_stats.read())
+
+async def record_medicine_write(before: Optional[dict], after: dict, movement: str = ADJUSTMENT):
+    """Bring the search index, cache, ETags, dashboard counters, stock ledger and subscribers up to date with a write."""
+    index_medicine(after)
+    catalog_cache.put(after)
+    await collection_versions.bump("medicines")
+    await dashboard_stats.record_medicine_change(before, after)
+    await stock_ledger.record(movement, [(before, after)])
+    publish_medicine_events(before, after)
+    await publish_stats()
+
+async def record_sales(sales: List[dict], changes: List[tuple]):
+    """Bring derived state up to date with committed sales and the (before, after) medicines they changed."""
+    for previous_medicine, updated_medicine in changes:
+        index_medicine(updated_medicine)
+        catalog_cache.put(updated_medicine)
+        publish_medicine_events(previous_medicine, updated_medicine)
+    await dashboard_stats.record_medicine_changes(changes)
+    sale_ids: Dict[str, List[str]] = {}
+    for sale in sales:
+        for medicine_id in {item["medicine_id"] for item in sale["items"]}:
+            sale_ids.setdefault(medicine_id, []).append(sale["id"])
+    # Group commits also report stock put back for sales that have to be retried
+    taken = [(before, after) for before, after in changes if after["stock_quantity"] < before["stock_quantity"]]
+    put_back = [(before, after) for before, after in changes if after["stock_quantity"] > before["stock_quantity"]]
+    await stock_ledger.record(SALE, taken, sale_ids)
+    await stock_ledger.record(SALE_REVERSAL, put_back)
+    await collection_versions.bump("medicines", "sales")
+    await dashboard_stats.record_sales(sales)
+    await sales_rollups.record_sales(sales, {medicine["id"]: medicine.get("category") for _, medicine in changes})
+    if not events_from_change_streams:
+        for sale in sales:
+            event_bus.publish("sale", sale)
+    await publish_stats()
+
 # Medicine Routes
 @api_router.post("/medicines", response_model=Medicine)
 async def create_medicine(medicine: MedicineCreate):
-    medicine_dict = medicine.dict()
-    medicine_obj = Medicine(**medicine_dict)
-    await db.medicines.insert_one(medicine_obj.dict())
-    return medicine_obj
+    medicine_doc = {**new_medicine_doc(medicine), **change_fields(await change_sequence.next())}
+    await db.medicines.insert_one(medicine_doc)
+    medicine_doc.pop("_id", None)
+    catalog_cache.invalidate_pages()
+    await record_medicine_write(None, medicine_doc, RESTOCK)
+    return Medicine(**medicine_doc)
+
+@api_router.post("/medicines/import")
+async def import_medicines(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+    mode: str = Query("insert", pattern="^(insert|upsert)$"),
+):
+    """Bulk import a CSV or NDJSON catalog; upsert mode matches on batch_number."""
+    fmt = format or detect_format(file.filename, file.content_type)
+    if fmt is None:
+        raise HTTPException(status_code=400, detail="Unsupported file format, upload CSV or NDJSON")
+
+    report = {"processed": 0, "inserted": 0, "updated": 0, "failed": 0, "errors": []}
+    chunks = iter_chunks(file.file, fmt, IMPORT_CHUNK_SIZE)
+    try:
+        while True:
+            # Parsing and validation are CPU bound, keep them off the event loop
+            validated = await run_in_threadpool(next_validated_chunk, chunks, MedicineCreate)
+            if validated is None:
+                break
+            valid, errors = validated
+            report["processed"] += len(valid) + len(errors)
+            errors += await write_import_chunk(valid, mode, report)
+            report["failed"] += len(errors)
+            report["errors"].extend(errors[:MAX_REPORTED_IMPORT_ERRORS - len(report["errors"])])
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Could not parse file after {report['processed']} rows: {e}",
+        )
+    finally:
+        if report["inserted"] or report["updated"]:
+            catalog_cache.clear()
+            await collection_versions.bump("medicines")
+            await dashboard_stats.reconcile()
+            if not events_from_change_streams:
+                # Too many rows to push one by one; clients reload the catalog
+                event_bus.publish("catalog_reloaded", {"inserted": report["inserted"], "updated": report["updated"]})
+            await publish_stats()
+
+    report["errors_truncated"] = report["failed"] > len(report["errors"])
+    return report
 
 @api_router.get("/medicines", response_model=List[Medicine])
-async def get_medicines():
-    medicines = await db.medicines.find().to_list(1000)
-    return [Medicine(**medicine) for medicine in medicines]
+async def get_medicines(
+    request: Request,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    stream: bool = False,
+):
+    if stream:
+        etag = await collection_versions.etag("medicines", key=str(request.url.query))
+        unchanged = not_modified(request, etag)
+        if unchanged is not None:
+            return unchanged
+        return ndjson_response(db.medicines, Medicine, after, cache_headers(etag))
+    medicines, next_cursor = await catalog_cache.page(
+        (limit, after), lambda: fetch_page(db.medicines, limit, after, MEDICINE_PROJECTION)
+    )
+    return tagged_json_response(request, medicines, next_cursor)
+
+@api_router.get("/medicines/low-stock", response_model=List[Medicine])
+async def get_low_stock_medicines(limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    medicines = await db.medicines.find({"is_low_stock": True}, MEDICINE_PROJECTION).limit(limit).to_list(limit)
+    return json_response(medicines)
+
+@api_router.get("/medicines/expired", response_model=List[Medicine])
+async def get_expired_medicines(
+    within_days: int = Query(0, ge=0),
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    # Everything expiring before the end of today + within_days (0 = already expired)
+    cutoff = start_of_day(datetime.utcnow().date()) + timedelta(days=within_days + 1)
+    medicines = await db.medicines.find(
+        {"lots.expiry_date": {"$lt": cutoff}}, MEDICINE_PROJECTION
+    ).sort("expiry_date", 1).limit(limit).to_list(limit)
+    return json_response(medicines)
+
+@api_router.get("/lots/expiring")
+async def get_expiring_lots(
+    within_days: int = Query(0, ge=0),
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    """One row per lot expiring before the end of today + within_days, with the stock value at cost."""
+    cutoff = start_of_day(datetime.utcnow().date()) + timedelta(days=within_days + 1)
+    lots = await db.medicines.aggregate([
+        {"$match": {"lots.expiry_date": {"$lt": cutoff}}},
+        {"$unwind": "$lots"},
+        {"$match": {"lots.expiry_date": {"$lt": cutoff}}},
+        {"$sort": {"lots.expiry_date": 1}},
+        {"$limit": limit},
+        {"$project": {
+            "_id": 0,
+            "medicine_id": "$id",
+            "name": 1,
+            "category": 1,
+            "lot_id": "$lots.lot_id",
+            "batch_number": "$lots.batch_number",
+            "expiry_date": "$lots.expiry_date",
+            "quantity": "$lots.quantity",
+            "stock_value": {"$multiply": ["$lots.quantity", {"$ifNull": ["$lots.purchase_price", "$purchase_price"]}]},
+        }},
+    ]).to_list(limit)
+    return json_response(lots)
 
 @api_router.get("/medicines/{medicine_id}", response_model=Medicine)
-async def get_medicine(medicine_id: str):
-    medicine = await db.medicines.find_one({"id": medicine_id})
+async def get_medicine(medicine_id: str, request: Request):
+    medicine = await catalog_cache.get(medicine_id)
     if medicine is None:
         raise HTTPException(status_code=404, detail="Medicine not found")
-    return Medicine(**medicine)
+    return tagged_json_response(request, medicine)
+
+# Stock, batch and expiry edits are applied to the medicine's lots
+LOT_FIELDS = ("stock_quantity", "batch_number", "expiry_date")
+
+def split_update(medicine_update: MedicineUpdate):
+    """The plain field changes of an update, and its lot changes."""
+    update_dict = {k: v for k, v in medicine_update.dict(exclude={"id"}).items() if v is not None}
+    update_dict["updated_at"] = datetime.utcnow()
+    lot_changes = {k: update_dict.pop(k) for k in LOT_FIELDS if k in update_dict}
+    return update_dict, lot_changes
+
+def edited_lots(medicine: dict, lot_changes: dict, update_dict: dict) -> list:
+    lots = lots_of(medicine)
+    if not lots:
+        lot_changes = {"batch_number": medicine["batch_number"], "expiry_date": medicine["expiry_date"], **lot_changes}
+    return adjust(lots, purchase_price=update_dict.get("purchase_price", medicine.get("purchase_price")), **lot_changes)
+
+def updated_fields(medicine: dict, update_dict: dict) -> dict:
+    """The document a plain field update produces, as the LOW_STOCK_STAGE pipeline computes it."""
+    updated = {**medicine, **update_dict}
+    updated["is_low_stock"] = updated["stock_quantity"] <= updated["min_stock_level"]
+    return updated
 
 @api_router.put("/medicines/{medicine_id}", response_model=Medicine)
 async def update_medicine(medicine_id: str, medicine_update: MedicineUpdate):
-    update_dict = {k: v for k, v in medicine_update.dict().items() if v is not None}
-    update_dict["updated_at"] = datetime.utcnow()
+    update_dict, lot_changes = split_update(medicine_update)
+    if lot_changes:
+        previous_medicine, updated_medicine = await modify_lots(
+            medicine_id, lambda medicine: edited_lots(medicine, lot_changes, update_dict), update_dict
+        )
+        await record_medicine_write(previous_medicine, updated_medicine)
+        return Medicine(**updated_medicine)
     
-    result = await db.medicines.update_one(
-        {"id": medicine_id}, 
-        {"$set": update_dict}
+    # One round trip: the document before the update comes back from the write itself
+    update_dict.update(change_fields(await change_sequence.next()))
+    previous_medicine = await db.medicines.find_one_and_update(
+        {"id": medicine_id},
+        [{"$set": {k: {"$literal": v} for k, v in update_dict.items()}}, LOW_STOCK_STAGE],
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE,
     )
     
-    if result.matched_count == 0:
+    if previous_medicine is None:
         raise HTTPException(status_code=404, detail="Medicine not found")
     
-    updated_medicine = await db.medicines.find_one({"id": medicine_id})
+    updated_medicine = updated_fields(previous_medicine, update_dict)
+    await record_medicine_write(previous_medicine, updated_medicine)
+    return Medicine(**updated_medicine)
+
+@api_router.patch("/medicines")
+async def bulk_update_medicines(updates: List[MedicineBulkUpdate]):
+    """Apply many updates with one read and one bulk write; reports a status per item.
+
+    Items follow PUT /medicines/{id} semantics. An item written by anyone
+    else between the read and the write gets 409 and can be resent as is,
+    since updates carry absolute values.
+    """
+    if len(updates) > MAX_BULK_UPDATE_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_UPDATE_ITEMS} updates per request")
+    results = [{"id": update.id, "status": 200} for update in updates]
+    positions: Dict[str, int] = {}
+    for index, update in enumerate(updates):
+        if update.id in positions:
+            results[index].update(status=400, detail="Medicine appears more than once in this request")
+        else:
+            positions[update.id] = index
+
+    medicines = {
+        medicine["id"]: medicine
+        async for medicine in db.medicines.find({"id": {"$in": list(positions)}}, {"_id": 0})
+    }
+    edits = []
+    for medicine_id, index in positions.items():
+        medicine = medicines.get(medicine_id)
+        if medicine is None:
+            results[index].update(status=404, detail="Medicine not found")
+            continue
+        update_dict, lot_changes = split_update(updates[index])
+        lots = None
+        if lot_changes:
+            try:
+                lots = edited_lots(medicine, lot_changes, update_dict)
+            except InsufficientStock as e:
+                results[index].update(status=400, detail=f"Insufficient stock (requested {e.requested}, available {e.available})")
+                continue
+            except ValueError as e:
+                results[index].update(status=400, detail=str(e))
+                continue
+        edits.append((index, medicine, update_dict, lots))
+
+    # Numbers are taken once the writes are planned, just before they land;
+    # every write is guarded on the state it was planned from, so none can
+    # replace a newer change with an older number.
+    seqs = iter(await change_sequence.allocate(len(edits)))
+    operations, planned = [], []
+    for index, medicine, update_dict, lots in edits:
+        update_dict.update(change_fields(next(seqs)))
+        if lots is not None:
+            operation, updated = lot_update(medicine, lots, update_dict)
+        else:
+            operation = UpdateOne(
+                {"id": medicine["id"], "change_seq": medicine.get("change_seq")},
+                [{"$set": {k: {"$literal": v} for k, v in update_dict.items()}}, LOW_STOCK_STAGE],
+            )
+            updated = updated_fields(medicine, update_dict)
+        operations.append(operation)
+        planned.append((index, medicine, updated))
+
+    if operations:
+        result = await db.medicines.bulk_write(operations, ordered=False)
+        if result.matched_count < len(operations):
+            # Written or deleted by someone else since the read; only writes carrying our stamp landed
+            stamps = {
+                medicine["id"]: medicine.get("change_seq")
+                async for medicine in db.medicines.find(
+                    {"id": {"$in": [updated["id"] for _, _, updated in planned]}}, {"_id": 0, "id": 1, "change_seq": 1}
+                )
+            }
+            for index, _, updated in planned:
+                if stamps.get(updated["id"]) != updated["change_seq"]:
+                    results[index].update(status=409, detail="Medicine was modified concurrently, please retry")
+
+    changes = [(medicine, updated) for index, medicine, updated in planned if results[index]["status"] == 200]
+    if changes:
+        for _, updated in changes:
+            index_medicine(updated)
+            catalog_cache.put(updated)
+        await collection_versions.bump("medicines")
+        await dashboard_stats.record_medicine_changes(changes)
+        await stock_ledger.record(ADJUSTMENT, changes)
+        if len(changes) <= MAX_PUSHED_CHANGES:
+            for previous_medicine, updated_medicine in changes:
+                publish_medicine_events(previous_medicine, updated_medicine)
+        elif not events_from_change_streams:
+            event_bus.publish("catalog_reloaded", {"inserted": 0, "updated": len(changes)})
+        await publish_stats()
+
+    return {
+        "updated": len(changes),
+        "failed": len(updates) - len(changes),
+        "results": results,
+    }
+
+@api_router.post("/medicines/{medicine_id}/lots", response_model=Medicine)
+async def receive_lot(medicine_id: str, lot: LotCreate):
+    """Restock with a new lot; existing lots are kept and sold first if they expire earlier."""
+    if lot.quantity <= 0:
+        raise HTTPException(status_code=400, detail="Lot quantity must be positive")
+    lot_obj = MedicineLot(**lot.dict())
+    previous_medicine, updated_medicine = await modify_lots(
+        medicine_id,
+        lambda medicine: insert_lot(lots_of(medicine), lot_obj.dict()),
+        {"updated_at": datetime.utcnow()},
+    )
+    await record_medicine_write(previous_medicine, updated_medicine, RESTOCK)
     return Medicine(**updated_medicine)
 
+@api_router.post("/medicines/{medicine_id}/lots/write-off", response_model=Medicine)
+async def write_off_expired_lots(medicine_id: str):
+    """Remove expired lots from stock, recorded in the stock ledger as an expiry write-off."""
+    now = datetime.utcnow()
+    def change(medicine):
+        lots = lots_of(medicine)
+        remaining = [lot for lot in lots if lot["expiry_date"] > now]
+        if len(remaining) == len(lots):
+            raise HTTPException(status_code=400, detail="Medicine has no expired stock")
+        return remaining
+    previous_medicine, updated_medicine = await modify_lots(medicine_id, change, {"updated_at": now})
+    await record_medicine_write(previous_medicine, updated_medicine, WRITE_OFF)
+    return Medicine(**updated_medicine)
+
+@api_router.get("/medicines/{medicine_id}/stock")
+async def get_stock_at(medicine_id: str, at: datetime):
+    """Stock of a medicine at a past moment, from its latest snapshot before then and the movements since."""
+    stock_quantity = await stock_ledger.stock_at(medicine_id, at)
+    if stock_quantity is None:
+        raise HTTPException(status_code=404, detail="No stock history for this medicine at that time")
+    return {"medicine_id": medicine_id, "at": at, "stock_quantity": stock_quantity}
+
+@api_router.get("/medicines/{medicine_id}/movements")
+async def get_stock_movements(
+    medicine_id: str,
+    start: datetime,
+    end: Optional[datetime] = None,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    """Opening and closing stock of a period with its movements by kind."""
+    return await stock_ledger.report(medicine_id, start, end or datetime.utcnow(), limit)
+
 @api_router.delete("/medicines/{medicine_id}")
 async def delete_medicine(medicine_id: str):
-    result = await db.medicines.delete_one({"id": medicine_id})
-    if result.deleted_count == 0:
+    deleted_medicine = await db.medicines.find_one_and_delete({"id": medicine_id}, projection={"_id": 0})
+    if deleted_medicine is None:
         raise HTTPException(status_code=404, detail="Medicine not found")
+    # Terminals syncing their replica learn about the delete from this
+    await delta_sync.record_deletion("medicines", medicine_id)
+    unindex_medicine(medicine_id)
+    catalog_cache.remove(medicine_id)
+    await collection_versions.bump("medicines")
+    await dashboard_stats.record_medicine_change(deleted_medicine, None)
+    publish_medicine_events(deleted_medicine, None)
+    await publish_stats()
     return {"message": "Medicine deleted successfully"}
 
-@api_router.get("/medicines/low-stock")
-async def get_low_stock_medicines():
-    medicines = await db.medicines.find().to_list(1000)
-    low_stock_medicines = [
-        Medicine(**medicine) for medicine in medicines 
-        if medicine["stock_quantity"] <= medicine["min_stock_level"]
-    ]
-    return low_stock_medicines
-
-@api_router.get("/medicines/expired")
-async def get_expired_medicines():
-    today = datetime.utcnow().date()
-    medicines = await db.medicines.find().to_list(1000)
-    expired_medicines = [
-        Medicine(**medicine) for medicine in medicines 
-        if medicine.get("expiry_date") and medicine["expiry_date"].date() <= datetime.utcnow().date()
-    ]
-    return expired_medicines
-
 # Customer Routes
 @api_router.post("/customers", response_model=Customer)
 async def create_customer(customer: CustomerCreate):
     customer_dict = customer.dict()
     customer_obj = Customer(**customer_dict)
-    await db.customers.insert_one(customer_obj.dict())
+    await db.customers.insert_one({**customer_obj.dict(), **change_fields(await change_sequence.next())})
+    await collection_versions.bump("customers")
     return customer_obj
 
 @api_router.get("/customers", response_model=List[Customer])
-async def get_customers():
-    customers = await db.customers.find().to_list(1000)
-    return [Customer(**customer) for customer in customers]
+async def get_customers(
+    request: Request,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    stream: bool = False,
+):
+    return await list_response(request, db.customers, Customer, limit, after, stream)
 
 # Sale Routes
 @api_router.post("/sales", response_model=Sale)
@@ -229,88 +1168,410 @@ async def create_sale(sale: SaleCreate):
     
     sale_obj = Sale(**sale_dict)
     
-    # Update medicine stock
+    # Combine repeated lines for the same medicine into one guarded decrement
+    quantities: Dict[str, int] = {}
+    names: Dict[str, str] = {}
     for item in sale.items:
-        result = await db.medicines.update_one(
-            {"id": item.medicine_id},
-            {"$inc": {"stock_quantity": -item.quantity}}
-        )
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail=f"Medicine {item.medicine_name} not found")
+        if item.quantity <= 0:
+            raise HTTPException(status_code=400, detail=f"Invalid quantity for {item.medicine_name}")
+        quantities[item.medicine_id] = quantities.get(item.medicine_id, 0) + item.quantity
+        names[item.medicine_id] = item.medicine_name
+    
+    # Lines are allocated to lots first-expiry-first-out, skipping expired lots
+    if SALES_GROUP_COMMIT:
+        try:
+            allocations = await sale_queue.submit(sale_obj.dict(), quantities, names)
+        except SaleQueueFull:
+            raise HTTPException(status_code=503, detail="Too many sales in progress, please retry")
+        except SaleQueueClosed:
+            raise HTTPException(status_code=503, detail="Server is shutting down, please retry")
+        sale_obj.lot_allocations = [LotAllocation(**allocation) for allocation in allocations]
+        return sale_obj
+    if transactions_supported:
+        changes, allocations = await commit_sale_in_transaction(sale_obj.dict(), quantities, names)
+    else:
+        changes, allocations = await commit_sale_with_compensation(sale_obj.dict(), quantities, names)
+    sale_obj.lot_allocations = [LotAllocation(**allocation) for allocation in allocations]
     
-    await db.sales.insert_one(sale_obj.dict())
+    # Keep the search index, dashboard counters and subscribers in step with the new stock levels
+    await record_sales([sale_obj.dict()], changes)
     return sale_obj
 
 @api_router.get("/sales", response_model=List[Sale])
-async def get_sales():
-    sales = await db.sales.find().to_list(1000)
-    return [Sale(**sale) for sale in sales]
+async def get_sales(
+    request: Request,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    stream: bool = False,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """Sales in [start, end), newest first; only the months the range covers are read."""
+    try:
+        after_key = decode_key(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    etag = await collection_versions.etag("sales", key=str(request.url.query))
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+    sales = sales_partitions.iter_sales(start, end, after=after_key, projection=model_projection(Sale))
+    if stream:
+        return StreamingResponse(
+            (orjson.dumps(sale) + b"\n" async for sale in sales),
+            media_type="application/x-ndjson",
+            headers=cache_headers(etag),
+        )
+    docs = []
+    async for sale in sales:
+        docs.append(sale)
+        if len(docs) > limit:
+            break
+    await sales.aclose()
+    if len(docs) > limit:
+        docs = docs[:limit]
+        return json_response(docs, etag, encode_key((docs[-1]["sale_date"], docs[-1]["id"])))
+    return json_response(docs, etag)
 
 @api_router.get("/sales/today")
 async def get_today_sales():
-    today = datetime.utcnow().date()
-    sales = await db.sales.find({
-        "sale_date": {
-            "$gte": datetime.combine(today, datetime.min.time()),
-            "$lt": datetime.combine(today, datetime.max.time())
-        }
-    }).to_list(1000)
-    return [Sale(**sale) for sale in sales]
+    today = start_of_day(datetime.utcnow().date())
+    docs = []
+    sales = sales_partitions.iter_sales(today, today + timedelta(days=1), projection=model_projection(Sale))
+    async for sale in sales:
+        docs.append(sale)
+        if len(docs) == 1000:
+            break
+    await sales.aclose()
+    return json_response(docs)
+
+@api_router.get("/sales/export")
+async def export_sales(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: str = Query("csv", pattern="^(csv|parquet)$"),
+):
+    """Stream sales in [start, end) with one row per line item."""
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+
+    cursor = sales_partitions.iter_sales(start, end, newest_first=False, batch_size=STREAM_BATCH_SIZE)
+
+    period = f"{start.date() if start else 'begin'}_{end.date() if end else 'now'}"
+    if format == "parquet":
+        body, media_type = iter_parquet(cursor), "application/vnd.apache.parquet"
+    else:
+        body, media_type = iter_csv(cursor), "text/csv"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="sales_{period}.{format}"'},
+    )
 
 # Supplier Routes
 @api_router.post("/suppliers", response_model=Supplier)
 async def create_supplier(supplier: SupplierCreate):
     supplier_dict = supplier.dict()
     supplier_obj = Supplier(**supplier_dict)
-    await db.suppliers.insert_one(supplier_obj.dict())
+    await db.suppliers.insert_one({**supplier_obj.dict(), **change_fields(await change_sequence.next())})
+    await collection_versions.bump("suppliers")
     return supplier_obj
 
 @api_router.get("/suppliers", response_model=List[Supplier])
-async def get_suppliers():
-    suppliers = await db.suppliers.find().to_list(1000)
-    return [Supplier(**supplier) for supplier in suppliers]
+async def get_suppliers(
+    request: Request,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    stream: bool = False,
+):
+    return await list_response(request, db.suppliers, Supplier, limit, after, stream)
 
 # Dashboard Stats
 @api_router.get("/dashboard/stats")
-async def get_dashboard_stats():
-    total_medicines = await db.medicines.count_documents({})
-    low_stock_count = len(await db.medicines.find({"$expr": {"$lte": ["$stock_quantity", "$min_stock_level"]}}).to_list(1000))
-    
-    today = datetime.utcnow().date()
-    today_sales = await db.sales.find({
-        "sale_date": {
-            "$gte": datetime.combine(today, datetime.min.time()),
-            "$lt": datetime.combine(today, datetime.max.time())
-        }
-    }).to_list(1000)
-    
-    today_revenue = sum(sale["total_amount"] for sale in today_sales)
-    
-    # Get expired medicines
-    expired_medicines = await db.medicines.find({
-        "expiry_date": {"$lte": datetime.utcnow()}
-    }).to_list(1000)
-    
+async def get_dashboard_stats(request: Request):
+    # Materialized counters, see dashboard_stats.py
+    stats = await dashboard_stats.read()
+    etag = quote_etag(digest(repr(sorted(stats.items()))))
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+    return json_response(stats, etag)
+
+# Analytics Routes
+def analytics_range(start: Optional[date], end: Optional[date]):
+    """Default to the last 30 days; end is exclusive."""
+    end = end or datetime.utcnow().date() + timedelta(days=1)
+    start = start or end - timedelta(days=30)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return start, end
+
+@api_router.get("/analytics/sales")
+async def get_sales_series(
+    period: str = Query("day", pattern="^(day|month)$"),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+):
+    start, end = analytics_range(start, end)
+    return await sales_rollups.series(period, start, end)
+
+@api_router.get("/analytics/top-medicines")
+async def get_top_medicines(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    by: str = Query("units", pattern="^(units|revenue)$"),
+):
+    start, end = analytics_range(start, end)
+    return await sales_rollups.top_medicines(start, end, limit, by)
+
+@api_router.get("/analytics/categories")
+async def get_category_mix(start: Optional[date] = None, end: Optional[date] = None):
+    start, end = analytics_range(start, end)
+    return await sales_rollups.category_mix(start, end)
+
+@api_router.get("/reports/inventory-valuation")
+async def get_inventory_valuation():
+    """Stock value at cost and retail with gross margin, overall and by category, manufacturer and form."""
+    # Computed from the in-memory columnar catalog, see valuation.py
+    return json_response(inventory_valuation.report())
+
+@api_router.post("/analytics/rebuild")
+async def rebuild_sales_rollups(start: Optional[date] = None, end: Optional[date] = None):
+    scanned = await sales_rollups.rebuild(start, end)
+    return {"sales_scanned": scanned}
+
+# Forecast Routes
+async def current_forecast() -> DemandForecast:
+    if demand_forecast.frame is None:
+        await demand_forecast.refresh()
+    return demand_forecast
+
+@api_router.get("/forecast/reorder")
+async def get_reorder_suggestions(
+    lead_time_days: float = Query(7, ge=0, le=365),
+    review_days: float = Query(7, ge=0, le=365),
+    service_level: float = Query(0.95, gt=0.5, lt=1),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    include_all: bool = False,
+):
+    """Medicines to reorder, soonest stockout first, from the last forecast refresh."""
+    forecast = await current_forecast()
+    return json_response({
+        "generated_at": forecast.generated_at,
+        "medicines": forecast.reorder(lead_time_days, review_days, service_level, limit, include_all),
+    })
+
+@api_router.get("/forecast/waste")
+async def get_waste_risk(limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE)):
+    """Stock expected to expire before it sells at the current demand rate."""
+    forecast = await current_forecast()
+    return json_response({"generated_at": forecast.generated_at, "medicines": forecast.waste(limit)})
+
+@api_router.post("/forecast/refresh")
+async def refresh_forecast():
+    await demand_forecast.refresh()
+    return {"generated_at": demand_forecast.generated_at, "medicines": len(demand_forecast.frame)}
+
+# Search Routes
+@api_router.get("/search/medicines", response_model=List[Medicine])
+async def search_medicines(q: str, limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE)):
+    # Served from the in-memory index, see search_index.py
+    return json_response([pick_fields(medicine, MEDICINE_FIELDS) for medicine in search_index.search(q, limit)])
+
+# Sync Routes
+@api_router.get("/sync")
+async def sync_changes(token: Optional[str] = None, limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    """Medicines, customers and suppliers changed or deleted since token, for local replicas.
+
+    Start without a token, apply each response and send back its token;
+    repeat while has_more. On reset, drop the replica before applying.
+    """
+    return json_response(await delta_sync.changes(token, limit, {
+        "medicines": MEDICINE_PROJECTION,
+        "customers": model_projection(Customer),
+        "suppliers": model_projection(Supplier),
+    }))
+
+# Push Routes
+@api_router.get("/events")
+async def stream_events(request: Request, last_event_id: Optional[str] = None):
+    """Server-sent events: stats, medicine and sale changes, and stock and expiry alerts.
+
+    A `resync` event means events were missed; reload over REST and reconnect.
+    """
+    return StreamingResponse(
+        event_bus.stream(request.headers.get("last-event-id") or last_event_id, EVENTS_HEARTBEAT_SECONDS),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Health Routes
+@api_router.get("/health/live")
+async def liveness():
+    # Deliberately ignores MongoDB: a database outage should not get every worker restarted
+    return {"status": "alive"}
+
+@api_router.get("/health/ready")
+async def readiness(request: Request):
+    """Ready once startup warm-up finished and while MongoDB answers a ping."""
+    if not getattr(request.app.state, "ready", False):
+        return ORJSONResponse({"status": "starting"}, status_code=503)
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), READINESS_TIMEOUT_SECONDS)
+    except (PyMongoError, asyncio.TimeoutError) as e:
+        return ORJSONResponse({"status": "unavailable", "detail": str(e) or type(e).__name__}, status_code=503)
     return {
-        "total_medicines": total_medicines,
-        "low_stock_count": low_stock_count,
-        "today_sales_count": len(today_sales),
-        "today_revenue": today_revenue,
-        "expired_medicines_count": len(expired_medicines)
+        "status": "ready",
+        "storage_engine": storage.engine,
+        "mongo_ping_ms": round((time.perf_counter() - start) * 1000, 2),
     }
 
-# Search Routes
-@api_router.get("/search/medicines")
-async def search_medicines(q: str):
-    medicines = await db.medicines.find({
-        "$or": [
-            {"name": {"$regex": q, "$options": "i"}},
-            {"generic_name": {"$regex": q, "$options": "i"}},
-            {"manufacturer": {"$regex": q, "$options": "i"}},
-            {"category": {"$regex": q, "$options": "i"}}
-        ]
-    }).to_list(100)
-    return [Medicine(**medicine) for medicine in medicines]
+# Diagnostics Routes
+@api_router.get("/diagnostics/indexes")
+async def get_index_diagnostics(refresh: bool = False):
+    if refresh:
+        await index_manager.ensure()
+    return index_manager.status()
+
+@api_router.get("/diagnostics/cache")
+async def get_cache_diagnostics():
+    return catalog_cache.stats()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+async def ensure_indexes():
+    global transactions_supported
+    transactions_supported = await detect_transaction_support()
+    logger.info("Multi-document transactions %s", "enabled" if transactions_supported else "unavailable")
+    # Storage options only apply at creation, before index builds would create it plainly
+    await sales_partitions.ensure_archive()
+    await index_manager.ensure()
+    # Backfill the flag for documents written before it existed
+    await db.medicines.update_many({"is_low_stock": {"$exists": False}}, [LOW_STOCK_STAGE])
+    # Move the stock of documents written before lots existed into a single lot
+    legacy = await db.medicines.find({"lots": {"$exists": False}}, {"_id": 0}).to_list(None)
+    if legacy:
+        await db.medicines.bulk_write(
+            [lot_update(medicine, lots_of(medicine))[0] for medicine in legacy], ordered=False
+        )
+        logger.info("Moved %d medicines to lot-level stock", len(legacy))
+    # Sales written before monthly partitions existed
+    await sales_partitions.migrate_legacy()
+    # Catalog documents written before delta sync existed
+    await delta_sync.backfill()
+    # Starting points for stock history of medicines written before the stock ledger existed
+    await stock_ledger.ensure_baselines()
+
+async def load_search_index():
+    """Rebuild the search index and inventory valuation from the database.
+
+    Building takes seconds on a large catalog, so fresh copies are built in
+    a worker thread while the current ones keep serving requests, and are
+    swapped in once this worker's writes made meanwhile are replayed on them.
+    """
+    global search_index, inventory_valuation, pending_catalog_writes
+    pending_catalog_writes = []
+    try:
+        medicines = await db.medicines.find({}, {"_id": 0}).to_list(None)
+        fresh_index, fresh_valuation = await run_in_threadpool(build_catalog_copies, medicines)
+        for medicine_id, doc in pending_catalog_writes:
+            if doc is None:
+                fresh_index.remove(medicine_id)
+                fresh_valuation.remove(medicine_id)
+            else:
+                fresh_index.add(doc)
+                fresh_valuation.add(doc)
+    finally:
+        pending_catalog_writes = None
+    search_index, inventory_valuation = fresh_index, fresh_valuation
+    logger.info("Search index and inventory valuation loaded with %d medicines", len(search_index))
+
+async def relay_change_streams():
+    relay = ChangeStreamRelay(db, event_bus, dashboard_stats.read)
+    while True:
+        try:
+            await relay.run()
+        except PyMongoError:
+            logger.exception("Change stream relay failed, restarting")
+            await asyncio.sleep(5)
+
+async def run_periodically(interval: int, job, name: str):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job()
+        except Exception:
+            logger.exception("%s failed", name)
+
+async def start_background_jobs() -> List[asyncio.Task]:
+    global events_from_change_streams
+    await load_search_index()
+    await dashboard_stats.reconcile()
+    tasks = []
+    # Backfill rollups once for databases that had sales before rollups (or per-medicine rollups) existed
+    if not await sales_rollups.medicines.estimated_document_count() and await sales_partitions.catalog.estimated_document_count():
+        tasks.append(asyncio.create_task(sales_rollups.rebuild()))
+    tasks += [
+        asyncio.create_task(run_periodically(SEARCH_INDEX_REFRESH_SECONDS, load_search_index, "Search index refresh")),
+        asyncio.create_task(run_periodically(STATS_RECONCILE_SECONDS, dashboard_stats.reconcile, "Stats reconciliation")),
+        asyncio.create_task(run_periodically(EXPIRY_CHECK_SECONDS, expiry_watcher.check, "Expiry check")),
+        asyncio.create_task(run_periodically(EXPIRY_CHECK_SECONDS, dashboard_stats.record_expirations, "Expired stock count")),
+        asyncio.create_task(run_periodically(FORECAST_REFRESH_SECONDS, demand_forecast.refresh, "Forecast refresh")),
+        asyncio.create_task(run_periodically(SALES_ARCHIVE_CHECK_SECONDS, sales_partitions.archive_old_months, "Sales archival")),
+        asyncio.create_task(run_periodically(SYNC_PRUNE_SECONDS, delta_sync.prune_tombstones, "Tombstone pruning")),
+    ]
+    if EVENTS_CHANGE_STREAMS:
+        # Change streams need the same replica set or mongos that transactions do
+        if transactions_supported:
+            events_from_change_streams = True
+            tasks.append(asyncio.create_task(relay_change_streams()))
+        else:
+            logger.warning("EVENTS_CHANGE_STREAMS is set but change streams need a replica set, publishing locally")
+    return tasks
+
+async def warm_up():
+    """Open pool connections and fill the first catalog page before taking traffic."""
+    connections = min(POOL_WARMUP_CONNECTIONS, mongo_client_options().get("maxPoolSize", POOL_WARMUP_CONNECTIONS))
+    # Concurrent commands each check out their own connection
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(connections)))
+    await catalog_cache.page(
+        (MAX_PAGE_SIZE, None), lambda: fetch_page(db.medicines, MAX_PAGE_SIZE, None, MEDICINE_PROJECTION)
+    )
+    logger.info("Warmed up %d connections and the first catalog page", connections)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    await ensure_indexes()
+    background_tasks = await start_background_jobs()
+    if SALES_GROUP_COMMIT:
+        sale_queue.start()
+    await warm_up()
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        # Queued sales are written before the connection goes away
+        await sale_queue.close()
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        client.close()
+
+# Create the main app without a prefix
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE)
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -321,15 +1582,6 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+app.add_middleware(MetricsMiddleware, metrics=metrics)
\ No newline at end of file
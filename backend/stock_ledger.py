@@ -0,0 +1,165 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING, InsertOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+SALE = "sale"
+SALE_REVERSAL = "sale_reversal"
+RESTOCK = "restock"
+ADJUSTMENT = "adjustment"
+WRITE_OFF = "write_off"
+
+DEFAULT_SNAPSHOT_EVERY = 50
+
+MedicineChange = Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+
+def stock_of(medicine: Optional[Dict[str, Any]]) -> int:
+    return medicine.get("stock_quantity", 0) if medicine is not None else 0
+
+
+def changed_at(medicine: Dict[str, Any]) -> datetime:
+    return medicine.get("changed_at") or medicine.get("updated_at") or datetime.utcnow()
+
+
+def snapshot_doc(medicine: Dict[str, Any]) -> Dict[str, Any]:
+    revision = medicine.get("lot_revision", 0)
+    return {
+        "_id": f"{medicine['id']}:{revision}",
+        "medicine_id": medicine["id"],
+        "revision": revision,
+        "stock_quantity": stock_of(medicine),
+        "at": changed_at(medicine),
+    }
+
+
+class StockLedger:
+    """Append-only history of stock movements, with periodic per-medicine snapshots.
+
+    Every write that changes a medicine's stock adds one movement keyed by
+    the medicine and the lot revision the write produced, holding the signed
+    quantity and the write's time. A snapshot of the stock level is taken
+    when a medicine is created and whenever its revision reaches a multiple
+    of snapshot_every, so the stock at any time is one snapshot plus fewer
+    than snapshot_every later movements. Snapshots are read from the written
+    document itself, which also corrects the running total for any movement
+    lost between a stock write and its entry here.
+    """
+
+    def __init__(
+        self,
+        db,
+        snapshot_every: int = DEFAULT_SNAPSHOT_EVERY,
+        movements_name: str = "stock_movements",
+        snapshots_name: str = "stock_snapshots",
+    ):
+        self.snapshot_every = max(snapshot_every, 1)
+        self.movements = db[movements_name]
+        self.snapshots = db[snapshots_name]
+        self.medicines = db["medicines"]
+
+    async def record(
+        self,
+        kind: str,
+        changes: List[MedicineChange],
+        sale_ids: Optional[Dict[str, List[str]]] = None,
+    ):
+        """Add movements for (before, after) medicine writes; before is None for a new medicine."""
+        movements, snapshots = [], []
+        for before, after in changes:
+            if after is None:
+                continue
+            revision = after.get("lot_revision", 0)
+            quantity = stock_of(after) - stock_of(before)
+            if quantity:
+                movement = {
+                    "_id": f"{after['id']}:{revision}",
+                    "medicine_id": after["id"],
+                    "revision": revision,
+                    "kind": kind,
+                    "quantity": quantity,
+                    "at": changed_at(after),
+                }
+                if sale_ids and after["id"] in sale_ids:
+                    movement["sale_ids"] = sale_ids[after["id"]]
+                movements.append(InsertOne(movement))
+            if before is None or revision % self.snapshot_every == 0:
+                snapshots.append(InsertOne(snapshot_doc(after)))
+        await self._insert(self.movements, movements)
+        await self._insert(self.snapshots, snapshots)
+
+    async def _insert(self, collection, operations: List[InsertOne]):
+        if not operations:
+            return
+        try:
+            await collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Recording is idempotent: the same write recorded twice keeps its first entry
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+
+    async def ensure_baselines(self) -> int:
+        """Snapshot medicines that have none yet, such as those written before the ledger existed."""
+        known = set(await self.snapshots.distinct("medicine_id"))
+        snapshots = []
+        async for medicine in self.medicines.find(
+            {}, {"_id": 0, "id": 1, "stock_quantity": 1, "lot_revision": 1, "changed_at": 1, "updated_at": 1}
+        ):
+            if medicine["id"] not in known:
+                snapshots.append(InsertOne(snapshot_doc(medicine)))
+        if snapshots:
+            await self._insert(self.snapshots, snapshots)
+            logger.info("Took baseline stock snapshots of %d medicines", len(snapshots))
+        return len(snapshots)
+
+    async def stock_at(self, medicine_id: str, at: datetime) -> Optional[int]:
+        """Stock just before `at`, or None when there is no history that far back."""
+        snapshot = await self.snapshots.find_one(
+            {"medicine_id": medicine_id, "at": {"$lt": at}},
+            sort=[("at", DESCENDING), ("revision", DESCENDING)],
+        )
+        if snapshot is None:
+            return None
+        tail = await self.movements.aggregate([
+            {"$match": {
+                "medicine_id": medicine_id,
+                "at": {"$gte": snapshot["at"], "$lt": at},
+                "revision": {"$gt": snapshot["revision"]},
+            }},
+            {"$group": {"_id": None, "quantity": {"$sum": "$quantity"}}},
+        ]).to_list(1)
+        return snapshot["stock_quantity"] + (tail[0]["quantity"] if tail else 0)
+
+    async def report(self, medicine_id: str, start: datetime, end: datetime, limit: int) -> Dict[str, Any]:
+        """Opening and closing stock of [start, end), totals per movement kind and the first movements."""
+        opening = await self.stock_at(medicine_id, start)
+        match = {"medicine_id": medicine_id, "at": {"$gte": start, "$lt": end}}
+        totals = {
+            row["_id"]: {"quantity": row["quantity"], "movements": row["movements"]}
+            for row in await self.movements.aggregate([
+                {"$match": match},
+                {"$group": {"_id": "$kind", "quantity": {"$sum": "$quantity"}, "movements": {"$sum": 1}}},
+            ]).to_list(None)
+        }
+        movements = await self.movements.find(match, {"_id": 0, "medicine_id": 0}).sort(
+            [("at", ASCENDING), ("revision", ASCENDING)]
+        ).limit(limit).to_list(limit)
+        if opening is None:
+            # Created (or first recorded) during the period
+            closing = await self.stock_at(medicine_id, end)
+        else:
+            closing = opening + sum(total["quantity"] for total in totals.values())
+        return {
+            "medicine_id": medicine_id,
+            "start": start,
+            "end": end,
+            "opening_stock": opening,
+            "closing_stock": closing,
+            "totals": totals,
+            "movements": movements,
+            "movements_truncated": sum(total["movements"] for total in totals.values()) > len(movements),
+        }
@@ -0,0 +1,61 @@
+import logging
+from typing import Any, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+logger = logging.getLogger(__name__)
+
+MONGO = "mongo"
+MEMORY = "memory"
+STORAGE_ENGINES = (MONGO, MEMORY)
+
+
+class Storage:
+    """The database client the app runs on, and which server features it has.
+
+    Routes and helpers use the Motor API on `db` whatever the engine; what
+    differs is below it. `mongo` is a MongoDB server and the only engine for
+    deployments. `memory` is a test harness: mongomock-motor from
+    requirements-dev.txt keeps everything in the process, with nothing to
+    connect to and nothing kept after exit, so test and benchmark runs need
+    no database server. It has no server commands, transactions, change
+    streams or per-collection storage options, so those paths fall back the
+    way they do on a standalone mongod.
+    """
+
+    def __init__(self, engine: str, client, db_name: str, server_features: bool):
+        self.engine = engine
+        self.client = client
+        self.db = client[db_name]
+        # hello, transactions, change streams and collection storage options
+        self.server_features = server_features
+
+    def close(self):
+        self.client.close()
+
+
+def memory_client():
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise RuntimeError("STORAGE_ENGINE=memory needs the mongomock-motor package from requirements-dev.txt") from None
+    return AsyncMongoMockClient()
+
+
+def open_storage(
+    engine: str,
+    db_name: str,
+    mongo_url: Optional[str] = None,
+    event_listeners: Optional[List[Any]] = None,
+    client_options: Optional[Dict[str, Any]] = None,
+) -> Storage:
+    """Build the client for engine; no connection is made until first use."""
+    if engine == MONGO:
+        if not mongo_url:
+            raise RuntimeError("MONGO_URL is required with STORAGE_ENGINE=mongo")
+        client = AsyncIOMotorClient(mongo_url, event_listeners=event_listeners or [], **(client_options or {}))
+        return Storage(engine, client, db_name, server_features=True)
+    if engine == MEMORY:
+        logger.warning("Using the in-memory storage engine for tests, data is lost when the process exits")
+        return Storage(engine, memory_client(), db_name, server_features=False)
+    raise RuntimeError(f"Unknown STORAGE_ENGINE {engine!r}, expected one of {', '.join(STORAGE_ENGINES)}")
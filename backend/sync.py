@@ -0,0 +1,157 @@
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Collections terminals replicate through /api/sync
+SYNC_COLLECTIONS = ("medicines", "customers", "suppliers")
+
+SEQUENCE_ID = "changes"
+
+
+def change_fields(seq: int) -> Dict[str, Any]:
+    """Fields stamped on every write to a synced document."""
+    return {"change_seq": seq, "changed_at": datetime.utcnow()}
+
+
+class ChangeSequence:
+    """Monotonic counter numbering every change to the synced collections.
+
+    Writers take numbers before writing and stamp them on the documents
+    they write, or on tombstones for deletes. The epoch is generated when
+    the counter is created, so tokens from a wiped database are recognised.
+    """
+
+    def __init__(self, db, collection_name: str = "change_sequence"):
+        self.collection = db[collection_name]
+
+    async def allocate(self, count: int = 1) -> range:
+        counter = await self.collection.find_one_and_update(
+            {"_id": SEQUENCE_ID},
+            {"$inc": {"value": count}, "$setOnInsert": {"epoch": uuid.uuid4().hex[:8], "pruned_through": 0}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return range(counter["value"] - count + 1, counter["value"] + 1)
+
+    async def next(self) -> int:
+        return (await self.allocate())[0]
+
+    async def state(self) -> Dict[str, Any]:
+        counter = await self.collection.find_one({"_id": SEQUENCE_ID})
+        if counter is None:
+            await self.allocate(0)
+            counter = await self.collection.find_one({"_id": SEQUENCE_ID})
+        return counter
+
+
+class DeltaSync:
+    """Changes to the synced collections since a client's sync token.
+
+    A token is "<epoch>.<seq>": the client has everything numbered up to seq.
+    Numbers are taken before the write that stamps them lands, so a change
+    can become visible after a higher-numbered one. The token handed back
+    therefore stops before any change younger than settle_seconds; changes
+    past it are sent again next time, and clients apply them idempotently.
+    Tombstones older than tombstone_days are pruned; a token from before the
+    pruning (or another epoch) gets a reset, meaning drop the replica and
+    apply this response as the start of a full sync.
+    """
+
+    def __init__(self, db, sequence: ChangeSequence, settle_seconds: float = 5, tombstone_days: int = 30):
+        self.db = db
+        self.sequence = sequence
+        self.settle_seconds = settle_seconds
+        self.tombstone_days = tombstone_days
+        self.tombstones = db["tombstones"]
+
+    async def record_deletion(self, collection_name: str, doc_id: str):
+        await self.tombstones.insert_one({
+            "collection": collection_name,
+            "id": doc_id,
+            **change_fields(await self.sequence.next()),
+        })
+
+    def _parse(self, token: Optional[str], counter: Dict[str, Any]) -> Tuple[int, bool]:
+        """The sequence number to continue after, and whether the client must reset."""
+        if not token:
+            return 0, False
+        epoch, _, seq = token.partition(".")
+        if epoch != counter["epoch"] or not seq.isdigit():
+            return 0, True
+        seq = int(seq)
+        if seq < counter.get("pruned_through", 0):
+            return 0, True
+        return seq, False
+
+    async def changes(self, token: Optional[str], limit: int, projections: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        counter = await self.sequence.state()
+        after, reset = self._parse(token, counter)
+
+        # The limit+1 lowest numbered changes across all collections
+        items: List[Tuple[int, datetime, str, Optional[Dict[str, Any]], str]] = []
+        for collection_name in SYNC_COLLECTIONS:
+            projection = {**projections[collection_name], "change_seq": 1, "changed_at": 1}
+            async for doc in self.db[collection_name].find(
+                {"change_seq": {"$gt": after}}, projection
+            ).sort("change_seq", ASCENDING).limit(limit + 1):
+                items.append((doc.pop("change_seq"), doc.pop("changed_at"), collection_name, doc, doc["id"]))
+        async for tombstone in self.tombstones.find({"change_seq": {"$gt": after}}).sort("change_seq", ASCENDING).limit(limit + 1):
+            items.append((tombstone["change_seq"], tombstone["changed_at"], tombstone["collection"], None, tombstone["id"]))
+        items.sort(key=lambda item: item[0])
+        has_more = len(items) > limit
+        page = items[:limit]
+
+        next_seq = after
+        settled_before = datetime.utcnow() - timedelta(seconds=self.settle_seconds)
+        for seq, changed_at, _, _, _ in page:
+            if changed_at > settled_before:
+                break
+            next_seq = seq
+        if has_more:
+            # A full page always moves on; its own recent changes are what was asked for
+            next_seq = max(next_seq, page[-1][0] if page[-1][0] != items[limit][0] else page[-1][0] - 1)
+
+        response: Dict[str, Any] = {
+            "token": f"{counter['epoch']}.{next_seq}",
+            "reset": reset,
+            "has_more": has_more,
+            "deleted": {collection_name: [] for collection_name in SYNC_COLLECTIONS},
+            **{collection_name: [] for collection_name in SYNC_COLLECTIONS},
+        }
+        for _, _, collection_name, doc, doc_id in page:
+            if doc is None:
+                response["deleted"][collection_name].append(doc_id)
+            else:
+                response[collection_name].append(doc)
+        return response
+
+    async def backfill(self):
+        """Number documents written before change numbering existed."""
+        for collection_name in SYNC_COLLECTIONS:
+            collection = self.db[collection_name]
+            ids = [doc["_id"] async for doc in collection.find({"change_seq": {"$exists": False}}, {"_id": 1})]
+            if not ids:
+                continue
+            seqs = await self.sequence.allocate(len(ids))
+            await collection.bulk_write(
+                [UpdateOne({"_id": _id}, {"$set": change_fields(seq)}) for _id, seq in zip(ids, seqs)],
+                ordered=False,
+            )
+            logger.info("Numbered %d %s for delta sync", len(ids), collection_name)
+
+    async def prune_tombstones(self) -> int:
+        cutoff = datetime.utcnow() - timedelta(days=self.tombstone_days)
+        newest = await self.tombstones.find({"changed_at": {"$lt": cutoff}}).sort("change_seq", -1).limit(1).to_list(1)
+        if not newest:
+            return 0
+        through = newest[0]["change_seq"]
+        # Raise the bar first: a client between the two steps is told to reset rather than miss a delete
+        await self.sequence.collection.update_one({"_id": SEQUENCE_ID}, {"$max": {"pruned_through": through}})
+        result = await self.tombstones.delete_many({"change_seq": {"$lte": through}})
+        logger.info("Pruned %d sync tombstones", result.deleted_count)
+        return result.deleted_count
@@ -0,0 +1,160 @@
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+# Catalog fields valuation and margin reports are broken down by
+GROUPINGS = ("category", "manufacturer", "form")
+
+UNKNOWN_LABEL = "Unknown"
+INITIAL_CAPACITY = 1024
+
+
+def cost_value(doc: Dict[str, Any]) -> float:
+    """Stock at cost: each lot at its own purchase price, falling back to the medicine's."""
+    price = doc.get("purchase_price") or 0.0
+    lots = doc.get("lots")
+    if not lots:
+        return (doc.get("stock_quantity") or 0) * price
+    return sum(
+        lot["quantity"] * (lot["purchase_price"] if lot.get("purchase_price") is not None else price)
+        for lot in lots
+    )
+
+
+class InventoryValuation:
+    """Columnar in-memory copy of the catalog for stock value and margin reports.
+
+    Stock, stock value at cost and selling prices sit in NumPy arrays with
+    one row per medicine, and each grouping field is dictionary encoded into an integer
+    code per row, so a report is a few `bincount`s over the whole catalog
+    instead of a pass over documents. Like the search index, the write
+    routes keep it current with `add`/`remove` and `load` rebuilds it.
+    Rows of removed medicines are zeroed and reused. Each worker holds its
+    own copy and only sees other workers' writes at the next `load`, so
+    reports say when their copy was loaded.
+    """
+
+    def __init__(self, groupings: Iterable[str] = GROUPINGS):
+        self.groupings = tuple(groupings)
+        self._reset(INITIAL_CAPACITY)
+        self.loaded_at: Optional[datetime] = None
+
+    def _reset(self, capacity: int):
+        self._rows: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._size = 0
+        self._stock = np.zeros(capacity)
+        self._cost_value = np.zeros(capacity)
+        self._retail = np.zeros(capacity)
+        self._present = np.zeros(capacity, dtype=bool)
+        self._codes = {grouping: np.zeros(capacity, dtype=np.int64) for grouping in self.groupings}
+        self._labels: Dict[str, List[str]] = {grouping: [] for grouping in self.groupings}
+        self._label_codes: Dict[str, Dict[str, int]] = {grouping: {} for grouping in self.groupings}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _grow(self):
+        capacity = len(self._stock) * 2
+        self._stock = np.resize(self._stock, capacity)
+        self._cost_value = np.resize(self._cost_value, capacity)
+        self._retail = np.resize(self._retail, capacity)
+        # np.resize repeats the old contents; new rows must start absent
+        present = np.zeros(capacity, dtype=bool)
+        present[:self._size] = self._present[:self._size]
+        self._present = present
+        self._codes = {grouping: np.resize(codes, capacity) for grouping, codes in self._codes.items()}
+
+    def _code(self, grouping: str, label: Any) -> int:
+        label = str(label).strip() if label else UNKNOWN_LABEL
+        codes = self._label_codes[grouping]
+        code = codes.get(label)
+        if code is None:
+            code = codes[label] = len(self._labels[grouping])
+            self._labels[grouping].append(label)
+        return code
+
+    def load(self, docs: Iterable[Dict[str, Any]]):
+        """Replace the whole copy with the given medicine documents."""
+        docs = list(docs)
+        self._reset(max(INITIAL_CAPACITY, len(docs)))
+        for doc in docs:
+            self.add(doc)
+        self.loaded_at = datetime.utcnow()
+
+    def add(self, doc: Dict[str, Any]):
+        """Insert or replace a medicine document."""
+        row = self._rows.get(doc["id"])
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+            else:
+                if self._size == len(self._stock):
+                    self._grow()
+                row = self._size
+                self._size += 1
+            self._rows[doc["id"]] = row
+        self._stock[row] = doc.get("stock_quantity") or 0
+        self._cost_value[row] = cost_value(doc)
+        self._retail[row] = doc.get("selling_price") or 0.0
+        self._present[row] = True
+        for grouping in self.groupings:
+            self._codes[grouping][row] = self._code(grouping, doc.get(grouping))
+
+    def remove(self, doc_id: str):
+        row = self._rows.pop(doc_id, None)
+        if row is None:
+            return
+        self._stock[row] = self._cost_value[row] = self._retail[row] = 0
+        self._present[row] = False
+        self._free.append(row)
+
+    def report(self) -> Dict[str, Any]:
+        """Stock value at cost and retail with the gross margin, overall and per grouping."""
+        size = self._size
+        present = self._present[:size]
+        units = self._stock[:size]
+        # Each grouping sums a measure over the whole catalog with one bincount
+        measures = {
+            "skus": present.astype(float),
+            "units": units,
+            "cost_value": self._cost_value[:size],
+            "retail_value": units * self._retail[:size],
+        }
+        now = datetime.utcnow()
+        report: Dict[str, Any] = {
+            "generated_at": now,
+            # Writes made through other workers show up once this copy is reloaded
+            "loaded_at": self.loaded_at,
+            "age_seconds": round((now - self.loaded_at).total_seconds(), 1) if self.loaded_at else None,
+            "totals": summary({name: values.sum() for name, values in measures.items()}),
+        }
+        for grouping in self.groupings:
+            codes = self._codes[grouping][:size]
+            labels = self._labels[grouping]
+            sums = {
+                name: np.bincount(codes, weights=values, minlength=len(labels))
+                for name, values in measures.items()
+            }
+            rows = [
+                {grouping: label, **summary({name: values[code] for name, values in sums.items()})}
+                for code, label in enumerate(labels)
+                if sums["skus"][code]
+            ]
+            rows.sort(key=lambda row: row["retail_value"], reverse=True)
+            report[f"by_{grouping}"] = rows
+        return report
+
+
+def summary(sums: Dict[str, float]) -> Dict[str, Any]:
+    """JSON-ready totals of one group, with its gross margin."""
+    margin = sums["retail_value"] - sums["cost_value"]
+    return {
+        "skus": int(sums["skus"]),
+        "units": int(sums["units"]),
+        "cost_value": round(float(sums["cost_value"]), 2),
+        "retail_value": round(float(sums["retail_value"]), 2),
+        "gross_margin": round(float(margin), 2),
+        "margin_percent": round(float(margin / sums["retail_value"] * 100), 2) if sums["retail_value"] else None,
+    }
@@ -1,11 +1,14 @@
 import requests
 import unittest
 import json
+import csv
 from datetime import datetime, date, timedelta
 import os
 import sys
 import random
 import string
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Get the backend URL from the frontend .env file
 BACKEND_URL = "https://4f692aa5-5871-43a6-bc8c-5d5cb6026edd.preview.emergentagent.com"
@@ -63,6 +66,22 @@ class PharmacyAPITest(unittest.TestCase):
             except:
                 pass
     
+    def sale_payload(self, medicine, quantity):
+        """A cash sale of one line for the given medicine"""
+        return {
+            "items": [
+                {
+                    "medicine_id": medicine["id"],
+                    "medicine_name": medicine["name"],
+                    "quantity": quantity,
+                    "unit_price": medicine["selling_price"],
+                    "total_price": quantity * medicine["selling_price"]
+                }
+            ],
+            "subtotal": quantity * medicine["selling_price"],
+            "payment_method": "cash"
+        }
+    
     def test_01_medicine_crud(self):
         """Test medicine CRUD operations"""
         print("\n=== Testing Medicine CRUD Operations ===")
@@ -349,6 +368,696 @@ class PharmacyAPITest(unittest.TestCase):
         expired_ids = [m["id"] for m in expired_medicines]
         self.assertIn(medicine["id"], expired_ids, "Created expired medicine not found in expired list")
         print(f"Expired medicines retrieved successfully. Found {len(expired_medicines)} expired medicines.")
+    
+    def test_09_medicine_pagination(self):
+        """Test keyset pagination and NDJSON streaming of medicines"""
+        print("\n=== Testing Medicine Pagination ===")
+        
+        # Create two medicines so there is always more than one page of size 1
+        for _ in range(2):
+            response = requests.post(f"{API_URL}/medicines", json=self.medicine_data)
+            self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+            self.created_resources["medicines"].append(response.json()["id"])
+        
+        # First page
+        print("Getting first page of medicines...")
+        response = requests.get(f"{API_URL}/medicines", params={"limit": 1})
+        self.assertEqual(response.status_code, 200, f"Failed to get medicines page: {response.text}")
+        first_page = response.json()
+        self.assertEqual(len(first_page), 1, "Page size not respected")
+        cursor = response.headers.get("X-Next-Cursor")
+        self.assertIsNotNone(cursor, "Next cursor header missing")
+        
+        # Second page continues after the cursor
+        print("Getting second page of medicines...")
+        response = requests.get(f"{API_URL}/medicines", params={"limit": 1, "after": cursor})
+        self.assertEqual(response.status_code, 200, f"Failed to get medicines page: {response.text}")
+        second_page = response.json()
+        self.assertEqual(len(second_page), 1, "Page size not respected")
+        self.assertGreater(second_page[0]["id"], first_page[0]["id"], "Second page does not follow the cursor")
+        
+        # Streaming mode returns one JSON document per line
+        print("Streaming medicines as NDJSON...")
+        response = requests.get(f"{API_URL}/medicines", params={"stream": "true"}, stream=True)
+        self.assertEqual(response.status_code, 200, f"Failed to stream medicines: {response.text}")
+        streamed_ids = [json.loads(line)["id"] for line in response.iter_lines() if line]
+        for medicine_id in self.created_resources["medicines"]:
+            self.assertIn(medicine_id, streamed_ids, "Created medicine missing from stream")
+        print(f"Streamed {len(streamed_ids)} medicines")
+    
+    def test_10_near_expiry_medicines(self):
+        """Test near-expiry window on the expired medicines endpoint"""
+        print("\n=== Testing Near-Expiry Medicines ===")
+        
+        # Create a medicine expiring in 10 days
+        near_expiry_data = self.medicine_data.copy()
+        near_expiry_data["expiry_date"] = (datetime.utcnow() + timedelta(days=10)).isoformat()
+        response = requests.post(f"{API_URL}/medicines", json=near_expiry_data)
+        self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+        medicine = response.json()
+        self.created_resources["medicines"].append(medicine["id"])
+        
+        # Not expired yet
+        response = requests.get(f"{API_URL}/medicines/expired")
+        self.assertEqual(response.status_code, 200, f"Failed to get expired medicines: {response.text}")
+        self.assertNotIn(medicine["id"], [m["id"] for m in response.json()], "Medicine reported as already expired")
+        
+        # But inside a 30 day window
+        response = requests.get(f"{API_URL}/medicines/expired", params={"within_days": 30})
+        self.assertEqual(response.status_code, 200, f"Failed to get near-expiry medicines: {response.text}")
+        self.assertIn(medicine["id"], [m["id"] for m in response.json()], "Medicine missing from near-expiry window")
+        print("Near-expiry window returned the expected medicine")
+    
+    def test_11_oversell_protection(self):
+        """Test that a sale exceeding available stock is rejected without side effects"""
+        print("\n=== Testing Oversell Protection ===")
+        
+        response = requests.post(f"{API_URL}/medicines", json=self.medicine_data)
+        self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+        medicine = response.json()
+        self.created_resources["medicines"].append(medicine["id"])
+        
+        quantity = medicine["stock_quantity"] + 1
+        sale_data = {
+            "items": [
+                {
+                    "medicine_id": medicine["id"],
+                    "medicine_name": medicine["name"],
+                    "quantity": quantity,
+                    "unit_price": medicine["selling_price"],
+                    "total_price": quantity * medicine["selling_price"]
+                }
+            ],
+            "subtotal": quantity * medicine["selling_price"],
+            "payment_method": "cash"
+        }
+        
+        print("Attempting to sell more than available stock...")
+        response = requests.post(f"{API_URL}/sales", json=sale_data)
+        self.assertEqual(response.status_code, 409, f"Oversell was not rejected: {response.text}")
+        
+        # Stock must be untouched
+        response = requests.get(f"{API_URL}/medicines/{medicine['id']}")
+        self.assertEqual(response.status_code, 200, f"Failed to get medicine: {response.text}")
+        self.assertEqual(response.json()["stock_quantity"], medicine["stock_quantity"], "Stock changed by rejected sale")
+        print("Oversell rejected and stock left unchanged")
+    
+    def test_12_conditional_get(self):
+        """Test ETag revalidation on list endpoints"""
+        print("\n=== Testing Conditional GET ===")
+        
+        response = requests.get(f"{API_URL}/medicines")
+        self.assertEqual(response.status_code, 200, f"Failed to get medicines: {response.text}")
+        etag = response.headers.get("ETag")
+        self.assertIsNotNone(etag, "ETag header missing")
+        
+        # Unchanged collection answers 304 with no body
+        response = requests.get(f"{API_URL}/medicines", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304, "Unchanged medicines list was not answered with 304")
+        self.assertEqual(response.content, b"", "304 response carried a body")
+        
+        # A write changes the ETag
+        response = requests.post(f"{API_URL}/medicines", json=self.medicine_data)
+        self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+        self.created_resources["medicines"].append(response.json()["id"])
+        response = requests.get(f"{API_URL}/medicines", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200, "Stale ETag was answered with 304")
+        self.assertNotEqual(response.headers.get("ETag"), etag, "ETag did not change after a write")
+        print("Conditional GET behaves as expected")
+    
+    def test_13_fefo_lot_allocation(self):
+        """Test that sales deplete the earliest-expiring lot first"""
+        print("\n=== Testing FEFO Lot Allocation ===")
+        
+        response = requests.post(f"{API_URL}/medicines", json=self.medicine_data)
+        self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+        medicine = response.json()
+        self.created_resources["medicines"].append(medicine["id"])
+        
+        # Restock with a lot that expires before the original one
+        lot_data = {
+            "batch_number": "EARLY001",
+            "expiry_date": (datetime.utcnow() + timedelta(days=30)).isoformat(),
+            "quantity": 5
+        }
+        response = requests.post(f"{API_URL}/medicines/{medicine['id']}/lots", json=lot_data)
+        self.assertEqual(response.status_code, 200, f"Failed to receive lot: {response.text}")
+        restocked = response.json()
+        self.assertEqual(restocked["stock_quantity"], medicine["stock_quantity"] + 5, "Restock did not add to stock")
+        self.assertEqual(restocked["batch_number"], "EARLY001", "Earliest lot is not the current batch")
+        
+        sale_data = {
+            "items": [
+                {
+                    "medicine_id": medicine["id"],
+                    "medicine_name": medicine["name"],
+                    "quantity": 7,
+                    "unit_price": medicine["selling_price"],
+                    "total_price": 7 * medicine["selling_price"]
+                }
+            ],
+            "subtotal": 7 * medicine["selling_price"],
+            "payment_method": "cash"
+        }
+        response = requests.post(f"{API_URL}/sales", json=sale_data)
+        self.assertEqual(response.status_code, 200, f"Failed to create sale: {response.text}")
+        allocations = [(a["batch_number"], a["quantity"]) for a in response.json()["lot_allocations"]]
+        self.assertEqual(allocations, [("EARLY001", 5), (medicine["batch_number"], 2)], "Sale was not allocated FEFO")
+        print(f"Sale allocated across lots: {allocations}")
+    
+    def test_14_health_endpoints(self):
+        """Test liveness and readiness probes"""
+        print("\n=== Testing Health Endpoints ===")
+        
+        response = requests.get(f"{API_URL}/health/live")
+        self.assertEqual(response.status_code, 200, f"Liveness probe failed: {response.text}")
+        
+        response = requests.get(f"{API_URL}/health/ready")
+        self.assertEqual(response.status_code, 200, f"Readiness probe failed: {response.text}")
+        self.assertEqual(response.json()["status"], "ready")
+        self.assertIn("mongo_ping_ms", response.json())
+        print(f"Backend ready, MongoDB ping {response.json()['mongo_ping_ms']}ms")
+
+    def test_15_demand_forecast(self):
+        """Test reorder suggestions and expiry waste risk"""
+        print("\n=== Testing Demand Forecast ===")
+        
+        response = requests.post(f"{API_URL}/forecast/refresh")
+        self.assertEqual(response.status_code, 200, f"Failed to refresh forecast: {response.text}")
+        print(f"Forecast covers {response.json()['medicines']} medicines")
+        
+        response = requests.get(f"{API_URL}/forecast/reorder", params={"lead_time_days": 5, "include_all": "true"})
+        self.assertEqual(response.status_code, 200, f"Failed to get reorder suggestions: {response.text}")
+        suggestions = response.json()["medicines"]
+        for medicine in suggestions:
+            self.assertGreaterEqual(medicine["suggested_order_quantity"], 0)
+            self.assertGreaterEqual(medicine["reorder_point"], 0)
+        print(f"Retrieved {len(suggestions)} reorder suggestions")
+        
+        response = requests.get(f"{API_URL}/forecast/waste")
+        self.assertEqual(response.status_code, 200, f"Failed to get waste risk: {response.text}")
+        for medicine in response.json()["medicines"]:
+            self.assertGreater(medicine["expected_waste_units"], 0)
+        
+        response = requests.get(f"{API_URL}/forecast/reorder", params={"service_level": 1.5})
+        self.assertEqual(response.status_code, 422)
+
+    def test_16_sales_date_range(self):
+        """Test date-ranged, cursor-paged sales listing over monthly partitions"""
+        print("\n=== Testing Sales Date Range ===")
+        
+        today = datetime.utcnow().date()
+        params = {"start": today.isoformat(), "end": (today + timedelta(days=1)).isoformat(), "limit": 1}
+        response = requests.get(f"{API_URL}/sales", params=params)
+        self.assertEqual(response.status_code, 200, f"Failed to get sales: {response.text}")
+        sales = response.json()
+        for sale in sales:
+            self.assertTrue(sale["sale_date"].startswith(today.isoformat()))
+        
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor:
+            response = requests.get(f"{API_URL}/sales", params={**params, "after": cursor})
+            self.assertEqual(response.status_code, 200)
+            next_page = response.json()
+            self.assertTrue(next_page)
+            self.assertLessEqual(next_page[0]["sale_date"], sales[-1]["sale_date"])
+        
+        response = requests.get(f"{API_URL}/sales", params={"after": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_17_delta_sync(self):
+        """Test catalog delta sync with tombstones"""
+        print("\n=== Testing Delta Sync ===")
+        
+        token = None
+        while True:
+            response = requests.get(f"{API_URL}/sync", params={"token": token} if token else {})
+            self.assertEqual(response.status_code, 200, f"Failed to sync: {response.text}")
+            changes = response.json()
+            token = changes["token"]
+            if not changes["has_more"]:
+                break
+        
+        response = requests.post(f"{API_URL}/medicines", json=self.medicine_data)
+        self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+        medicine_id = response.json()["id"]
+        
+        changes = requests.get(f"{API_URL}/sync", params={"token": token}).json()
+        self.assertIn(medicine_id, [medicine["id"] for medicine in changes["medicines"]])
+        
+        response = requests.delete(f"{API_URL}/medicines/{medicine_id}")
+        self.assertEqual(response.status_code, 200)
+        changes = requests.get(f"{API_URL}/sync", params={"token": token}).json()
+        self.assertIn(medicine_id, changes["deleted"]["medicines"])
+        self.assertNotIn(medicine_id, [medicine["id"] for medicine in changes["medicines"]])
+        
+        response = requests.get(f"{API_URL}/sync", params={"token": "unknown.1"})
+        self.assertTrue(response.json()["reset"])
+
+    def test_18_bulk_update(self):
+        """Test bulk PATCH of medicines with per-item results"""
+        print("\n=== Testing Bulk Medicine Update ===")
+        
+        suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+        medicine_ids = []
+        for i in range(3):
+            response = requests.post(f"{API_URL}/medicines", json={**self.medicine_data, "batch_number": f"BULK{suffix}{i}"})
+            self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+            medicine_ids.append(response.json()["id"])
+        
+        response = requests.patch(f"{API_URL}/medicines", json=[
+            {"id": medicine_ids[0], "selling_price": 3.5},
+            {"id": medicine_ids[1], "stock_quantity": 0},
+            {"id": medicine_ids[2], "selling_price": 4.0, "stock_quantity": 25},
+            {"id": f"missing-{suffix}", "selling_price": 1.0},
+            {"id": medicine_ids[0], "selling_price": 9.0},
+        ])
+        self.assertEqual(response.status_code, 200, f"Failed to bulk update: {response.text}")
+        report = response.json()
+        print(f"Bulk update report: updated={report['updated']} failed={report['failed']}")
+        self.assertEqual(report["updated"], 3)
+        self.assertEqual([result["status"] for result in report["results"]], [200, 200, 200, 404, 400])
+        
+        medicines = [requests.get(f"{API_URL}/medicines/{medicine_id}").json() for medicine_id in medicine_ids]
+        self.assertEqual(medicines[0]["selling_price"], 3.5)
+        self.assertEqual(medicines[1]["stock_quantity"], 0)
+        self.assertEqual(medicines[2]["selling_price"], 4.0)
+        self.assertEqual(medicines[2]["stock_quantity"], 25)
+        
+        for medicine_id in medicine_ids:
+            requests.delete(f"{API_URL}/medicines/{medicine_id}")
+
+    def test_19_stock_ledger(self):
+        """Test stock movements and stock-at-time from the ledger"""
+        print("\n=== Testing Stock Ledger ===")
+        
+        suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+        response = requests.post(f"{API_URL}/medicines", json={**self.medicine_data, "stock_quantity": 10})
+        self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+        medicine_id = response.json()["id"]
+        created_at = response.json()["created_at"]
+        
+        response = requests.post(f"{API_URL}/medicines/{medicine_id}/lots", json={
+            "batch_number": f"LEDGER{suffix}B",
+            "expiry_date": (datetime.utcnow() + timedelta(days=400)).isoformat(),
+            "quantity": 5,
+            "purchase_price": 1.0
+        })
+        self.assertEqual(response.status_code, 200, f"Failed to receive lot: {response.text}")
+        response = requests.put(f"{API_URL}/medicines/{medicine_id}", json={"stock_quantity": 12})
+        self.assertEqual(response.status_code, 200, f"Failed to adjust stock: {response.text}")
+        
+        response = requests.get(f"{API_URL}/medicines/{medicine_id}/movements", params={"start": created_at})
+        self.assertEqual(response.status_code, 200, f"Failed to get movements: {response.text}")
+        report = response.json()
+        print(f"Movements: {report['totals']}")
+        self.assertEqual(report["closing_stock"], 12)
+        self.assertEqual(report["totals"]["restock"]["quantity"], 15)
+        self.assertEqual(report["totals"]["adjustment"]["quantity"], -3)
+        
+        response = requests.get(f"{API_URL}/medicines/{medicine_id}/stock", params={"at": datetime.utcnow().isoformat()})
+        self.assertEqual(response.status_code, 200, f"Failed to get stock at time: {response.text}")
+        self.assertEqual(response.json()["stock_quantity"], 12)
+        
+        requests.delete(f"{API_URL}/medicines/{medicine_id}")
+
+    def test_20_inventory_valuation(self):
+        """Test inventory valuation and margin report"""
+        print("\n=== Testing Inventory Valuation ===")
+        
+        suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+        category = f"Valuation {suffix}"
+        response = requests.post(f"{API_URL}/medicines", json={
+            **self.medicine_data,
+            "category": category,
+            "purchase_price": 2.0,
+            "selling_price": 5.0,
+            "stock_quantity": 10
+        })
+        self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+        medicine_id = response.json()["id"]
+        
+        response = requests.get(f"{API_URL}/reports/inventory-valuation")
+        self.assertEqual(response.status_code, 200, f"Failed to get valuation: {response.text}")
+        report = response.json()
+        print(f"Inventory totals: {report['totals']}")
+        for grouping in ("by_category", "by_manufacturer", "by_form"):
+            self.assertIn(grouping, report)
+        rows = [row for row in report["by_category"] if row["category"] == category]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["cost_value"], 20.0)
+        self.assertEqual(rows[0]["retail_value"], 50.0)
+        self.assertEqual(rows[0]["gross_margin"], 30.0)
+        self.assertEqual(rows[0]["margin_percent"], 60.0)
+        self.assertIsNotNone(report["loaded_at"], "Valuation report does not say when its copy was loaded")
+        
+        # Each lot is valued at the price it was bought at
+        response = requests.post(f"{API_URL}/medicines/{medicine_id}/lots", json={
+            "batch_number": f"VAL{suffix}-2",
+            "expiry_date": (datetime.utcnow() + timedelta(days=400)).isoformat(),
+            "quantity": 5,
+            "purchase_price": 3.0
+        })
+        self.assertEqual(response.status_code, 200, f"Failed to receive lot: {response.text}")
+        report = requests.get(f"{API_URL}/reports/inventory-valuation").json()
+        rows = [row for row in report["by_category"] if row["category"] == category]
+        self.assertEqual(rows[0]["cost_value"], 35.0)
+        self.assertEqual(rows[0]["retail_value"], 75.0)
+        
+        requests.delete(f"{API_URL}/medicines/{medicine_id}")
+
+    def test_21_negative_stock_rejected(self):
+        """Test that a negative stock quantity is rejected instead of failing the write"""
+        print("\n=== Testing Negative Stock Validation ===")
+        
+        response = requests.post(f"{API_URL}/medicines", json={**self.medicine_data, "stock_quantity": -1})
+        self.assertEqual(response.status_code, 422, "Negative stock on create was not rejected")
+        
+        response = requests.post(f"{API_URL}/medicines", json=self.medicine_data)
+        self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+        medicine_id = response.json()["id"]
+        
+        response = requests.put(f"{API_URL}/medicines/{medicine_id}", json={"stock_quantity": -5})
+        self.assertEqual(response.status_code, 422, "Negative stock on update was not rejected")
+        response = requests.get(f"{API_URL}/medicines/{medicine_id}")
+        self.assertEqual(response.json()["stock_quantity"], self.medicine_data["stock_quantity"])
+        
+        requests.delete(f"{API_URL}/medicines/{medicine_id}")
+
+    def test_22_search_prefix_typo_and_updates(self):
+        """Test prefix and typo-tolerant search, and that the index follows writes"""
+        print("\n=== Testing Search Index ===")
+        
+        term = ''.join(random.choices(string.ascii_lowercase, k=10))
+        response = requests.post(f"{API_URL}/medicines", json={**self.medicine_data, "name": f"Indexed {term}"})
+        self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+        medicine_id = response.json()["id"]
+        
+        def found(query):
+            response = requests.get(f"{API_URL}/search/medicines", params={"q": query})
+            self.assertEqual(response.status_code, 200, f"Failed to search medicines: {response.text}")
+            return medicine_id in [result["id"] for result in response.json()]
+        
+        self.assertTrue(found(term[:5]), "Prefix search missed the medicine")
+        typo = term[:4] + ("a" if term[4] != "a" else "b") + term[5:]
+        self.assertTrue(found(typo), "Search with a one-letter typo missed the medicine")
+        
+        renamed = ''.join(random.choices(string.ascii_lowercase, k=10))
+        response = requests.put(f"{API_URL}/medicines/{medicine_id}", json={"name": f"Indexed {renamed}"})
+        self.assertEqual(response.status_code, 200, f"Failed to rename medicine: {response.text}")
+        self.assertTrue(found(renamed), "Renamed medicine not found under its new name")
+        self.assertFalse(found(term), "Renamed medicine still found under its old name")
+        
+        requests.delete(f"{API_URL}/medicines/{medicine_id}")
+        self.assertFalse(found(renamed), "Deleted medicine still returned by search")
+
+    def test_23_catalog_import(self):
+        """Test CSV import reporting inserted, updated and failed rows"""
+        print("\n=== Testing Catalog Import ===")
+        
+        columns = list(self.medicine_data)
+        suffix = ''.join(random.choices(string.ascii_uppercase, k=6))
+        rows = [{**self.medicine_data, "batch_number": f"IMPORT{suffix}{i}"} for i in range(2)]
+        invalid = {**self.medicine_data, "batch_number": f"IMPORT{suffix}X", "stock_quantity": "many"}
+        
+        def upload(rows, mode):
+            lines = [",".join(columns)] + [",".join(str(row[column]) for column in columns) for row in rows]
+            response = requests.post(
+                f"{API_URL}/medicines/import",
+                params={"mode": mode},
+                files={"file": ("catalog.csv", "\n".join(lines).encode(), "text/csv")},
+            )
+            self.assertEqual(response.status_code, 200, f"Failed to import medicines: {response.text}")
+            return response.json()
+        
+        report = upload(rows + [invalid], "insert")
+        self.assertEqual((report["processed"], report["inserted"], report["failed"]), (3, 2, 1))
+        self.assertEqual(report["errors"][0]["row"], 4, "Error not reported against the bad CSV row")
+        
+        # Upsert matches on batch_number instead of adding duplicates
+        report = upload([{**rows[0], "stock_quantity": 7}], "upsert")
+        self.assertEqual((report["inserted"], report["updated"], report["failed"]), (0, 1, 0))
+        
+        response = requests.get(f"{API_URL}/medicines", params={"stream": "true"}, stream=True)
+        medicines = [json.loads(line) for line in response.iter_lines() if line]
+        imported = {m["batch_number"]: m for m in medicines if m["batch_number"].startswith(f"IMPORT{suffix}")}
+        self.created_resources["medicines"].extend(m["id"] for m in imported.values())
+        self.assertEqual(sorted(imported), [row["batch_number"] for row in rows])
+        self.assertEqual(imported[rows[0]["batch_number"]]["stock_quantity"], 7)
+        print("Import report and upserts behave as expected")
+
+    def test_24_sales_export(self):
+        """Test CSV export of a date range with one row per sale line"""
+        print("\n=== Testing Sales Export ===")
+        
+        response = requests.post(f"{API_URL}/medicines", json=self.medicine_data)
+        self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+        medicine = response.json()
+        self.created_resources["medicines"].append(medicine["id"])
+        
+        response = requests.post(f"{API_URL}/sales", json=self.sale_payload(medicine, 3))
+        self.assertEqual(response.status_code, 200, f"Failed to create sale: {response.text}")
+        sale = response.json()
+        
+        window = {
+            "start": (datetime.utcnow() - timedelta(hours=1)).isoformat(),
+            "end": (datetime.utcnow() + timedelta(hours=1)).isoformat(),
+        }
+        response = requests.get(f"{API_URL}/sales/export", params=window, stream=True)
+        self.assertEqual(response.status_code, 200, f"Failed to export sales: {response.text}")
+        self.assertTrue(response.headers["Content-Type"].startswith("text/csv"))
+        rows = list(csv.DictReader(line.decode() for line in response.iter_lines()))
+        exported = [row for row in rows if row["sale_id"] == sale["id"]]
+        self.assertEqual(len(exported), 1, "Sale missing from export or exported more than once")
+        self.assertEqual(exported[0]["medicine_id"], medicine["id"])
+        self.assertEqual(int(exported[0]["quantity"]), 3)
+        self.assertAlmostEqual(float(exported[0]["total_amount"]), sale["total_amount"])
+        
+        # A range ending before the sale leaves it out
+        window["end"] = window["start"]
+        window["start"] = (datetime.utcnow() - timedelta(days=1)).isoformat()
+        response = requests.get(f"{API_URL}/sales/export", params=window)
+        self.assertNotIn(sale["id"], response.text, "Sale exported outside the requested range")
+        print(f"Exported {len(rows)} rows")
+
+    def test_25_sales_analytics(self):
+        """Test that rollups count a sale and that a rebuild keeps today's live totals"""
+        print("\n=== Testing Sales Analytics ===")
+        
+        category = f"Analytics {''.join(random.choices(string.ascii_uppercase, k=8))}"
+        response = requests.post(f"{API_URL}/medicines", json={**self.medicine_data, "category": category})
+        self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+        medicine = response.json()
+        self.created_resources["medicines"].append(medicine["id"])
+        
+        today = datetime.utcnow().date()
+        window = {"start": today.isoformat(), "end": (today + timedelta(days=1)).isoformat()}
+        
+        def snapshot():
+            response = requests.get(f"{API_URL}/analytics/sales", params=window)
+            self.assertEqual(response.status_code, 200, f"Failed to get sales series: {response.text}")
+            series = response.json()
+            response = requests.get(f"{API_URL}/analytics/top-medicines", params={**window, "limit": 1000})
+            self.assertEqual(response.status_code, 200, f"Failed to get top medicines: {response.text}")
+            top = {entry["medicine_id"]: entry for entry in response.json()}
+            response = requests.get(f"{API_URL}/analytics/categories", params=window)
+            self.assertEqual(response.status_code, 200, f"Failed to get category mix: {response.text}")
+            categories = {entry["name"]: entry for entry in response.json()}
+            return (series[0]["sales_count"] if series else 0), top, categories
+        
+        sales_before, _, _ = snapshot()
+        response = requests.post(f"{API_URL}/sales", json=self.sale_payload(medicine, 4))
+        self.assertEqual(response.status_code, 200, f"Failed to create sale: {response.text}")
+        
+        sales_after, top, categories = snapshot()
+        self.assertEqual(sales_after, sales_before + 1, "Sale not added to today's rollup")
+        self.assertEqual(top[medicine["id"]]["units"], 4)
+        self.assertAlmostEqual(top[medicine["id"]]["revenue"], 4 * medicine["selling_price"])
+        self.assertEqual(categories[category]["units"], 4)
+        
+        # Today is still open, so a rebuild must not replace it with a partial scan
+        response = requests.post(f"{API_URL}/analytics/rebuild")
+        self.assertEqual(response.status_code, 200, f"Failed to rebuild rollups: {response.text}")
+        self.assertIsInstance(response.json()["sales_scanned"], int)
+        self.assertEqual(snapshot(), (sales_after, top, categories), "Rebuild changed today's rollups")
+        print("Rollups match the recorded sale before and after a rebuild")
+
+    def test_26_request_metrics(self):
+        """Test that request latencies are labelled by route template, not raw path"""
+        print("\n=== Testing Metrics ===")
+        
+        def request_count(labels):
+            response = requests.get(f"{BACKEND_URL}/metrics")
+            self.assertEqual(response.status_code, 200, f"Failed to get metrics: {response.text}")
+            self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+            prefix = f"http_request_duration_seconds_count{{{labels}}} "
+            counts = [line[len(prefix):] for line in response.text.splitlines() if line.startswith(prefix)]
+            return float(counts[0]) if counts else 0
+        
+        route = 'method="GET",route="/api/medicines/{medicine_id}",status="404"'
+        unmatched = 'method="GET",route="unmatched",status="404"'
+        before = request_count(route), request_count(unmatched)
+        
+        for _ in range(2):
+            missing = ''.join(random.choices(string.ascii_lowercase, k=12))
+            self.assertEqual(requests.get(f"{API_URL}/medicines/{missing}").status_code, 404)
+            self.assertEqual(requests.get(f"{API_URL}/no-such-route/{missing}").status_code, 404)
+        
+        after = request_count(route), request_count(unmatched)
+        self.assertEqual(after[0] - before[0], 2, "Requests not counted under their route template")
+        self.assertEqual(after[1] - before[1], 2, "Unknown paths not counted under one label")
+        print("Request metrics are labelled by route")
+
+    def test_27_server_sent_events(self):
+        """Test that medicine writes and stock alerts are pushed, and replayed after Last-Event-ID"""
+        print("\n=== Testing Server-Sent Events ===")
+        
+        def events(response):
+            event = {}
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    field, _, value = line.partition(": ")
+                    event[field] = value
+                elif event:
+                    yield event
+                    event = {}
+        
+        def next_event(stream, event_type, medicine_id):
+            for event in stream:
+                if event.get("event") == event_type and json.loads(event["data"])["id"] == medicine_id:
+                    return event
+        
+        subscription = requests.get(f"{API_URL}/events", stream=True, timeout=30)
+        self.assertEqual(subscription.status_code, 200, "Failed to open event stream")
+        self.assertTrue(subscription.headers["Content-Type"].startswith("text/event-stream"))
+        stream = events(subscription)
+        # Sent once the subscription is registered, so later writes reach this stream
+        self.assertEqual(next(stream), {"retry": "3000"})
+        
+        response = requests.post(f"{API_URL}/medicines", json=self.medicine_data)
+        self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+        medicine = response.json()
+        self.created_resources["medicines"].append(medicine["id"])
+        created = next_event(stream, "medicine", medicine["id"])
+        self.assertEqual(json.loads(created["data"])["stock_quantity"], medicine["stock_quantity"])
+        
+        low = medicine["min_stock_level"] - 1
+        response = requests.put(f"{API_URL}/medicines/{medicine['id']}", json={"stock_quantity": low})
+        self.assertEqual(response.status_code, 200, f"Failed to update medicine: {response.text}")
+        alert = next_event(stream, "low_stock", medicine["id"])
+        self.assertEqual(json.loads(alert["data"])["stock_quantity"], low)
+        subscription.close()
+        
+        # Reconnecting after the create replays the events that followed it
+        subscription = requests.get(f"{API_URL}/events", headers={"Last-Event-ID": created["id"]}, stream=True, timeout=30)
+        replayed = events(subscription)
+        next(replayed)
+        self.assertEqual(next_event(replayed, "low_stock", medicine["id"])["id"], alert["id"])
+        subscription.close()
+        print("Events pushed and replayed as expected")
+
+    def test_28_concurrent_sales_burst(self):
+        """Test that a burst of concurrent sales decrements stock exactly, without overselling"""
+        print("\n=== Testing Concurrent Sales Burst ===")
+        
+        response = requests.post(f"{API_URL}/medicines", json=self.medicine_data)
+        self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+        medicine = response.json()
+        self.created_resources["medicines"].append(medicine["id"])
+        
+        # Asks for more than the stock, so some sales must be turned away
+        quantity, attempts = 5, 30
+        started = datetime.utcnow() - timedelta(seconds=1)
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            responses = list(pool.map(
+                lambda _: requests.post(f"{API_URL}/sales", json=self.sale_payload(medicine, quantity)),
+                range(attempts),
+            ))
+        statuses = [response.status_code for response in responses]
+        self.assertTrue(set(statuses) <= {200, 409, 503}, f"Unexpected statuses: {statuses}")
+        sold = statuses.count(200) * quantity
+        self.assertGreater(sold, 0, "No sale in the burst succeeded")
+        
+        response = requests.get(f"{API_URL}/medicines/{medicine['id']}")
+        self.assertEqual(response.status_code, 200, f"Failed to get medicine: {response.text}")
+        self.assertEqual(response.json()["stock_quantity"], medicine["stock_quantity"] - sold,
+                         "Stock does not match the accepted sales")
+        
+        sale_ids = {response.json()["id"] for response in responses if response.status_code == 200}
+        response = requests.get(f"{API_URL}/sales", params={"start": started.isoformat(), "limit": 1000})
+        self.assertTrue(sale_ids <= {sale["id"] for sale in response.json()}, "Accepted sale was not stored")
+        print(f"{statuses.count(200)} of {attempts} sales accepted, {sold} units sold")
+
+    def test_29_conditional_get_detail_and_stats(self):
+        """Test the ETag 304 round-trip on a medicine and the dashboard stats"""
+        print("\n=== Testing Conditional GET on Detail and Stats ===")
+        
+        response = requests.post(f"{API_URL}/medicines", json=self.medicine_data)
+        self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+        medicine_id = response.json()["id"]
+        self.created_resources["medicines"].append(medicine_id)
+        
+        etags = {}
+        for url in (f"{API_URL}/medicines/{medicine_id}", f"{API_URL}/dashboard/stats"):
+            response = requests.get(url)
+            self.assertEqual(response.status_code, 200, f"Failed to get {url}: {response.text}")
+            etags[url] = response.headers.get("ETag")
+            self.assertIsNotNone(etags[url], f"ETag header missing on {url}")
+            response = requests.get(url, headers={"If-None-Match": etags[url]})
+            self.assertEqual(response.status_code, 304, f"Unchanged {url} was not answered with 304")
+            self.assertEqual(response.content, b"", "304 response carried a body")
+        
+        # Both change once the medicine turns low on stock
+        response = requests.put(f"{API_URL}/medicines/{medicine_id}", json={"stock_quantity": 1})
+        self.assertEqual(response.status_code, 200, f"Failed to update medicine: {response.text}")
+        for url, etag in etags.items():
+            response = requests.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 200, f"Stale ETag on {url} was answered with 304")
+            self.assertNotEqual(response.headers.get("ETag"), etag, f"ETag on {url} did not change")
+        print("Conditional GET on detail and stats behaves as expected")
+
+    def test_30_expired_count_matches_recount(self):
+        """Test that the expired medicines counter follows expiry, write-offs and adjustments"""
+        print("\n=== Testing Expired Medicines Counter ===")
+        
+        def drift():
+            response = requests.get(f"{API_URL}/dashboard/stats")
+            self.assertEqual(response.status_code, 200, f"Failed to get dashboard stats: {response.text}")
+            counted = response.json()["expired_medicines_count"]
+            response = requests.get(f"{API_URL}/medicines/expired")
+            self.assertEqual(response.status_code, 200, f"Failed to get expired medicines: {response.text}")
+            return counted - len(response.json())
+        
+        # Other medicines may expire later today, which the recount already includes
+        baseline = drift()
+        expired_on = (datetime.utcnow() - timedelta(days=2)).isoformat()
+        response = requests.post(f"{API_URL}/medicines", json={**self.medicine_data, "expiry_date": expired_on})
+        self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+        expired = response.json()
+        self.created_resources["medicines"].append(expired["id"])
+        self.assertEqual(drift(), baseline, "Counter missed a medicine created expired")
+        
+        # Adjusting expiry in and out of the past
+        for expiry_date in ((datetime.utcnow() + timedelta(days=30)).isoformat(), expired_on):
+            response = requests.put(f"{API_URL}/medicines/{expired['id']}", json={"expiry_date": expiry_date})
+            self.assertEqual(response.status_code, 200, f"Failed to update medicine: {response.text}")
+            self.assertEqual(drift(), baseline, "Counter drifted after adjusting expiry")
+        
+        response = requests.post(f"{API_URL}/medicines/{expired['id']}/lots/write-off")
+        self.assertEqual(response.status_code, 200, f"Failed to write off lots: {response.text}")
+        self.assertEqual(drift(), baseline, "Counter drifted after a write-off")
+        
+        # Stock that expires while nobody writes the medicine, then is written off
+        expiring_on = (datetime.utcnow() + timedelta(seconds=2)).isoformat()
+        response = requests.post(f"{API_URL}/medicines", json={**self.medicine_data, "expiry_date": expiring_on})
+        self.assertEqual(response.status_code, 200, f"Failed to create medicine: {response.text}")
+        expiring = response.json()
+        self.created_resources["medicines"].append(expiring["id"])
+        time.sleep(3)
+        response = requests.post(f"{API_URL}/medicines/{expiring['id']}/lots/write-off")
+        self.assertEqual(response.status_code, 200, f"Failed to write off lots: {response.text}")
+        self.assertEqual(drift(), baseline, "Write-off took off stock that expired after it was counted")
+        print("Expired medicines counter matches a recount")
 
 def run_tests():
     """Run all tests"""
@@ -0,0 +1,389 @@
+"""Concurrent POS-like load against a local backend.
+
+Starts server.py under uvicorn against a MongoDB server (--mongo-url) or on
+the in-memory storage engine (--stand-in, STORAGE_ENGINE=memory), or targets
+a backend that is already running (--base-url). It seeds a catalog through the bulk import endpoint
+and a sales history through POST /api/sales. Then it drives concurrent
+clients through a weighted mix of search, checkout, dashboard and catalog
+reads. Latency percentiles and throughput per endpoint are printed as JSON, labelled with the storage engine the
+server reports.
+
+The in-memory engine needs mongomock-motor installed. Use it to compare two
+builds against each other, not to size production.
+
+Usage:
+  python benchmarks/load_test.py --stand-in --medicines 2000 --sales 500 --duration 30
+  python benchmarks/load_test.py --mongo-url mongodb://localhost:27017 --concurrency 32 --output run.json
+  python benchmarks/load_test.py --stand-in --baseline run.json --max-regression 0.2
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+STEMS = [
+    "Paracetamol", "Ibuprofen", "Amoxicillin", "Azithromycin", "Cetirizine", "Metformin", "Atorvastatin",
+    "Omeprazole", "Pantoprazole", "Losartan", "Amlodipine", "Salbutamol", "Montelukast", "Diclofenac",
+    "Ciprofloxacin", "Doxycycline", "Levothyroxine", "Prednisolone", "Ranitidine", "Loratadine",
+]
+FORMS = ["tablet", "capsule", "syrup", "injection", "cream"]
+CATEGORIES = ["Analgesic", "Antibiotic", "Antihistamine", "Antidiabetic", "Cardiac", "Gastro", "Respiratory"]
+MANUFACTURERS = ["Cipla", "Sun Pharma", "Pfizer", "GSK", "Novartis", "Abbott", "Lupin"]
+
+DEFAULT_MIX = "search=5,sale=2,dashboard=2,medicine=1,list=1"
+IMPORT_BATCH = 5000
+
+
+# Server process
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = {**os.environ, "DB_NAME": args.db_name}
+    if args.stand_in:
+        env["STORAGE_ENGINE"] = "memory"
+    else:
+        env["STORAGE_ENGINE"] = "mongo"
+        env["MONGO_URL"] = args.mongo_url
+    command = [
+        sys.executable, "-m", "uvicorn", "server:app",
+        "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+    ]
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+    return process, f"http://127.0.0.1:{port}"
+
+
+def wait_ready(base_url: str, process: Optional[subprocess.Popen], timeout: float) -> dict:
+    """Wait for the readiness probe and return its body."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            response = requests.get(f"{base_url}/api/health/ready", timeout=2)
+            if response.status_code == 200:
+                return response.json()
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} not ready after {timeout}s")
+
+
+# Seeding
+def make_medicine(index: int, rng: random.Random) -> dict:
+    stem = STEMS[index % len(STEMS)]
+    strength = rng.choice([5, 10, 20, 50, 100, 250, 500])
+    price = round(rng.uniform(0.5, 40), 2)
+    return {
+        "name": f"{stem} {strength}mg {index}",
+        "generic_name": stem,
+        "manufacturer": rng.choice(MANUFACTURERS),
+        "category": rng.choice(CATEGORIES),
+        "dosage": f"{strength}mg",
+        "form": rng.choice(FORMS),
+        "batch_number": f"LT{index:07d}",
+        "expiry_date": (datetime.utcnow() + timedelta(days=rng.randint(30, 900))).isoformat(),
+        "purchase_price": price,
+        "selling_price": round(price * rng.uniform(1.1, 1.6), 2),
+        # Enough stock that the run never sells out
+        "stock_quantity": 1_000_000,
+        "min_stock_level": rng.randint(5, 50),
+    }
+
+
+def seed_catalog(session: requests.Session, base_url: str, count: int, rng: random.Random):
+    for start in range(0, count, IMPORT_BATCH):
+        body = "\n".join(
+            json.dumps(make_medicine(index, rng)) for index in range(start, min(start + IMPORT_BATCH, count))
+        )
+        response = session.post(
+            f"{base_url}/api/medicines/import",
+            files={"file": ("catalog.ndjson", body.encode(), "application/x-ndjson")},
+        )
+        response.raise_for_status()
+
+
+def load_catalog(session: requests.Session, base_url: str) -> List[dict]:
+    response = session.get(f"{base_url}/api/medicines", params={"stream": "true"}, stream=True)
+    response.raise_for_status()
+    return [
+        {key: medicine[key] for key in ("id", "name", "generic_name", "selling_price")}
+        for medicine in map(json.loads, response.iter_lines())
+    ]
+
+
+def sale_payload(catalog: List[dict], rng: random.Random, max_lines: int) -> dict:
+    items = []
+    for medicine in rng.sample(catalog, min(len(catalog), rng.randint(1, max_lines))):
+        quantity = rng.randint(1, 3)
+        items.append({
+            "medicine_id": medicine["id"],
+            "medicine_name": medicine["name"],
+            "quantity": quantity,
+            "unit_price": medicine["selling_price"],
+            "total_price": round(quantity * medicine["selling_price"], 2),
+        })
+    return {
+        "items": items,
+        "subtotal": round(sum(item["total_price"] for item in items), 2),
+        "discount_percent": rng.choice([0, 0, 0, 5, 10]),
+        "tax_percent": 5,
+        "payment_method": rng.choice(["cash", "card", "upi"]),
+    }
+
+
+def seed_sales(base_url: str, catalog: List[dict], count: int, concurrency: int, seed: int, max_lines: int):
+    local = threading.local()
+
+    def post_sale(index: int):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        payload = sale_payload(catalog, random.Random(seed * 1_000_003 + index), max_lines)
+        local.session.post(f"{base_url}/api/sales", json=payload).raise_for_status()
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(post_sale, range(count)))
+
+
+# Workload
+def search_terms(catalog: List[dict], rng: random.Random) -> List[str]:
+    """Mostly prefixes of real names, some full generic names and some with a typo."""
+    terms = []
+    for medicine in rng.sample(catalog, min(len(catalog), 200)):
+        name = medicine["generic_name"].lower()
+        terms.append(name[:rng.randint(3, 6)])
+        terms.append(name)
+        position = rng.randrange(1, len(name) - 1)
+        terms.append(name[:position] + name[position + 1] + name[position] + name[position + 2:])
+    return terms
+
+
+Operation = Callable[[requests.Session, random.Random], requests.Response]
+
+
+def build_operations(base_url: str, catalog: List[dict], terms: List[str], max_lines: int) -> Dict[str, Tuple[str, Operation]]:
+    """Mix key -> (endpoint label used in the report, request)."""
+    return {
+        "search": ("GET /api/search/medicines", lambda session, rng: session.get(
+            f"{base_url}/api/search/medicines", params={"q": rng.choice(terms), "limit": 20})),
+        "sale": ("POST /api/sales", lambda session, rng: session.post(
+            f"{base_url}/api/sales", json=sale_payload(catalog, rng, max_lines))),
+        "dashboard": ("GET /api/dashboard/stats", lambda session, rng: session.get(
+            f"{base_url}/api/dashboard/stats")),
+        "medicine": ("GET /api/medicines/{id}", lambda session, rng: session.get(
+            f"{base_url}/api/medicines/{rng.choice(catalog)['id']}")),
+        "list": ("GET /api/medicines", lambda session, rng: session.get(
+            f"{base_url}/api/medicines", params={"limit": 100})),
+    }
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def run_workload(operations, weights: Dict[str, float], concurrency: int, duration: float, think: float, seed: int):
+    names = [name for name in weights if weights[name] > 0]
+    name_weights = [weights[name] for name in names]
+    samples: List[Tuple[str, float, bool]] = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(worker_id: int):
+        rng = random.Random(seed * 7919 + worker_id)
+        session = requests.Session()
+        local: List[Tuple[str, float, bool]] = []
+        while time.monotonic() < deadline:
+            label, operation = operations[rng.choices(names, weights=name_weights)[0]]
+            start = time.perf_counter()
+            try:
+                ok = operation(session, rng).status_code < 400
+            except requests.RequestException:
+                ok = False
+            local.append((label, time.perf_counter() - start, ok))
+            if think:
+                time.sleep(rng.expovariate(1 / think))
+        with lock:
+            samples.extend(local)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(worker_id,)) for worker_id in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.monotonic() - started
+
+
+# Reporting
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+def build_report(samples, elapsed: float) -> dict:
+    by_endpoint: Dict[str, Tuple[List[float], int]] = {}
+    for label, seconds, ok in samples:
+        latencies, errors = by_endpoint.setdefault(label, ([], 0))
+        latencies.append(seconds)
+        if not ok:
+            by_endpoint[label] = (latencies, errors + 1)
+    return {
+        "endpoints": {
+            label: summarize(latencies, errors, elapsed)
+            for label, (latencies, errors) in sorted(by_endpoint.items())
+        },
+        "total": summarize([seconds for _, seconds, _ in samples], sum(not ok for _, _, ok in samples), elapsed),
+    }
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> List[str]:
+    """p95 regressions beyond the allowed fraction, per endpoint present in both runs."""
+    regressions = []
+    for label, current in report["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(label)
+        if not previous or not previous["p95_ms"]:
+            continue
+        change = current["p95_ms"] / previous["p95_ms"] - 1
+        if change > max_regression:
+            regressions.append(f"{label}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms (+{change:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--mongo-url", help="start server.py against this MongoDB server")
+    target.add_argument("--stand-in", action="store_true", help="start server.py on the in-memory storage engine")
+    target.add_argument("--base-url", help="use an already running backend, e.g. http://localhost:8001")
+    parser.add_argument("--db-name", default=f"load_test_{uuid.uuid4().hex[:8]}", help="database for a started server")
+    parser.add_argument("--keep-db", action="store_true", help="do not drop the database of a started server")
+    parser.add_argument("--medicines", type=int, default=2000)
+    parser.add_argument("--sales", type=int, default=500)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the data already in the target")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds of unmeasured load first")
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between a client's requests")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--max-lines", type=int, default=4, help="most line items per sale")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--output", help="also write the JSON report here")
+    parser.add_argument("--baseline", help="earlier report to compare p95 latencies against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed p95 increase over the baseline")
+    args = parser.parse_args()
+
+    if not (args.mongo_url or args.stand_in or args.base_url):
+        parser.error("one of --mongo-url, --stand-in or --base-url is required")
+
+    weights = parse_mix(args.mix)
+    process = None
+    base_url = args.base_url
+    if base_url is None:
+        process, base_url = start_server(args)
+    try:
+        ready = wait_ready(base_url, process, args.startup_timeout)
+        rng = random.Random(args.seed)
+        session = requests.Session()
+
+        seed_started = time.monotonic()
+        if not args.skip_seed:
+            seed_catalog(session, base_url, args.medicines, rng)
+        catalog = load_catalog(session, base_url)
+        if not catalog:
+            raise RuntimeError("The catalog is empty, nothing to load test")
+        if not args.skip_seed:
+            seed_sales(base_url, catalog, args.sales, args.concurrency, args.seed, args.max_lines)
+        seed_seconds = time.monotonic() - seed_started
+
+        operations = build_operations(base_url, catalog, search_terms(catalog, rng), args.max_lines)
+        unknown = set(weights) - set(operations)
+        if unknown:
+            parser.error(f"unknown operations in --mix: {', '.join(sorted(unknown))}")
+        if args.warmup:
+            run_workload(operations, weights, args.concurrency, args.warmup, args.think_ms / 1000, args.seed + 1)
+        samples, elapsed = run_workload(operations, weights, args.concurrency, args.duration, args.think_ms / 1000, args.seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+            if args.mongo_url and not args.keep_db:
+                from pymongo import MongoClient
+
+                with MongoClient(args.mongo_url) as mongo:
+                    mongo.drop_database(args.db_name)
+
+    report = {
+        "config": {
+            "target": "stand-in" if args.stand_in else "mongodb" if args.mongo_url else base_url,
+            # Reported by the server, so runs on different engines are told apart in comparisons
+            "storage_engine": ready.get("storage_engine"),
+            "medicines": len(catalog),
+            "seeded_sales": 0 if args.skip_seed else args.sales,
+            "concurrency": args.concurrency,
+            "duration_seconds": args.duration,
+            "think_ms": args.think_ms,
+            "mix": weights,
+            "seed": args.seed,
+        },
+        "seed_seconds": round(seed_seconds, 2),
+        "elapsed_seconds": round(elapsed, 2),
+        **build_report(samples, elapsed),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        baseline_engine = baseline.get("config", {}).get("storage_engine")
+        if baseline_engine != report["config"]["storage_engine"]:
+            print(f"Comparing a {report['config']['storage_engine']} run against a {baseline_engine} baseline", file=sys.stderr)
+        regressions = compare(report, baseline, args.max_regression)
+        if regressions:
+            print("p95 regressions:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Per-document cost of serializing a medicine list response.
+
+Compares the previous path (build Medicine(**doc), let FastAPI re-validate it
+through response_model and encode with json) with the current one (documents
+projected to the model fields in the query, encoded directly with orjson).
+
+Usage: python benchmarks/serialization.py [--documents 10000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+
+import orjson
+from pydantic import TypeAdapter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+from server import MEDICINE_PROJECTION, Medicine  # noqa: E402
+
+
+def make_documents(count: int) -> List[dict]:
+    now = datetime.utcnow().replace(microsecond=0)
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"Medicine {i}",
+            "generic_name": f"Generic {i % 500}",
+            "manufacturer": f"Manufacturer {i % 50}",
+            "category": f"Category {i % 20}",
+            "dosage": "500mg",
+            "form": "tablet",
+            "batch_number": f"B{i:06d}",
+            "expiry_date": now + timedelta(days=i % 720),
+            "purchase_price": 1.25 + i % 10,
+            "selling_price": 2.5 + i % 10,
+            "stock_quantity": i % 300,
+            "min_stock_level": 20,
+            "lots": [
+                {
+                    "lot_id": str(uuid.uuid4()),
+                    "batch_number": f"B{i:06d}",
+                    "expiry_date": now + timedelta(days=i % 720),
+                    "quantity": i % 300,
+                    "purchase_price": 1.25 + i % 10,
+                    "received_at": now,
+                }
+            ],
+            "created_at": now,
+            "updated_at": now,
+        }
+        for i in range(count)
+    ]
+
+
+def previous_path(docs: List[dict], adapter: TypeAdapter) -> bytes:
+    # Route body, then FastAPI's response_model handling and JSONResponse
+    medicines = [Medicine(**doc) for doc in docs]
+    dumped = [medicine.model_dump() for medicine in medicines]
+    validated = adapter.validate_python(dumped)
+    content = adapter.dump_python(validated, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def current_path(docs: List[dict]) -> bytes:
+    return orjson.dumps(docs)
+
+
+def best_of(repeat: int, func, *args) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    docs = make_documents(args.documents)
+    projected = [{field: doc[field] for field in MEDICINE_PROJECTION if field in doc} for doc in docs]
+    adapter = TypeAdapter(List[Medicine])
+
+    assert json.loads(previous_path(docs, adapter)) == json.loads(current_path(projected))
+
+    previous = best_of(args.repeat, previous_path, docs, adapter)
+    current = best_of(args.repeat, current_path, projected)
+    print(json.dumps({
+        "documents": args.documents,
+        "previous_total_ms": round(previous * 1000, 2),
+        "current_total_ms": round(current * 1000, 2),
+        "previous_per_document_us": round(previous / args.documents * 1e6, 3),
+        "current_per_document_us": round(current / args.documents * 1e6, 3),
+        "speedup": round(previous / current, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,19 @@ import axios from "axios";
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Local replica of the catalog, kept current from /api/sync deltas
+const REPLICA_KEY = 'pharmacare.replica';
+const SYNCED = ['medicines', 'customers', 'suppliers'];
+const SYNC_INTERVAL_MS = 30000;
+const emptyReplica = () => ({ token: null, medicines: {}, customers: {}, suppliers: {} });
+const loadReplica = () => {
+  try {
+    return JSON.parse(localStorage.getItem(REPLICA_KEY)) || emptyReplica();
+  } catch (error) {
+    return emptyReplica();
+  }
+};
+
 // Main App Component
 function App() {
   const [currentView, setCurrentView] = useState('dashboard');
@@ -13,6 +26,7 @@ function App() {
   const [sales, setSales] = useState([]);
   const [suppliers, setSuppliers] = useState([]);
   const [dashboardStats, setDashboardStats] = useState({});
+  const [valuation, setValuation] = useState(null);
   const [searchQuery, setSearchQuery] = useState('');
 
   // Fetch data functions
@@ -61,6 +75,40 @@ function App() {
     }
   };
 
+  const fetchValuation = async () => {
+    try {
+      const response = await axios.get(`${API}/reports/inventory-valuation`);
+      setValuation(response.data);
+    } catch (error) {
+      console.error('Error fetching inventory valuation:', error);
+    }
+  };
+
+  // Pulls only what changed since the last sync; if the backend is unreachable the saved replica is shown
+  const syncCatalog = async () => {
+    let replica = loadReplica();
+    try {
+      let hasMore = true;
+      while (hasMore) {
+        const response = await axios.get(`${API}/sync`, { params: replica.token ? { token: replica.token } : {} });
+        const changes = response.data;
+        if (changes.reset) replica = emptyReplica();
+        SYNCED.forEach((name) => {
+          changes[name].forEach((item) => { replica[name][item.id] = item; });
+          changes.deleted[name].forEach((id) => { delete replica[name][id]; });
+        });
+        replica.token = changes.token;
+        hasMore = changes.has_more;
+      }
+      localStorage.setItem(REPLICA_KEY, JSON.stringify(replica));
+    } catch (error) {
+      console.error('Error syncing catalog, showing the local copy:', error);
+    }
+    setMedicines(Object.values(replica.medicines));
+    setCustomers(Object.values(replica.customers));
+    setSuppliers(Object.values(replica.suppliers));
+  };
+
   const searchMedicines = async (query) => {
     if (!query.trim()) {
       fetchMedicines();
@@ -76,10 +124,40 @@ function App() {
 
   useEffect(() => {
     fetchDashboardStats();
-    fetchMedicines();
-    fetchCustomers();
+    syncCatalog();
     fetchSales();
-    fetchSuppliers();
+    const timer = setInterval(syncCatalog, SYNC_INTERVAL_MS);
+    return () => clearInterval(timer);
+  }, []);
+
+  // Computed from an in-memory copy of the catalog, cheap enough to refresh on every visit
+  useEffect(() => {
+    if (currentView === 'dashboard') fetchValuation();
+  }, [currentView]);
+
+  // Changes pushed by the backend, so open terminals stay current without polling
+  useEffect(() => {
+    const source = new EventSource(`${API}/events`);
+    const on = (type, handler) => source.addEventListener(type, (event) => handler(JSON.parse(event.data)));
+    const upsertById = (items, item) => {
+      const index = items.findIndex((existing) => existing.id === item.id);
+      if (index === -1) return [...items, item];
+      const next = [...items];
+      next[index] = item;
+      return next;
+    };
+
+    on('stats', setDashboardStats);
+    on('medicine', (medicine) => setMedicines((current) => upsertById(current, medicine)));
+    on('medicine_deleted', ({ id }) => setMedicines((current) => current.filter((medicine) => medicine.id !== id)));
+    on('sale', (sale) => setSales((current) => upsertById(current, sale)));
+    on('catalog_reloaded', () => syncCatalog());
+    on('resync', () => {
+      fetchDashboardStats();
+      syncCatalog();
+      fetchSales();
+    });
+    return () => source.close();
   }, []);
 
   // Navigation Component
@@ -146,6 +224,39 @@ function App() {
         </div>
       </div>
       
+      {valuation && (
+        <div className="mt-8 bg-white rounded-lg shadow-md p-6">
+          <h3 className="text-xl font-semibold mb-4 text-gray-800">Inventory Value</h3>
+          <div className="grid grid-cols-1 md:grid-cols-3 gap-4 mb-4">
+            <div>
+              <p className="text-sm text-gray-600">At Cost</p>
+              <p className="text-2xl font-bold">${valuation.totals.cost_value.toFixed(2)}</p>
+            </div>
+            <div>
+              <p className="text-sm text-gray-600">At Retail</p>
+              <p className="text-2xl font-bold">${valuation.totals.retail_value.toFixed(2)}</p>
+            </div>
+            <div>
+              <p className="text-sm text-gray-600">Gross Margin</p>
+              <p className="text-2xl font-bold text-green-600">
+                ${valuation.totals.gross_margin.toFixed(2)} ({valuation.totals.margin_percent ?? 0}%)
+              </p>
+            </div>
+          </div>
+          <div className="space-y-2">
+            {valuation.by_category.slice(0, 5).map((row) => (
+              <div key={row.category} className="flex justify-between items-center p-3 bg-gray-50 rounded">
+                <div>
+                  <p className="font-medium">{row.category}</p>
+                  <p className="text-sm text-gray-600">{row.skus} medicines, {row.units} units</p>
+                </div>
+                <p className="font-bold">${row.retail_value.toFixed(2)} <span className="text-sm text-green-600">{row.margin_percent ?? 0}%</span></p>
+              </div>
+            ))}
+          </div>
+        </div>
+      )}
+      
       <div className="mt-8 grid grid-cols-1 lg:grid-cols-2 gap-6">
         <div className="bg-white rounded-lg shadow-md p-6">
           <h3 className="text-xl font-semibold mb-4 text-gray-800">Recent Sales</h3>
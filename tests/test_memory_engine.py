@@ -0,0 +1,58 @@
+"""Runs the API suite in backend_test.py against a local server on the in-memory storage engine.
+
+No MongoDB server or deployed backend is needed, only the packages in
+backend/requirements-dev.txt:
+
+    pip install -r backend/requirements-dev.txt
+    python -m pytest -q tests
+"""
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "backend"))
+sys.path.insert(0, str(ROOT))
+os.environ["STORAGE_ENGINE"] = "memory"
+os.environ.setdefault("DB_NAME", "pharmacy_test")
+
+pytest.importorskip("mongomock_motor")
+
+import uvicorn  # noqa: E402
+
+import backend_test  # noqa: E402
+import server  # noqa: E402
+
+STARTUP_TIMEOUT_SECONDS = 30
+
+
+class MemoryEngineAPITest(backend_test.PharmacyAPITest):
+    """The suite over real HTTP, so streamed responses such as SSE work as deployed."""
+
+    @classmethod
+    def setUpClass(cls):
+        assert server.storage.engine == "memory"
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        cls.server = uvicorn.Server(uvicorn.Config(server.app, log_level="warning"))
+        cls.thread = threading.Thread(target=cls.server.run, kwargs={"sockets": [sock]}, daemon=True)
+        cls.thread.start()
+        deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+        while not cls.server.started:
+            if time.monotonic() > deadline or not cls.thread.is_alive():
+                raise RuntimeError("Test server did not start")
+            time.sleep(0.05)
+        cls.urls = backend_test.BACKEND_URL, backend_test.API_URL
+        backend_test.BACKEND_URL = "http://127.0.0.1:%d" % sock.getsockname()[1]
+        backend_test.API_URL = f"{backend_test.BACKEND_URL}/api"
+
+    @classmethod
+    def tearDownClass(cls):
+        backend_test.BACKEND_URL, backend_test.API_URL = cls.urls
+        cls.server.should_exit = True
+        cls.thread.join(STARTUP_TIMEOUT_SECONDS)
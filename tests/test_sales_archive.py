@@ -0,0 +1,80 @@
+"""Archiving of old sales months: claims, leases and reads over archived months.
+
+Archiving runs as a background job on every worker with no API route, so it
+is driven here directly against the in-memory storage engine.
+"""
+import sys
+import unittest
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "backend"))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from indexes import IndexManager  # noqa: E402
+from sales_partitions import ARCHIVED, ARCHIVING, SalesPartitions, month_key  # noqa: E402
+
+MONTH = datetime(2020, 1, 1)
+DAYS, SALES_PER_DAY = 3, 2
+
+
+class SalesArchiveTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = mongomock_motor.AsyncMongoMockClient()[f"archive_{uuid.uuid4().hex}"]
+        self.partitions = self.worker()
+        await self.partitions.insert_many([
+            {"id": f"{day}-{i}", "sale_date": MONTH + timedelta(days=day, hours=i), "total_amount": 10.0}
+            for day in range(DAYS)
+            for i in range(SALES_PER_DAY)
+        ])
+        self.key = month_key(MONTH.date())
+
+    def worker(self) -> SalesPartitions:
+        return SalesPartitions(self.db, IndexManager(self.db), hot_months=1, compress_archive=False)
+
+    async def catalog_entry(self):
+        return await self.db.sales_partitions.find_one({"_id": self.key})
+
+    async def read_back(self, partitions: SalesPartitions):
+        end = MONTH + timedelta(days=31)
+        ids = [sale["id"] async for sale in partitions.iter_sales(MONTH, end, newest_first=False)]
+        totals = await partitions.aggregate(MONTH, end, [{"$group": {"_id": None, "revenue": {"$sum": "$total_amount"}}}])
+        return ids, totals[0]["revenue"] if totals else 0
+
+    async def test_archived_month_reads_back_the_same(self):
+        before = await self.read_back(self.partitions)
+        self.assertEqual(await self.partitions.archive_old_months(), DAYS * SALES_PER_DAY)
+        self.assertEqual((await self.catalog_entry())["state"], ARCHIVED)
+        self.assertNotIn("sales_2020_01", await self.db.list_collection_names())
+        self.assertEqual(await self.read_back(self.worker()), before)
+
+    async def test_live_claim_is_left_alone_until_its_lease_lapses(self):
+        await self.db.sales_partitions.update_one({"_id": self.key}, {"$set": {
+            "state": ARCHIVING, "owner": "other", "lease_until": datetime.utcnow() + timedelta(minutes=5),
+        }})
+        await self.db.sales_archive.insert_one({"_id": "stale", "month": self.key, "owner": "other", "sales_count": 1, "sales": []})
+        self.assertEqual(await self.partitions.archive_month(self.key), 0)
+        self.assertEqual((await self.catalog_entry())["owner"], "other")
+
+        await self.db.sales_partitions.update_one({"_id": self.key}, {"$set": {"lease_until": datetime.utcnow()}})
+        self.assertEqual(await self.partitions.archive_month(self.key), DAYS * SALES_PER_DAY)
+        self.assertEqual((await self.catalog_entry())["state"], ARCHIVED)
+        self.assertIsNone(await self.db.sales_archive.find_one({"_id": "stale"}), "Lapsed claim's buckets were kept")
+
+    async def test_worker_stops_once_its_claim_is_taken_over(self):
+        insert_bucket = self.partitions.archive.insert_one
+
+        async def taken_over_after_first_bucket(doc):
+            await insert_bucket(doc)
+            await self.db.sales_partitions.update_one({"_id": self.key}, {"$set": {"owner": "other"}})
+
+        self.partitions.archive.insert_one = taken_over_after_first_bucket
+        self.assertEqual(await self.partitions.archive_month(self.key), 0)
+        self.assertEqual(await self.db.sales_archive.count_documents({}), 1, "Kept copying after losing the claim")
+        self.assertEqual((await self.catalog_entry())["state"], ARCHIVING)
+        self.assertIn("sales_2020_01", await self.db.list_collection_names())